@@ -0,0 +1,207 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+from blocks import instance_profiles
+from geometry_store import GeometryStore, KIND_NAMES
+from geometry_file import GEOMETRY_EXTENSION, GeometryFile
+from parse_cache import ParseCache
+from profile_engine import concatenate_profiles, find_profiles, run_areas2, run_lengths
+from tessellate import DEFAULT_CHORD_TOLERANCE, tessellate_runs
+
+# Headless counterpart of the viewer: runs the same streaming parser and
+# profile detection over many files with a process pool and writes one
+# record per file. Nothing here may import PyQt5, the nightly machines
+# have no display.
+#
+#   python batch.py drawings/ 'archive/**/*.dxf' -o results.jsonl -j 16
+
+
+def expand_inputs(inputs, recursive=False):
+    # Files named by paths, directories and glob patterns, without duplicates
+    files = []
+    for item in inputs:
+        if os.path.isdir(item):
+            pattern = os.path.join(item, '**', '*.dxf') if recursive else os.path.join(item, '*.dxf')
+            matches = []
+            for extension in ('dxf', 'DXF', GEOMETRY_EXTENSION[1:]):
+                matches += glob.glob(pattern[:-3] + extension, recursive=recursive)
+        elif glob.has_magic(item):
+            matches = glob.glob(item, recursive=True)
+        else:
+            matches = [item]
+        files.extend(os.path.normpath(m) for m in sorted(matches) if os.path.isfile(m) or m == item)
+    return list(dict.fromkeys(files))
+
+
+def process_file(filename, tolerance=1e-3, layers=None, with_profiles=False, cache_dir=None):
+    # Statistics of one drawing as a JSON friendly dict. Failures are
+    # reported in the record so one bad file does not stop a whole run.
+    record = {'file': filename}
+    start = time.perf_counter()
+    try:
+        record['size'] = os.path.getsize(filename)
+        cache = ParseCache(cache_dir) if cache_dir and not filename.lower().endswith(GEOMETRY_EXTENSION) else None
+        cached = cache.load(filename, tolerance, layers) if cache is not None else None
+        if filename.lower().endswith(GEOMETRY_EXTENSION):
+            # Already processed, used in place from the mapped file
+            geometry = GeometryFile(filename)
+            profiles = geometry.profiles()
+            store = geometry.store() or GeometryStore(layers=geometry.layers)
+        elif cached is not None:
+            store, profiles = cached
+        else:
+            store = GeometryStore.from_file(filename, layers=layers)
+            profiles = find_profiles(store, tolerance)
+            if cache is not None:
+                cache.save(filename, tolerance, store, profiles, layers)
+        # Every placed block copy counts like profiles drawn in place
+        layer_names, instances, placed = list(store.layers), None, None
+        if len(store.instances) and not filename.lower().endswith(GEOMETRY_EXTENSION):
+            placed, layer_names, instances = instance_profiles(filename, store, tolerance)
+            profiles = concatenate_profiles([profiles, placed])
+    except Exception as e:
+        record['error'] = f"{type(e).__name__}: {e}"
+        record['seconds'] = round(time.perf_counter() - start, 6)
+        return record
+
+    areas = np.abs(run_areas2(profiles.vertices, profiles.offsets, profiles.closed)) / 2.0
+    lengths = run_lengths(profiles.vertices, profiles.offsets, profiles.closed)
+    closed = profiles.closed
+    bounds = store.bounds()
+    if placed is not None and len(placed.vertices):
+        points, _ = tessellate_runs(placed.vertices, placed.offsets, placed.closed, DEFAULT_CHORD_TOLERANCE)
+        low, high = points.min(axis=0), points.max(axis=0)
+        if bounds is not None:
+            low, high = np.minimum(low, bounds[:2]), np.maximum(high, bounds[2:])
+        bounds = (low[0], low[1], high[0], high[1])
+
+    record['entities'] = {name.lower(): int(c) for name, c in zip(KIND_NAMES, store.counts())}
+    record['inserts'] = len(store.instances)
+    record['instances'] = 0 if instances is None else len(instances)
+    record['layers'] = layer_names
+    record['bounds'] = None if bounds is None else [float(v) for v in bounds]
+    record['closed_profiles'] = profiles.loop_count()
+    record['open_chains'] = profiles.chain_count()
+    record['dangling'] = len(profiles.dangling)
+    record['closed_area'] = float(areas[closed].sum())
+    record['closed_length'] = float(lengths[closed].sum())
+    record['open_length'] = float(lengths[~closed].sum())
+    if with_profiles:
+        record['profiles'] = [
+            {'closed': bool(c), 'layer': layer_names[layer] if layer < len(layer_names) else None,
+             'vertices': int(n), 'area': float(a) if c else 0.0, 'length': float(l)}
+            for c, layer, n, a, l in zip(closed.tolist(), profiles.layers.tolist(),
+                                         np.diff(profiles.offsets).tolist(), areas.tolist(), lengths.tolist())]
+    record['seconds'] = round(time.perf_counter() - start, 6)
+    return record
+
+
+def _process(job):
+    return process_file(*job)
+
+
+class JsonLinesWriter:
+    def __init__(self, output):
+        self._file = sys.stdout if output == '-' else open(output, 'w', encoding='utf-8')
+
+    def write(self, record):
+        self._file.write(json.dumps(record) + '\n')
+
+    def close(self):
+        if self._file is sys.stdout:
+            self._file.flush()
+        else:
+            self._file.close()
+
+
+class ParquetWriter:
+    # Nested values (entity counts, layers, profiles) are stored as JSON
+    # strings so every file shares one flat schema
+    columns = ('file', 'size', 'error', 'entities', 'inserts', 'instances', 'layers', 'bounds', 'closed_profiles',
+               'open_chains', 'dangling', 'closed_area', 'closed_length', 'open_length', 'profiles', 'seconds')
+    nested = ('entities', 'layers', 'bounds', 'profiles')
+
+    def __init__(self, output):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise SystemExit("Parquet output needs pyarrow (pip install pyarrow), use JSON Lines otherwise")
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+        self._output = output
+        self._rows = []
+
+    def write(self, record):
+        self._rows.append({name: json.dumps(record[name]) if name in self.nested and name in record
+                           else record.get(name) for name in self.columns})
+
+    def close(self):
+        table = self._pa.Table.from_pylist(self._rows)
+        self._pq.write_table(table, self._output)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Detect profiles and compute statistics for many DXF files.")
+    parser.add_argument('inputs', nargs='+', help=f"DXF or {GEOMETRY_EXTENSION} files, directories or glob patterns")
+    parser.add_argument('-o', '--output', default='-', help="output file, '-' for stdout (default)")
+    parser.add_argument('-f', '--format', choices=('jsonl', 'parquet'),
+                        help="output format, guessed from the output extension by default")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument('-r', '--recursive', action='store_true', help="also search subdirectories")
+    parser.add_argument('--tolerance', type=float, default=1e-3, help="endpoint snapping tolerance")
+    parser.add_argument('--layers', nargs='+', help="only read entities on these layers")
+    parser.add_argument('--profiles', action='store_true', help="include per profile records")
+    parser.add_argument('--cache', metavar='DIR', help="reuse parsed drawings cached in DIR")
+    parser.add_argument('-q', '--quiet', action='store_true', help="no progress on stderr")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    files = expand_inputs(args.inputs, args.recursive)
+    if not files:
+        print("No DXF files found", file=sys.stderr)
+        return 1
+
+    fmt = args.format or ('parquet' if args.output.endswith('.parquet') else 'jsonl')
+    writer = ParquetWriter(args.output) if fmt == 'parquet' else JsonLinesWriter(args.output)
+
+    # Largest files first so a big drawing does not start last and hold up the run
+    sizes = {f: os.path.getsize(f) if os.path.isfile(f) else 0 for f in files}
+    files.sort(key=sizes.get, reverse=True)
+    jobs = [(f, args.tolerance, args.layers, args.profiles, args.cache) for f in files]
+
+    start = time.perf_counter()
+    failed = 0
+    try:
+        if args.jobs <= 1:
+            results = map(_process, jobs)
+            pool = None
+        else:
+            pool = Pool(min(args.jobs, len(jobs)))
+            results = pool.imap_unordered(_process, jobs)
+        for done, record in enumerate(results, 1):
+            failed += 'error' in record
+            writer.write(record)
+            if not args.quiet:
+                print(f"\r{done}/{len(jobs)} files, {failed} failed", end='', file=sys.stderr)
+        if pool is not None:
+            pool.close()
+            pool.join()
+    finally:
+        writer.close()
+    if not args.quiet:
+        print(f"\n{len(jobs)} files in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
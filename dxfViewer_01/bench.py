@@ -0,0 +1,324 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from blocks import instance_profiles
+from dxf_writer import save_incremental, write_dxf
+from geometry_store import GeometryStore
+from nesting import nest, polygons_area
+from parallel_profiles import find_profiles_parallel
+from profile_engine import concatenate_profiles, find_profiles
+from synthetic_dxf import GENERATORS, cached_drawing
+from tessellate import DEFAULT_CHORD_TOLERANCE, tessellate_runs
+from measure import check_drawing, entity_measures, profile_measures
+from toolpath import plan_toolpath
+
+# Benchmarks of the load, convert and render pipeline on synthetic drawings.
+# Every (kind, size) drawing is timed stage by stage and the results are
+# written as JSON so runs can be compared:
+#
+#   python bench.py --sizes 1000 100000 -o results/today.json
+#   python bench.py --sizes 1000 100000 --compare results/yesterday.json
+#
+# The Qt stages (items, render, snap, pick) run on the offscreen platform
+# and are skipped with --no-qt. Items are only built for the first
+# --max-items profiles, a 10M entity scene would not fit in memory anyway.
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+
+
+def best_of(repeat, func):
+    # Fastest of repeat runs and the result of the last one
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_pipeline(filename, repeat=1, jobs=1):
+    # Parsing, profile detection (serial and over jobs processes), block
+    # instances and tessellation, no Qt involved
+    results = {}
+    results['parse'], store = best_of(repeat, lambda: GeometryStore.from_file(filename))
+    results['profiles'], profiles = best_of(repeat, lambda: find_profiles(store))
+    if jobs > 1:
+        # The pool is started outside the timing
+        find_profiles_parallel(store, jobs=jobs, min_entities=0)
+        results['profiles_parallel'], _ = best_of(
+            repeat, lambda: find_profiles_parallel(store, jobs=jobs, min_entities=0))
+    # Block copies count like profiles drawn in place, each block detected once
+    detected, instances = profiles, None
+    if len(store.instances):
+        results['instances'], (placed, _, instances) = best_of(repeat, lambda: instance_profiles(filename, store))
+        detected = concatenate_profiles([profiles, placed])
+    results['tessellate'], (points, offsets) = best_of(
+        repeat, lambda: tessellate_runs(detected.vertices, detected.offsets, detected.closed, DEFAULT_CHORD_TOLERANCE))
+    # Saving with one profile in a hundred moved, copied through and written anew
+    moved = np.tile(((1.0, 0.0, 0.0), (0.0, 1.0, 0.0)), (len(profiles), 1, 1))
+    moved[::100, :, 2] = 10.0
+    matrices = profiles.entity_matrices(store.counts(), moved)
+    target = filename + '.saved'
+    results['save_incremental'], _ = best_of(repeat, lambda: save_incremental(filename, target, store, matrices))
+    results['save_full'], _ = best_of(repeat, lambda: write_dxf(target, [store.placed(matrices)]))
+    os.remove(target)
+    counts = {'entities': len(store), 'instances': 0 if instances is None else len(instances),
+              'profiles': len(detected), 'closed_profiles': detected.loop_count(),
+              'vertices': len(detected.vertices), 'points': len(points)}
+    return results, counts, (store, detected, points, offsets)
+
+
+def bench_qt(profiles, points, offsets, max_items=200000, snap_queries=200, render_size=1024, repeat=1):
+    # Item construction, offscreen rendering, snapping and selection
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PyQt5.QtWidgets import QApplication
+    from PyQt5.QtGui import QImage, QPainter, QColor, QBrush
+    from PyQt5.QtCore import QRectF
+    from containment import hole_owners
+    from path_builder import build_paths
+    from interactable_path_item import InteractablePathItem
+    from profile_scene import ProfileScene
+
+    app = QApplication.instance() or QApplication([])
+    results = {}
+    n = min(len(profiles), max_items)
+    points, offsets = points[:offsets[n]], offsets[:n + 1]
+    closed = profiles.closed[:n]
+
+    results['holes'], owners = best_of(repeat, lambda: hole_owners(points, offsets, closed))
+    results['paths'], paths = best_of(repeat, lambda: list(build_paths(points, offsets, closed, owners)))
+
+    scene = ProfileScene()
+
+    def build_items():
+        scene.clear()
+        items = []
+        for path, ids in paths:
+            item = InteractablePathItem(path)
+            item.setPathStyle(scene.path_style)
+            if closed[ids[0]]:
+                item.setBrush(QBrush(QColor(255, 0, 255, 127)))
+            scene.addItem(item)
+            items.append(item)
+        return items
+
+    results['items'], items = best_of(repeat, build_items)
+
+    image = QImage(render_size, render_size, QImage.Format_ARGB32_Premultiplied)
+    bounds = scene.itemsBoundingRect()
+
+    def render(source):
+        image.fill(QColor(10, 10, 20))
+        painter = QPainter(image)
+        scene.render(painter, QRectF(image.rect()), source)
+        painter.end()
+
+    # Whole drawing on screen, then a close up of its centre
+    results['render_fit'], _ = best_of(repeat, lambda: render(bounds))
+    centre = bounds.center()
+    close_up = QRectF(centre.x() - bounds.width() / 40, centre.y() - bounds.height() / 40,
+                      bounds.width() / 20, bounds.height() / 20)
+    results['render_zoom'], _ = best_of(repeat, lambda: render(close_up))
+
+    if items and snap_queries:
+        rng = np.random.default_rng(0)
+        picks = rng.integers(0, len(items), min(snap_queries, len(items)))
+
+        def snap():
+            for k in picks.tolist():
+                items[k].snapToClosest()
+
+        elapsed, _ = best_of(repeat, snap)
+        results['snap_per_query'] = elapsed / len(picks)
+
+        # Clicks on a vertex of each picked item, then crossing and window
+        # bands over the close up
+        clicks = [items[k].sceneOutline()[0][0] for k in picks.tolist() if len(items[k].outline()[0])]
+        tolerance = bounds.width() / render_size
+
+        def pick():
+            for x, y in clicks:
+                scene.itemAtPoint(x, y, tolerance)
+
+        scene.itemAtPoint(0.0, 0.0)  # builds the index
+        elapsed, _ = best_of(repeat, pick)
+        results['pick_per_query'] = elapsed / max(len(clicks), 1)
+        band = (close_up.left(), close_up.top(), close_up.right(), close_up.bottom())
+        results['band_crossing'], _ = best_of(repeat, lambda: scene.itemsInRect(*band))
+        results['band_window'], _ = best_of(repeat, lambda: scene.itemsInRect(*band, window=True))
+
+    scene.clear()
+    app.processEvents()
+    return results, {'items': len(items)}
+
+
+def bench_nest(profiles, points, offsets, parts=500, sheets=3, spacing=None, rotations=4):
+    # Nests the first parts closed profiles (with their holes) on sheets
+    # sized so they need about the given number of them
+    from containment import hole_owners
+    owners = hole_owners(points, offsets, profiles.closed)
+    holes = {}
+    for hole, owner in zip(np.flatnonzero(owners >= 0).tolist(), owners[owners >= 0].tolist()):
+        holes.setdefault(owner, []).append(hole)
+    outlines = np.flatnonzero(profiles.closed & (np.diff(offsets) >= 3) & (owners < 0))[:parts]
+    shapes = [[points[offsets[k]:offsets[k + 1]] for k in [i] + holes.get(i, [])] for i in outlines.tolist()]
+    if not shapes:
+        return {}, {}
+    sizes = np.array([np.ptp(np.concatenate(shape), axis=0) for shape in shapes])
+    height = max(np.sqrt(sum(polygons_area(shape) for shape in shapes) / 0.5 / sheets / 2), sizes.max() * 1.1)
+    spacing = height / 200 if spacing is None else spacing
+    start = time.perf_counter()
+    layout = nest(shapes, 2 * height, height, spacing, rotations)
+    elapsed = time.perf_counter() - start
+    return {'nest': elapsed}, {'nest_parts': len(shapes), 'nest_parts_per_second': len(layout) / elapsed,
+                               'nest_sheets': layout.sheets, 'nest_utilization': layout.utilization,
+                               'nest_unplaced': len(layout.unplaced)}
+
+
+def bench_toolpath(profiles, points, offsets, repeat=1):
+    # Cut ordering of every profile, with the rapid travel it saves
+    from containment import profile_parents
+    results = {}
+    results['parents'], parents = best_of(repeat, lambda: profile_parents(points, offsets, profiles.closed))
+    results['toolpath'], toolpath = best_of(
+        repeat, lambda: plan_toolpath(profiles.vertices, profiles.offsets, profiles.closed, parents))
+    return results, {'travel_before': toolpath.travel_before, 'travel_after': toolpath.travel_after}
+
+
+def bench_check(store, profiles, points, offsets, repeat=1):
+    # Entity and profile measurements and every design rule check
+    from containment import hole_owners
+    results = {}
+    results['measure_entities'], _ = best_of(repeat, lambda: entity_measures(store))
+    owners = hole_owners(points, offsets, profiles.closed)
+    results['measure_profiles'], _ = best_of(repeat, lambda: profile_measures(profiles, points, offsets, owners))
+    results['check'], issues = best_of(repeat, lambda: check_drawing(store, profiles, points, offsets, owners))
+    return results, {'issues': len(issues.checks)}
+
+
+def run(kinds, sizes, seed=0, workdir=None, repeat=1, qt=True, max_items=200000, jobs=1, nest_parts=0,
+        toolpath=False, check=False, log=None):
+    workdir = workdir or os.path.join(os.path.expanduser('~'), '.cache', 'dxfviewer', 'bench')
+    records = []
+    for kind in kinds:
+        for size in sizes:
+            start = time.perf_counter()
+            filename = cached_drawing(workdir, kind, size, seed)
+            record = {'kind': kind, 'size': size, 'seed': seed, 'file_bytes': os.path.getsize(filename),
+                      'generate': time.perf_counter() - start}
+            timings, counts, (store, profiles, points, offsets) = bench_pipeline(filename, repeat, jobs)
+            record.update(counts)
+            if qt:
+                qt_timings, qt_counts = bench_qt(profiles, points, offsets, max_items=max_items, repeat=repeat)
+                timings.update(qt_timings)
+                record.update(qt_counts)
+            if nest_parts:
+                nest_timings, nest_counts = bench_nest(profiles, points, offsets, nest_parts)
+                timings.update(nest_timings)
+                record.update(nest_counts)
+            if toolpath:
+                toolpath_timings, toolpath_counts = bench_toolpath(profiles, points, offsets, repeat)
+                timings.update(toolpath_timings)
+                record.update(toolpath_counts)
+            if check:
+                check_timings, check_counts = bench_check(store, profiles, points, offsets, repeat)
+                timings.update(check_timings)
+                record.update(check_counts)
+            record['seconds'] = timings
+            records.append(record)
+            if log is not None:
+                log(f"{kind:>7} {size:>9}  " + '  '.join(f"{stage} {t:.4f}" for stage, t in timings.items()))
+    return {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'repeat': repeat,
+            'jobs': jobs,
+        },
+        'results': records,
+    }
+
+
+def compare(current, previous):
+    # Lines of stage timings next to the previous run, slower ones flagged
+    old = {(r['kind'], r['size'], r.get('seed', 0)): r['seconds'] for r in previous['results']}
+    lines = []
+    for record in current['results']:
+        before = old.get((record['kind'], record['size'], record.get('seed', 0)))
+        if before is None:
+            continue
+        for stage, seconds in record['seconds'].items():
+            if stage in before and before[stage] > 0:
+                ratio = seconds / before[stage]
+                flag = '  SLOWER' if ratio > 1.2 else ''
+                lines.append(f"{record['kind']:>7} {record['size']:>9} {stage:>15} "
+                             f"{before[stage]:10.4f} -> {seconds:10.4f}  x{ratio:5.2f}{flag}")
+    return lines
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the DXF pipeline on synthetic drawings.")
+    parser.add_argument('--kinds', nargs='+', choices=sorted(GENERATORS), default=sorted(GENERATORS))
+    parser.add_argument('--sizes', nargs='+', type=int, default=DEFAULT_SIZES, help="entities per drawing")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=1, help="keep the best of this many runs per stage")
+    parser.add_argument('--workdir', help="where generated drawings are kept between runs")
+    parser.add_argument('--max-items', type=int, default=200000, help="cap on scene items built")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help="worker processes for the parallel profile stage, 1 skips it")
+    parser.add_argument('--nest', type=int, default=0, metavar='PARTS',
+                        help="also nest this many closed profiles and report parts per second and utilization")
+    parser.add_argument('--toolpath', action='store_true',
+                        help="also plan the cut order and report the rapid travel before and after")
+    parser.add_argument('--check', action='store_true',
+                        help="also measure every entity and profile and run the design rule checks")
+    parser.add_argument('--no-qt', action='store_true', help="skip items, rendering and snapping")
+    parser.add_argument('-o', '--output', help="write the results to this JSON file")
+    parser.add_argument('--compare', help="previous results JSON to compare with")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    log = lambda line: print(line, file=sys.stderr)
+    results = run(args.kinds, args.sizes, args.seed, args.workdir, args.repeat, not args.no_qt, args.max_items,
+                  args.jobs, args.nest, args.toolpath, args.check, log)
+    if args.output:
+        directory = os.path.dirname(args.output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=1)
+    else:
+        json.dump(results, sys.stdout, indent=1)
+        print()
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            previous = json.load(f)
+        for line in compare(results, previous):
+            print(line, file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
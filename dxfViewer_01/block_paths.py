@@ -0,0 +1,22 @@
+from blocks import BlockGeometry
+from path_builder import build_paths
+from tessellate import DEFAULT_CHORD_TOLERANCE
+
+# The Qt half of blocks: the QPainterPaths the viewer draws every copy of a
+# block with. Headless runs use blocks alone.
+
+
+class BlockPaths(BlockGeometry):
+    # BlockGeometry with its paths, shared by all instances of the block
+    def __init__(self, store, tolerance=1e-3, chord_tolerance=DEFAULT_CHORD_TOLERANCE, group_holes=True):
+        super().__init__(store, tolerance, chord_tolerance, group_holes)
+        self._paths = None
+
+    def paths(self):
+        # [(path, closed, profile ids)] for the block, see path_builder.build_paths;
+        # built on first use, which may be on a worker thread
+        if self._paths is None:
+            closed = self.profiles.closed.tolist()
+            self._paths = [(path, closed[ids[0]], ids)
+                           for path, ids in build_paths(self.points, self.offsets, self.profiles.closed, self.owners)]
+        return self._paths
@@ -0,0 +1,168 @@
+import numpy as np
+
+from dxf_stream import read_blocks
+from geometry_store import GeometryStoreBuilder, InstanceSet
+from containment import hole_owners
+from profile_engine import ProfileSet, concatenate_profiles, find_profiles
+from tessellate import DEFAULT_CHORD_TOLERANCE, tessellate_runs
+
+# Block references as instances. Every block definition is parsed into a
+# GeometryStore of its own, its profiles are detected and tessellated once
+# in block coordinates, and every INSERT only contributes a placement
+# matrix. Drawings with thousands of copies of a few parts then cost memory
+# per unique part, not per copy. Blocks are treated as self contained parts:
+# their geometry never joins into profiles with the rest of the drawing.
+# Nothing here imports PyQt5; the paths of a block are in block_paths.
+
+MAX_NESTING = 16
+
+
+class BlockTable:
+    # Block name -> (base point, GeometryStore) of the definitions in a file;
+    # nested INSERTs of a definition are in its store's instances
+    def __init__(self, definitions=None):
+        self.definitions = dict(definitions or {})
+
+    @classmethod
+    def from_file(cls, filename):
+        definitions = {}
+        for name, block in read_blocks(filename).items():
+            builder = GeometryStoreBuilder()
+            for entity in block.entities:
+                builder.add(entity)
+            definitions[name] = (block.base, builder.build())
+        return cls(definitions)
+
+    def __len__(self):
+        return len(self.definitions)
+
+    def __contains__(self, name):
+        return name in self.definitions
+
+    def store(self, name):
+        return self.definitions[name][1]
+
+    def base(self, name):
+        return self.definitions[name][0]
+
+
+def _full(matrices):
+    # (K, 2, 3) -> (K, 3, 3)
+    bottom = np.broadcast_to((0.0, 0.0, 1.0), (len(matrices), 1, 3))
+    return np.concatenate((matrices, bottom), axis=1)
+
+
+def flatten_instances(instances, table, layer_names):
+    # Resolves nested INSERTs into one InstanceSet over the blocks that have
+    # geometry of their own, with matrices mapping raw block coordinates to
+    # the drawing. Entities inside a block take the layer of the INSERT when
+    # the nested INSERT itself sits on layer 0, as in AutoCAD. Returns the
+    # set and its layer names, layer_names extended where nesting needs it.
+    layer_names = list(layer_names)
+    layer_ids = {name: i for i, name in enumerate(layer_names)}
+    blocks, block_ids, matrices, layers, handles = [], [], [], [], []
+    slots = {}
+
+    def layer_id(name):
+        if name not in layer_ids:
+            layer_ids[name] = len(layer_names)
+            layer_names.append(name)
+        return layer_ids[name]
+
+    def visit(name, placed, layer, handle, depth):
+        # placed (K, 3, 3) maps name's coordinates relative to its base point
+        if name not in table or depth > MAX_NESTING:
+            return
+        (bx, by), store = table.definitions[name]
+        placed = placed @ np.array(((1.0, 0.0, -bx), (0.0, 1.0, -by), (0.0, 0.0, 1.0)))
+        if len(store):
+            if name not in slots:
+                slots[name] = len(blocks)
+                blocks.append(name)
+            block_ids.append(np.full(len(placed), slots[name], dtype=np.int32))
+            matrices.append(placed[:, :2])
+            layers.append(layer)
+            handles.append(handle)
+        nested = store.instances
+        for child in range(len(nested.blocks)):
+            rows = np.flatnonzero(nested.block_ids == child)
+            if not len(rows):
+                continue
+            # Every copy of this block places every nested copy
+            combined = (placed[:, None] @ _full(nested.matrices[rows])[None]).reshape(-1, 3, 3)
+            child_layers = [store.layers[k] for k in nested.layers[rows].tolist()]
+            inherited = np.array([-1 if n == '0' else layer_id(n) for n in child_layers], dtype=np.int32)
+            combined_layers = np.where(inherited[None, :] < 0, layer[:, None], inherited[None, :]).ravel()
+            combined_handles = np.repeat(handle, len(rows))
+            visit(nested.blocks[child], combined, combined_layers, combined_handles, depth + 1)
+
+    for b, name in enumerate(instances.blocks):
+        rows = np.flatnonzero(instances.block_ids == b)
+        names = [layer_names[k] if 0 <= k < len(layer_names) else '0' for k in instances.layers[rows].tolist()]
+        visit(name, _full(instances.matrices[rows]), np.array([layer_id(n) for n in names], dtype=np.int32),
+              instances.handles[rows], 0)
+
+    if not blocks:
+        return InstanceSet(), layer_names
+    return InstanceSet(blocks, np.concatenate(block_ids), np.concatenate(matrices), np.concatenate(layers),
+                       np.concatenate(handles)), layer_names
+
+
+class BlockGeometry:
+    # Profiles of one block definition, detected and tessellated once and
+    # shared by all its instances
+    def __init__(self, store, tolerance=1e-3, chord_tolerance=DEFAULT_CHORD_TOLERANCE, group_holes=True):
+        self.store = store
+        self.profiles = find_profiles(store, tolerance)
+        self.points, self.offsets = tessellate_runs(self.profiles.vertices, self.profiles.offsets,
+                                                    self.profiles.closed, chord_tolerance)
+        self.owners = hole_owners(self.points, self.offsets, self.profiles.closed) if group_holes else None
+
+
+def explode(profiles, ids, matrix, layer):
+    # The profiles ids of a block's ProfileSet placed with a (2, 3) matrix,
+    # as a ProfileSet of their own on one layer. Bulges keep their meaning
+    # under similarity transforms only; a mirror flips their sign.
+    ids = np.asarray(ids, dtype=np.int64)
+    starts, ends = profiles.offsets[ids], profiles.offsets[ids + 1]
+    lengths = ends - starts
+    rows = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+    vertices = profiles.vertices[rows].copy()
+    m = np.asarray(matrix, dtype=np.float64)
+    vertices[:, :2] = vertices[:, :2] @ m[:, :2].T + m[:, 2]
+    if np.linalg.det(m[:, :2]) < 0:
+        vertices[:, 2] = -vertices[:, 2]
+    return ProfileSet(vertices, np.concatenate(([0], np.cumsum(lengths))), profiles.closed[ids],
+                      np.full(len(ids), layer), np.zeros((0, 2)), np.zeros(len(ids) + 1, dtype=np.int64),
+                      np.zeros((0, 2)))
+
+
+def place_profiles(profiles, matrices, layers):
+    # Every profile of a block's ProfileSet placed with each of K (2, 3)
+    # matrices, copy by copy, as one ProfileSet; copy k is on layers[k].
+    # Mirrored copies flip their bulges as in explode.
+    m = np.asarray(matrices, dtype=np.float64).reshape(-1, 2, 3)
+    count, size = len(m), len(profiles.vertices)
+    vertices = np.empty((count, size, 3))
+    vertices[:, :, :2] = np.einsum('kij,nj->kni', m[:, :, :2], profiles.vertices[:, :2]) + m[:, None, :, 2]
+    vertices[:, :, 2] = np.where(np.linalg.det(m[:, :, :2]) < 0, -1.0, 1.0)[:, None] * profiles.vertices[:, 2]
+    offsets = (profiles.offsets[:-1][None, :] + size * np.arange(count)[:, None]).ravel()
+    return ProfileSet(vertices.reshape(-1, 3), np.append(offsets, count * size), np.tile(profiles.closed, count),
+                      np.repeat(np.asarray(layers, dtype=np.int32), len(profiles)), np.zeros((0, 2)),
+                      np.zeros(count * len(profiles) + 1, dtype=np.int64), np.zeros((0, 2)))
+
+
+def instance_profiles(filename, store, tolerance=1e-3):
+    # The profiles of every placed block copy in the DXF file behind store,
+    # for headless runs that need them counted like the drawing's own; each
+    # block is detected once. Returns the ProfileSet, the layer names its
+    # layers index (store.layers extended, see flatten_instances) and the
+    # flattened InstanceSet.
+    table = BlockTable.from_file(filename)
+    instances, layer_names = flatten_instances(store.instances, table, store.layers)
+    placed = []
+    for b, name in enumerate(instances.blocks):
+        rows = np.flatnonzero(instances.block_ids == b)
+        placed.append(place_profiles(find_profiles(table.store(name), tolerance), instances.matrices[rows],
+                                     instances.layers[rows]))
+    return concatenate_profiles(placed), layer_names, instances
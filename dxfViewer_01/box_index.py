@@ -0,0 +1,97 @@
+import numpy as np
+
+
+class BoxIndex:
+    # Static uniform grid over axis aligned boxes (N, 4) xmin, ymin, xmax,
+    # ymax, for "which boxes touch this rectangle" queries over many
+    # profiles. Every box is listed in each cell it covers, stored as one
+    # sorted array of packed cell keys so building and querying are a few
+    # numpy passes. Boxes spanning more than max_cells cells are kept aside
+    # and tested on every query instead of being spread over the grid.
+    # Rows with NaN bounds are never returned.
+
+    def __init__(self, bounds, cell_size=None, max_cells=64):
+        self.bounds = np.asarray(bounds, dtype=np.float64).reshape(-1, 4)
+        valid = ~np.isnan(self.bounds).any(axis=1)
+        if cell_size is None:
+            cell_size = self._default_cell_size(self.bounds[valid])
+        self.cell_size = float(cell_size)
+
+        ids = np.flatnonzero(valid)
+        k0, k1 = self._cells(self.bounds[ids])
+        spans = k1 - k0 + 1
+        counts = spans[:, 0] * spans[:, 1]
+        large = counts > max_cells
+        self._large = ids[large]
+
+        ids, k0, spans, counts = ids[~large], k0[~large], spans[~large], counts[~large]
+        owner = np.repeat(np.arange(len(ids)), counts)
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        cx = k0[owner, 0] + local % spans[owner, 0]
+        cy = k0[owner, 1] + local // spans[owner, 0]
+        keys = _pack(cx, cy)
+        order = np.argsort(keys, kind='stable')
+        self._keys = keys[order]
+        self._ids = ids[owner[order]]
+
+    @staticmethod
+    def _default_cell_size(bounds):
+        # About the size of a typical box, so most boxes land in a few cells
+        if not len(bounds):
+            return 1.0
+        sizes = np.maximum(bounds[:, 2] - bounds[:, 0], bounds[:, 3] - bounds[:, 1])
+        extent = max(bounds[:, 2].max() - bounds[:, 0].min(), bounds[:, 3].max() - bounds[:, 1].min())
+        # At most about 4096 cells a side whatever the box sizes
+        return max(float(np.median(sizes)) * 2.0, extent / 4096.0, 1e-9)
+
+    def _cells(self, bounds):
+        k0 = np.floor(bounds[:, :2] / self.cell_size).astype(np.int64)
+        k1 = np.floor(bounds[:, 2:] / self.cell_size).astype(np.int64)
+        return k0, k1
+
+    def __len__(self):
+        return len(self.bounds)
+
+    def query(self, xmin, ymin, xmax, ymax):
+        # Sorted ids of the boxes intersecting the rectangle
+        k0, k1 = self._cells(np.array([[xmin, ymin, xmax, ymax]]))
+        (kx0, ky0), (kx1, ky1) = k0[0].tolist(), k1[0].tolist()
+        cells = (kx1 - kx0 + 1) * (ky1 - ky0 + 1)
+        if cells > len(self._ids):
+            # Larger than the whole grid, a plain scan is cheaper
+            candidates = np.arange(len(self.bounds))
+        else:
+            cx, cy = np.meshgrid(np.arange(kx0, kx1 + 1), np.arange(ky0, ky1 + 1))
+            keys = _pack(cx.ravel(), cy.ravel())
+            starts = np.searchsorted(self._keys, keys, side='left')
+            ends = np.searchsorted(self._keys, keys, side='right')
+            lengths = ends - starts
+            hits = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+            candidates = np.unique(np.concatenate((self._ids[hits], self._large)))
+        b = self.bounds[candidates]
+        inside = (b[:, 0] <= xmax) & (b[:, 2] >= xmin) & (b[:, 1] <= ymax) & (b[:, 3] >= ymin)
+        return candidates[inside]
+
+    def query_points(self, points):
+        # Every (point, box) pair where the box contains the point, as two
+        # aligned id arrays ordered by point
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        cells = np.floor(points / self.cell_size).astype(np.int64)
+        keys = _pack(cells[:, 0], cells[:, 1])
+        starts = np.searchsorted(self._keys, keys, side='left')
+        lengths = np.searchsorted(self._keys, keys, side='right') - starts
+        point_ids = np.repeat(np.arange(len(points)), lengths)
+        box_ids = self._ids[np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())]
+        if len(self._large):
+            point_ids = np.concatenate((point_ids, np.repeat(np.arange(len(points)), len(self._large))))
+            box_ids = np.concatenate((box_ids, np.tile(self._large, len(points))))
+            order = np.argsort(point_ids, kind='stable')
+            point_ids, box_ids = point_ids[order], box_ids[order]
+        b, p = self.bounds[box_ids], points[point_ids]
+        inside = (b[:, 0] <= p[:, 0]) & (b[:, 2] >= p[:, 0]) & (b[:, 1] <= p[:, 1]) & (b[:, 3] >= p[:, 1])
+        return point_ids[inside], box_ids[inside]
+
+
+def _pack(cx, cy):
+    # Both cell coordinates in one int64 so a 1D sort groups them
+    return (np.asarray(cx, dtype=np.int64) << 32) | (np.asarray(cy, dtype=np.int64) & 0xffffffff)
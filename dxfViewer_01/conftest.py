@@ -0,0 +1,32 @@
+import os
+import sys
+
+import pytest
+
+# The modules import each other by their bare names, as when main.py, batch.py
+# or bench.py are run from this directory
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def dxf_text(entities, header=()):
+    # Smallest ASCII DXF the stream reader takes: an optional HEADER section
+    # and the ENTITIES section, every entity a list of (group code, value)
+    # pairs starting with its (0, type)
+    tags = []
+    if header:
+        tags += [(0, 'SECTION'), (2, 'HEADER')] + list(header) + [(0, 'ENDSEC')]
+    tags += [(0, 'SECTION'), (2, 'ENTITIES')]
+    for entity in entities:
+        tags += entity
+    tags += [(0, 'ENDSEC'), (0, 'EOF')]
+    return ''.join(f"{code:>3}\n{value}\n" for code, value in tags)
+
+
+@pytest.fixture
+def write_drawing(tmp_path):
+    # Writes dxf_text(entities) to a file in the test's directory, returns its path
+    def write(entities, name='drawing.dxf', header=()):
+        path = tmp_path / name
+        path.write_text(dxf_text(entities, header), encoding='ascii')
+        return str(path)
+    return write
@@ -0,0 +1,131 @@
+import numpy as np
+
+from box_index import BoxIndex
+
+# Which closed profile lies inside which, from tessellated profiles (flat
+# points and per profile offsets). Closed profiles lying inside another
+# closed profile are its holes; a profile inside a hole is an island, an
+# outline of its own again. Nothing here imports PyQt5, batch runs use it
+# as well as the viewer.
+
+
+def profile_parents(points, offsets, closed, tested=None):
+    # (P,) index of the smallest closed profile containing the first point of
+    # each profile, -1 for profiles inside no other. Only closed profiles of
+    # three or more points contain anything; a closed profile needs a larger
+    # area than the one it contains. tested limits the profiles looked up,
+    # all with points by default.
+    count = len(offsets) - 1
+    parents = np.full(count, -1, dtype=np.int64)
+    lengths = np.diff(offsets)
+    ids = np.flatnonzero(np.asarray(closed, dtype=bool) & (lengths >= 3))
+    tested = np.flatnonzero(lengths > 0) if tested is None else np.asarray(tested, dtype=np.int64)
+    if not len(ids) or len(tested) < 2:
+        return parents
+
+    # Boxes and areas of every run, picked for the loops
+    all_bounds = _boxes(points, offsets)
+    starts, ends = offsets[ids], offsets[ids + 1]
+    bounds = all_bounds[ids]
+    areas = np.abs(_areas(points, offsets))[ids]
+    # Every profile tested against the loops, with the area it must be beaten by
+    tested_bounds = all_bounds[tested]
+    tested_areas = np.zeros(count)
+    tested_areas[ids] = areas
+    tested_areas = tested_areas[tested]
+    # Outlines are much larger than the typical (hole sized) box, let them
+    # spread over the grid rather than being tested against every point
+    index = BoxIndex(bounds, max_cells=4096)
+
+    # Candidate (inner, outer) pairs: the outer box contains the inner one and is larger
+    inner, outer = index.query_points(points[offsets[tested]])
+    b, c = bounds[outer], tested_bounds[inner]
+    candidate = (b[:, 2] >= c[:, 2]) & (b[:, 3] >= c[:, 3]) & (areas[outer] > tested_areas[inner])
+    inner, outer = inner[candidate], outer[candidate]
+    inside = _contains(points, starts[outer], ends[outer], points[offsets[tested[inner]]])
+    if not inside.any():
+        return parents
+
+    # Smallest containing outline is the parent
+    inner, outer = inner[inside], outer[inside]
+    order = np.lexsort((areas[outer], inner))
+    first = np.concatenate(([True], inner[order][1:] != inner[order][:-1]))
+    parents[tested[inner[order][first]]] = ids[outer[order][first]]
+    return parents
+
+
+def hole_owners(points, offsets, closed):
+    # (P,) index of the closed profile each profile is a hole of, -1 for
+    # outlines, islands and open chains. A profile's owner is the smallest
+    # closed profile containing its first point; profiles nested an odd
+    # number of levels deep are holes.
+    owners = np.full(len(offsets) - 1, -1, dtype=np.int64)
+    ids = np.flatnonzero(np.asarray(closed, dtype=bool) & (np.diff(offsets) >= 3))
+    parents = profile_parents(points, offsets, closed, ids)
+    ids = ids[parents[ids] >= 0]
+    if not len(ids):
+        return owners
+    # Depths follow from the outermost loops in
+    depth = np.zeros(len(owners), dtype=np.int64)
+    level = parents.copy()
+    while True:
+        nested = level >= 0
+        if not nested.any():
+            break
+        depth += nested
+        level = np.where(nested, parents[np.maximum(level, 0)], -1)
+    holes = ids[depth[ids] % 2 == 1]
+    owners[holes] = parents[holes]
+    return owners
+
+
+def _boxes(points, offsets):
+    # (P, 4) box of every profile, NaN for empty ones. A reduceat runs on to
+    # the next start, so every non-empty run is reduced, open chains too.
+    lengths = np.diff(offsets)
+    runs = np.flatnonzero(lengths > 0)
+    boxes = np.full((len(lengths), 4), np.nan)
+    if len(runs):
+        x, y, starts = points[:offsets[-1], 0], points[:offsets[-1], 1], offsets[runs]
+        boxes[runs] = np.column_stack((np.minimum.reduceat(x, starts), np.minimum.reduceat(y, starts),
+                                       np.maximum.reduceat(x, starts), np.maximum.reduceat(y, starts)))
+    return boxes
+
+
+def _areas(points, offsets):
+    # Signed shoelace area of every profile taken as a closed run, 0 for
+    # empty ones; every run wraps to its own start, see _boxes
+    lengths = np.diff(offsets)
+    runs = np.flatnonzero(lengths > 0)
+    areas = np.zeros(len(lengths))
+    if len(runs):
+        x, y, starts = points[:offsets[-1], 0], points[:offsets[-1], 1], offsets[runs]
+        nxt = np.arange(1, len(x) + 1)
+        nxt[offsets[runs + 1] - 1] = starts
+        areas[runs] = np.add.reduceat(x * y[nxt] - x[nxt] * y, starts) / 2
+    return areas
+
+
+def _contains(points, starts, ends, tests, max_edges=1 << 22):
+    # Even-odd test of tests[k] against the closed run points[starts[k]:ends[k]]
+    # for every k, edges of all pairs expanded together in chunks
+    result = np.zeros(len(tests), dtype=bool)
+    lengths = ends - starts
+    k0 = 0
+    while k0 < len(tests):
+        total = np.cumsum(lengths[k0:])
+        k1 = k0 + max(1, int(np.searchsorted(total, max_edges, side='right')))
+        n = lengths[k0:k1]
+        pair = np.repeat(np.arange(k0, k1), n)
+        local = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+        a = starts[pair] + local
+        b = np.where(local + 1 < n[pair - k0], a + 1, starts[pair])
+        px, py = tests[pair, 0], tests[pair, 1]
+        ax, ay, bx, by = points[a, 0], points[a, 1], points[b, 0], points[b, 1]
+        straddles = (ay > py) != (by > py)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x_cross = ax + (py - ay) * (bx - ax) / (by - ay)
+        crossings = straddles & (px < x_cross)
+        result[k0:k1] = np.add.reduceat(crossings.astype(np.int64), np.cumsum(n) - n) % 2 == 1
+        k0 = k1
+    return result
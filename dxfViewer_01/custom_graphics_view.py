@@ -1,15 +1,202 @@
-from PyQt5.QtWidgets import QGraphicsView
-from PyQt5.QtCore import Qt
-from interactable_path_item import InteractablePathItem
+import math
+from PyQt5.QtWidgets import QGraphicsView, QStyleOptionGraphicsItem, QLabel
+from PyQt5.QtGui import QColor, QPen, QPolygonF
+from PyQt5.QtCore import Qt, QPointF, QRectF, QTimer, pyqtSignal
+from interactable_path_item import InteractablePathItem, detach_render_command, draw_render_command
+from instrumentation import profiler
+from tile_cache import TileCache, zoom_key, tile_range
+
+# Distance in pixels from an outline within which a click still hits it,
+# and the drag below which a press on empty space is a plain click
+HIT_PIXELS = 4
+DRAG_PIXELS = 3
+
 
 class CustomGraphicsView(QGraphicsView):
+    # Scene rect on screen, once per event loop pass after scrolling, zooming or resizing
+    visibleRectChanged = pyqtSignal(QRectF)
+
     def __init__(self, parent=None):
         super().__init__(parent)
         self._is_panning = False
         self._mouse_pressed_pos = None
         self.cursor_position_callback = None
+        # Rubber band (view points) dragged from empty space: the press and
+        # current position, or the lasso points with Alt held
+        self._band = None
+        self._lasso = None
         self.setMouseTracking(True)
         self.viewport().setMouseTracking(True)
+        # Static geometry is blitted from cached tiles, see drawBackground
+        self.tile_cache = TileCache(parent=self)
+        self.tile_cache.tileReady.connect(self.onTileReady)
+        self._tile_cache_enabled = True
+        # Zoom key of the tiles drawn last, their updates are repainted
+        self._frame_zoom = None
+        self._visible_rect_timer = QTimer(self)
+        self._visible_rect_timer.setSingleShot(True)
+        self._visible_rect_timer.setInterval(0)
+        self._visible_rect_timer.timeout.connect(lambda: self.visibleRectChanged.emit(self.visibleSceneRect()))
+        # Span and counter summary drawn over the top left corner, off by default
+        self._timing_overlay = QLabel(self)
+        self._timing_overlay.setAttribute(Qt.WA_TransparentForMouseEvents)
+        self._timing_overlay.setStyleSheet('background: rgba(0, 0, 0, 160); color: rgb(200, 255, 200); '
+                                           'font-family: monospace; padding: 4px;')
+        self._timing_overlay.move(4, 4)
+        self._timing_overlay.hide()
+        self._timing_timer = QTimer(self)
+        self._timing_timer.setInterval(500)
+        self._timing_timer.timeout.connect(self.updateTimingOverlay)
+
+    def visibleSceneRect(self):
+        return self.mapToScene(self.viewport().rect()).boundingRect()
+
+    def scrollContentsBy(self, dx, dy):
+        super().scrollContentsBy(dx, dy)
+        self._visible_rect_timer.start()
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self._visible_rect_timer.start()
+
+    def setTransform(self, matrix, combine=False):
+        super().setTransform(matrix, combine)
+        self._visible_rect_timer.start()
+
+    def paintEvent(self, event):
+        # Every frame of the viewport, tiles and live items together
+        with profiler.span('paint'):
+            super().paintEvent(event)
+
+    def setTimingOverlayVisible(self, visible):
+        self._timing_overlay.setVisible(visible)
+        if visible:
+            self.updateTimingOverlay()
+            self._timing_timer.start()
+        else:
+            self._timing_timer.stop()
+
+    def isTimingOverlayVisible(self):
+        return self._timing_overlay.isVisible()
+
+    def updateTimingOverlay(self):
+        self._timing_overlay.setText(profiler.report() or 'No timings yet')
+        self._timing_overlay.adjustSize()
+
+    def setScene(self, scene):
+        if self.scene() is not None and hasattr(self.scene(), 'staticChanged'):
+            self.scene().staticChanged.disconnect(self.onStaticChanged)
+            self.scene().setStaticTiled(False)
+        super().setScene(scene)
+        self.tile_cache.clear()
+        if scene is not None and hasattr(scene, 'staticChanged'):
+            scene.staticChanged.connect(self.onStaticChanged)
+            scene.setStaticTiled(self._tile_cache_enabled)
+
+    def setTileCacheEnabled(self, enabled):
+        self._tile_cache_enabled = enabled
+        if not enabled:
+            self.tile_cache.clear()
+        if hasattr(self.scene(), 'setStaticTiled'):
+            self.scene().setStaticTiled(enabled)
+        self.viewport().update()
+
+    def isTileCacheEnabled(self):
+        return self._tile_cache_enabled
+
+    def onStaticChanged(self, rect, item):
+        # Only the changed area is repainted, the rest of the viewport stays
+        if rect.isNull():
+            self.tile_cache.invalidate()
+            self.viewport().update()
+        else:
+            self.tile_cache.invalidate(rect)
+            self.viewport().update(self.mapFromScene(rect).boundingRect().adjusted(-2, -2, 2, 2))
+
+    def onTileReady(self, key):
+        if self._frame_zoom is not None and key[0] == self._frame_zoom:
+            rect = self.mapFromScene(self.tile_cache.tileRect(key)).boundingRect()
+            self.viewport().update(rect.adjusted(-1, -1, 1, 1))
+
+    def drawBackground(self, painter, rect):
+        super().drawBackground(painter, rect)
+        self._frame_zoom = None
+        if not self._tile_cache_enabled or self.scene() is None:
+            return
+        zoom = self.transform()
+        zoom.setMatrix(zoom.m11(), zoom.m12(), 0, zoom.m21(), zoom.m22(), 0, 0, 0, 1)
+        key = zoom_key(zoom)
+        viewport_transform = self.viewportTransform()
+        # Zoom space to device: only the scroll offset is left
+        offset = QPointF(viewport_transform.dx(), viewport_transform.dy())
+        size = self.tile_cache.tile_size
+        i0, j0, i1, j1 = tile_range(viewport_transform.mapRect(rect).translated(-offset), size)
+
+        missing = []
+        painter.save()
+        painter.resetTransform()
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                tile_key = (key, i, j)
+                cached = self.tile_cache.tile(tile_key)
+                if cached is None or cached[1]:
+                    missing.append(tile_key)
+                    self.requestTile(tile_key, zoom, priority=1)
+                if cached is not None and cached[0] is not None:
+                    painter.drawImage(QPointF(i * size, j * size) + offset, cached[0])
+        painter.restore()
+        self._frame_zoom = key
+        if missing:
+            self.drawStaticItems(painter, rect, [self.tile_cache.tileRect(tile_key) for tile_key in missing])
+
+        # Prefetch a ring of tiles around the viewport so panning finds them ready
+        i0, j0, i1, j1 = tile_range(QRectF(self.viewport().rect()).translated(-offset), size)
+        for i in range(i0 - 1, i1 + 2):
+            for j in range(j0 - 1, j1 + 2):
+                if i0 <= i <= i1 and j0 <= j <= j1:
+                    continue
+                tile_key = (key, i, j)
+                cached = self.tile_cache.tile(tile_key)
+                if cached is None or cached[1]:
+                    self.requestTile(tile_key, zoom)
+
+    def drawStaticItems(self, painter, rect, tile_rects):
+        # Draws the unselected items over tiles that are missing or stale
+        # until their rendering arrives, edits and new areas never show blank
+        area = QRectF()
+        for tile_rect in tile_rects:
+            area = area.united(tile_rect)
+        items = self.scene().items(area.intersected(rect), Qt.IntersectsItemBoundingRect, Qt.AscendingOrder)
+        world = painter.worldTransform()
+        painter.save()
+        for item in items:
+            if not isinstance(item, InteractablePathItem) or item.isSelected() or not item.isVisible():
+                continue
+            if len(tile_rects) > 1 and not any(item.sceneBoundingRect().intersects(r) for r in tile_rects):
+                continue
+            transform = item.sceneTransform() * world
+            command = item.renderCommand(QStyleOptionGraphicsItem.levelOfDetailFromTransform(transform))
+            if command is not None:
+                painter.setTransform(transform)
+                draw_render_command(painter, command)
+        painter.restore()
+
+    def requestTile(self, key, zoom, priority=0):
+        # Snapshots the static items over a tile and queues its rendering
+        if self.tile_cache.isPending(key):
+            return
+        size = self.tile_cache.tile_size
+        inverse, _ = zoom.inverted()
+        scene_rect = inverse.mapRect(QRectF(key[1] * size, key[2] * size, size, size))
+        commands = []
+        for item in self.scene().items(scene_rect, Qt.IntersectsItemBoundingRect, Qt.AscendingOrder):
+            if not isinstance(item, InteractablePathItem) or item.isSelected() or not item.isVisible():
+                continue
+            transform = item.sceneTransform() * zoom
+            command = item.renderCommand(QStyleOptionGraphicsItem.levelOfDetailFromTransform(transform))
+            if command is not None:
+                commands.append((transform, detach_render_command(command)))
+        self.tile_cache.request(key, zoom, commands, priority)
 
     def wheelEvent(self, event):
         zoom_factor = 1.15
@@ -17,16 +204,42 @@ class CustomGraphicsView(QGraphicsView):
             self.scale(zoom_factor, zoom_factor)
         else:
             self.scale(1 / zoom_factor, 1 / zoom_factor)
+        self._visible_rect_timer.start()
+
+    def sceneTolerance(self, pixels=HIT_PIXELS):
+        # View pixels as a scene distance at the current zoom
+        transform = self.transform()
+        return pixels / math.sqrt(max(abs(transform.determinant()), 1e-24))
+
+    def itemAtViewPos(self, pos):
+        # Topmost item under a view position, looked up in the scene's
+        # selection index rather than through the items' shapes
+        scene = self.scene()
+        if not hasattr(scene, 'itemAtPoint'):
+            return self.itemAt(pos)
+        point = self.mapToScene(pos)
+        return scene.itemAtPoint(point.x(), point.y(), self.sceneTolerance())
 
     def mousePressEvent(self, event):
+        scene = self.scene()
+        if scene is not None and hasattr(scene, 'hit_tolerance'):
+            scene.hit_tolerance = self.sceneTolerance()
         if event.button() == Qt.MiddleButton:
             self._is_panning = True
             self._mouse_pressed_pos = event.pos()
             self.setCursor(Qt.ClosedHandCursor)
             event.accept()
-        elif self.itemAt(event.pos()):
+        elif self.itemAtViewPos(event.pos()):
             self.setCursor(Qt.OpenHandCursor)
             super().mousePressEvent(event)
+        elif event.button() == Qt.LeftButton and hasattr(scene, 'setSelection'):
+            # Empty space: clear the selection in one batch and start a band
+            self.setCursor(Qt.ArrowCursor)
+            if not event.modifiers() & Qt.ControlModifier:
+                scene.setSelection([])
+            self._band = (event.pos(), event.pos())
+            self._lasso = [event.pos()] if event.modifiers() & Qt.AltModifier else None
+            event.accept()
         else:
             self.setCursor(Qt.ArrowCursor)
             super().mousePressEvent(event)
@@ -36,6 +249,9 @@ class CustomGraphicsView(QGraphicsView):
             self._is_panning = False
             self.setCursor(Qt.ArrowCursor)
             event.accept()
+        elif self._band is not None and event.button() == Qt.LeftButton:
+            self.selectBand(event.pos(), event.modifiers() & Qt.ControlModifier)
+            event.accept()
         else:
             super().mouseReleaseEvent(event)
 
@@ -46,10 +262,63 @@ class CustomGraphicsView(QGraphicsView):
             self.horizontalScrollBar().setValue(self.horizontalScrollBar().value() - delta.x())
             self.verticalScrollBar().setValue(self.verticalScrollBar().value() - delta.y())
             event.accept()
+        elif self._band is not None:
+            self._band = (self._band[0], event.pos())
+            if self._lasso is not None and (event.pos() - self._lasso[-1]).manhattanLength() >= DRAG_PIXELS:
+                self._lasso.append(event.pos())
+            self.viewport().update()
+            event.accept()
         else:
             super().mouseMoveEvent(event)
 
-    def updateSnapPoints(self):
-        for item in self.scene.items():
+    def selectBand(self, pos, add=False):
+        # Selects with the band ending at pos. Dragged to the right the band
+        # is a window taking the items entirely inside it, to the left it
+        # crosses and takes every item it touches; a lasso takes the items
+        # with all their points inside.
+        start, lasso = self._band[0], self._lasso
+        self._band = self._lasso = None
+        self.viewport().update()
+        if (pos - start).manhattanLength() < DRAG_PIXELS:
+            return
+        scene = self.scene()
+        with profiler.span('band select'):
+            if lasso is not None:
+                polygon = self.mapToScene(QPolygonF([QPointF(p) for p in lasso + [pos]]))
+                items = scene.itemsInPolygon([(p.x(), p.y()) for p in polygon])
+            else:
+                rect = self.mapToScene(QRectF(QPointF(start), QPointF(pos)).normalized().toRect()).boundingRect()
+                items = scene.itemsInRect(rect.left(), rect.top(), rect.right(), rect.bottom(),
+                                          window=pos.x() >= start.x())
+            scene.setSelection(items, add=bool(add))
+
+    def drawForeground(self, painter, rect):
+        super().drawForeground(painter, rect)
+        if self._band is None:
+            return
+        painter.save()
+        painter.resetTransform()
+        start, end = self._band
+        if self._lasso is not None:
+            painter.setPen(QPen(QColor(120, 200, 255), 0, Qt.DashLine))
+            painter.drawPolygon(QPolygonF([QPointF(p) for p in self._lasso + [end]]))
+        else:
+            # Blue solid for a window, green dashed for a crossing band
+            window = end.x() >= start.x()
+            pen = QPen(QColor(120, 170, 255) if window else QColor(120, 255, 150), 0,
+                       Qt.SolidLine if window else Qt.DashLine)
+            painter.setPen(pen)
+            fill = QColor(pen.color())
+            fill.setAlpha(40)
+            painter.setBrush(fill)
+            painter.drawRect(QRectF(QPointF(start), QPointF(end)).normalized())
+        painter.restore()
+
+    def updateSnapPoints(self, everything=True):
+        scene = self.scene()
+        if hasattr(scene, 'resnap'):
+            scene.resnap(everything)
+            return
+        for item in scene.items():
             if isinstance(item, InteractablePathItem):
-                item.snapAndUpdateGrabbers()
\ No newline at end of file
+                item.snapAndUpdateGrabbers()
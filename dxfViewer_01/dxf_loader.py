@@ -0,0 +1,202 @@
+import time
+from PyQt5.QtCore import QObject, pyqtSignal, pyqtSlot
+from block_paths import BlockPaths
+from blocks import BlockTable, flatten_instances
+from dxf_stream import iter_entities, read_layer_colors
+from geometry_file import GEOMETRY_EXTENSION, GeometryFile
+from geometry_store import GeometryStore, GeometryStoreBuilder
+from instrumentation import profiler
+from containment import hole_owners
+from path_builder import build_paths
+from parallel_profiles import find_profiles_parallel
+from tessellate import DEFAULT_CHORD_TOLERANCE, tessellate_runs
+
+
+class DxfLoader(QObject):
+    # Parses a DXF file and detects its profiles off the GUI thread. Finished
+    # (path, closed, layer name, profile ids) tuples are handed back in
+    # batches so the scene can be populated progressively. With group_holes
+    # the holes of a profile are part of its path and ids lists them after
+    # the profile itself.
+    progress = pyqtSignal(int, int, str)
+    layersReady = pyqtSignal(dict)
+    # Flattened points (M, 2), per profile offsets (P + 1,) and hole owners
+    # (P,), None without group_holes, sent instead of paths when build_paths
+    # is off
+    pointsReady = pyqtSignal(object, object, object)
+    pathsReady = pyqtSignal(list)
+    # Flattened InstanceSet, the layer names it indexes and block name ->
+    # BlockPaths with its paths already built, once per block
+    instancesReady = pyqtSignal(object, object, object)
+    storeReady = pyqtSignal(object)
+    profilesReady = pyqtSignal(object)
+    finished = pyqtSignal()
+    failed = pyqtSignal(str)
+
+    def __init__(self, filename, tolerance=1e-3, chord_tolerance=DEFAULT_CHORD_TOLERANCE, batch_size=500, layers=None,
+                 cache=None, build_paths=True, group_holes=True, jobs=None):
+        super().__init__()
+        self.filename = filename
+        # Optional ParseCache, parsing and profile detection are skipped on a hit
+        self.cache = cache
+        # A virtualized scene builds its own paths for what is on screen
+        self.build_paths = build_paths
+        self.group_holes = group_holes
+        # Worker processes for profile detection, all cores by default
+        self.jobs = jobs
+        self.layers = layers
+        self.tolerance = tolerance
+        self.chord_tolerance = chord_tolerance
+        self.batch_size = batch_size
+        self._cancelled = False
+
+    def cancel(self):
+        # Checked between entities and batches; a running profile detection
+        # itself is not interrupted
+        self._cancelled = True
+
+    def isCancelled(self):
+        return self._cancelled
+
+    @pyqtSlot()
+    def run(self):
+        try:
+            self._load()
+        except Exception as e:
+            self.failed.emit(f"{type(e).__name__}: {e}")
+        self.finished.emit()
+
+    def _load(self):
+        if self.filename.lower().endswith(GEOMETRY_EXTENSION):
+            result = self._mapGeometryFile()
+        else:
+            result = self._parseDxf()
+        if result is None:
+            return
+        store, profiles = result
+        if len(store.instances):
+            self._loadInstances(store)
+            if self._cancelled:
+                return
+
+        # Arcs and bulges of every profile are flattened in one pass
+        with profiler.span('tessellate', profiles=len(profiles)):
+            points, offsets = tessellate_runs(profiles.vertices, profiles.offsets, profiles.closed,
+                                              self.chord_tolerance)
+        profiler.count('profiles', len(profiles))
+        profiler.count('points', len(points))
+        owners = None
+        if self.group_holes:
+            with profiler.span('find holes'):
+                owners = hole_owners(points, offsets, profiles.closed)
+        if not self.build_paths:
+            self.pointsReady.emit(points, offsets, owners)
+            self.progress.emit(1, 1, 'Done')
+            return
+        layers = [store.layers[i] if i < len(store.layers) else None for i in profiles.layers.tolist()]
+        closed = profiles.closed.tolist()
+
+        total = len(profiles)
+        batch = []
+        start = time.perf_counter()
+        for path, ids in build_paths(points, offsets, profiles.closed, owners):
+            if self._cancelled:
+                return
+            batch.append((path, closed[ids[0]], layers[ids[0]], ids))
+            if len(batch) >= self.batch_size:
+                profiler.record('paths', start, time.perf_counter() - start, {'paths': len(batch)})
+                self.pathsReady.emit(batch)
+                self.progress.emit(ids[0] + 1, total, 'Building paths')
+                batch = []
+                start = time.perf_counter()
+        if batch:
+            profiler.record('paths', start, time.perf_counter() - start, {'paths': len(batch)})
+            self.pathsReady.emit(batch)
+        self.progress.emit(total, total, 'Done')
+
+    def _loadInstances(self, store):
+        # Block definitions are converted once however often they are inserted
+        self.progress.emit(0, 0, 'Loading blocks')
+        with profiler.span('read blocks'):
+            table = BlockTable.from_file(self.filename)
+            instances, layer_names = flatten_instances(store.instances, table, store.layers)
+        geometry = {}
+        for name in instances.blocks:
+            if self._cancelled:
+                return
+            with profiler.span('block', block=name):
+                geometry[name] = BlockPaths(table.store(name), self.tolerance, self.chord_tolerance,
+                                            self.group_holes)
+                geometry[name].paths()
+        profiler.count('inserts', len(store.instances))
+        profiler.count('instances', len(instances))
+        profiler.count('blocks', len(geometry))
+        self.instancesReady.emit(instances, layer_names, geometry)
+
+    def _mapGeometryFile(self):
+        # Exported profiles are used straight from the mapped file
+        with profiler.span('map file'):
+            geometry = GeometryFile(self.filename)
+        self.layersReady.emit(geometry.layer_colors)
+        store = geometry.store()
+        if store is None:
+            store = GeometryStore(layers=geometry.layers)
+        profiles = geometry.profiles()
+        self.storeReady.emit(store)
+        self.profilesReady.emit(profiles)
+        return store, profiles
+
+    def _parseDxf(self):
+        # Progress is reported in KiB read so it fits the int signal on huge files
+        def report(done, total):
+            self.progress.emit(done // 1024, total // 1024, 'Reading')
+
+        # Layer name -> AutoCAD color index, from the LAYER table
+        self.layersReady.emit(read_layer_colors(self.filename))
+
+        cached = None
+        if self.cache is not None:
+            with profiler.span('cache load'):
+                cached = self.cache.load(self.filename, self.tolerance, self.layers)
+        if cached is not None:
+            store, profiles = cached
+            self.storeReady.emit(store)
+            self.profilesReady.emit(profiles)
+            return store, profiles
+
+        # Reading and converting are interleaved, the time spent in
+        # builder.add is summed up and reported as its own span
+        builder = GeometryStoreBuilder()
+        start = time.perf_counter()
+        converting = 0.0
+        count = 0
+        for entity in iter_entities(self.filename, layers=self.layers, progress=report):
+            if self._cancelled:
+                return None
+            t = time.perf_counter()
+            builder.add(entity)
+            converting += time.perf_counter() - t
+            count += 1
+        elapsed = time.perf_counter() - start
+        profiler.record('read', start, elapsed - converting, {'file': self.filename})
+        profiler.record('convert', start + elapsed - converting, converting, {'entities': count})
+        profiler.count('entities', count)
+        with profiler.span('build store'):
+            store = builder.build()
+        self.storeReady.emit(store)
+
+        # Find closed profiles
+        self.progress.emit(0, 0, 'Finding profiles')
+        with profiler.span('find profiles', entities=len(store)):
+            profiles = find_profiles_parallel(store, self.tolerance, self.jobs)
+        profiler.count('vertices', len(profiles.vertices))
+        if self._cancelled:
+            return None
+        self.profilesReady.emit(profiles)
+        if self.cache is not None:
+            self.progress.emit(0, 0, 'Caching')
+            try:
+                self.cache.save(self.filename, self.tolerance, store, profiles, self.layers)
+            except OSError as e:
+                print(f"Could not cache {self.filename}: {e}")
+        return store, profiles
@@ -0,0 +1,318 @@
+import os
+from collections import namedtuple
+
+
+# Lightweight records yielded by iter_entities. Coordinates are 2D, the
+# viewers never used Z. Bulges of LWPOLYLINE vertices are kept as the third
+# value of every point.
+Line = namedtuple('Line', 'layer handle start end')
+Circle = namedtuple('Circle', 'layer handle center radius')
+Arc = namedtuple('Arc', 'layer handle center radius start_angle end_angle')
+LWPolyline = namedtuple('LWPolyline', 'layer handle points closed')
+# Block reference; columns, rows and their spacing describe MINSERT arrays
+Insert = namedtuple('Insert', 'layer handle name position scale rotation columns rows column_spacing row_spacing')
+# Block definition from the BLOCKS section, entities relative to nothing in
+# particular: base is the point that lands on an INSERT's position
+Block = namedtuple('Block', 'name base entities')
+
+Line.dxftype = 'LINE'
+Circle.dxftype = 'CIRCLE'
+Arc.dxftype = 'ARC'
+LWPolyline.dxftype = 'LWPOLYLINE'
+Insert.dxftype = 'INSERT'
+
+SUPPORTED_TYPES = frozenset(('LINE', 'CIRCLE', 'ARC', 'LWPOLYLINE', 'INSERT'))
+
+_BINARY_SENTINEL = b'AutoCAD Binary DXF'
+
+
+def _decode(value):
+    try:
+        return value.decode('utf-8')
+    except UnicodeDecodeError:
+        return value.decode('cp1252', 'replace')
+
+
+def _build_line(tags):
+    layer, handle = '0', None
+    x0 = y0 = x1 = y1 = 0.0
+    for code, value in tags:
+        if code == 10:
+            x0 = float(value)
+        elif code == 20:
+            y0 = float(value)
+        elif code == 11:
+            x1 = float(value)
+        elif code == 21:
+            y1 = float(value)
+        elif code == 8:
+            layer = _decode(value)
+        elif code == 5:
+            handle = _decode(value)
+    return Line(layer, handle, (x0, y0), (x1, y1))
+
+
+def _build_circle(tags):
+    layer, handle = '0', None
+    x = y = radius = 0.0
+    for code, value in tags:
+        if code == 10:
+            x = float(value)
+        elif code == 20:
+            y = float(value)
+        elif code == 40:
+            radius = float(value)
+        elif code == 8:
+            layer = _decode(value)
+        elif code == 5:
+            handle = _decode(value)
+    return Circle(layer, handle, (x, y), radius)
+
+
+def _build_arc(tags):
+    layer, handle = '0', None
+    x = y = radius = start_angle = end_angle = 0.0
+    for code, value in tags:
+        if code == 10:
+            x = float(value)
+        elif code == 20:
+            y = float(value)
+        elif code == 40:
+            radius = float(value)
+        elif code == 50:
+            start_angle = float(value)
+        elif code == 51:
+            end_angle = float(value)
+        elif code == 8:
+            layer = _decode(value)
+        elif code == 5:
+            handle = _decode(value)
+    return Arc(layer, handle, (x, y), radius, start_angle, end_angle)
+
+
+def _build_lwpolyline(tags):
+    layer, handle = '0', None
+    flags = 0
+    points = []
+    x = None
+    for code, value in tags:
+        if code == 10:
+            x = float(value)
+        elif code == 20:
+            # A vertex is complete once its Y is known, a following 42 sets its bulge
+            points.append([x, float(value), 0.0])
+        elif code == 42:
+            if points:
+                points[-1][2] = float(value)
+        elif code == 70:
+            flags = int(value)
+        elif code == 8:
+            layer = _decode(value)
+        elif code == 5:
+            handle = _decode(value)
+    return LWPolyline(layer, handle, [tuple(p) for p in points], bool(flags & 1))
+
+
+def _build_insert(tags):
+    layer, handle, name = '0', None, ''
+    x = y = rotation = column_spacing = row_spacing = 0.0
+    sx = sy = 1.0
+    columns = rows = 1
+    for code, value in tags:
+        if code == 10:
+            x = float(value)
+        elif code == 20:
+            y = float(value)
+        elif code == 2:
+            name = _decode(value)
+        elif code == 41:
+            sx = float(value)
+        elif code == 42:
+            sy = float(value)
+        elif code == 50:
+            rotation = float(value)
+        elif code == 70:
+            columns = max(1, int(value))
+        elif code == 71:
+            rows = max(1, int(value))
+        elif code == 44:
+            column_spacing = float(value)
+        elif code == 45:
+            row_spacing = float(value)
+        elif code == 8:
+            layer = _decode(value)
+        elif code == 5:
+            handle = _decode(value)
+    return Insert(layer, handle, name, (x, y), (sx, sy), rotation, columns, rows, column_spacing, row_spacing)
+
+
+_BUILDERS = {
+    b'LINE': _build_line,
+    b'CIRCLE': _build_circle,
+    b'ARC': _build_arc,
+    b'LWPOLYLINE': _build_lwpolyline,
+    b'INSERT': _build_insert,
+}
+
+
+def iter_tags(f):
+    # Yields (group code, raw value) pairs of an ASCII DXF opened in binary mode
+    readline = f.readline
+    while True:
+        code = readline()
+        if not code:
+            return
+        yield int(code), readline().strip()
+
+
+def iter_entities(filename, layers=None, types=None, progress=None, progress_interval=10000):
+    # Streams LINE, CIRCLE, ARC, LWPOLYLINE and INSERT records straight from
+    # the ENTITIES section without building an ezdxf document. Entities of
+    # other types, and tags outside ENTITIES, are skipped without being
+    # parsed. The blocks INSERTs refer to are read by read_blocks.
+    wanted = SUPPORTED_TYPES if types is None else SUPPORTED_TYPES & {t.upper() for t in types}
+    builders = {name: build for name, build in _BUILDERS.items() if name.decode() in wanted}
+    layers = None if layers is None else set(layers)
+    total_size = os.path.getsize(filename)
+
+    with open(filename, 'rb') as f:
+        if f.read(len(_BINARY_SENTINEL)) == _BINARY_SENTINEL:
+            raise ValueError(f"{filename}: binary DXF is not supported")
+        f.seek(0)
+
+        tags = iter_tags(f)
+        section_start = False
+        in_entities = False
+        builder = None
+        entity_tags = []
+        count = 0
+
+        for code, value in tags:
+            if not in_entities:
+                if section_start and code == 2 and value == b'ENTITIES':
+                    in_entities = True
+                section_start = code == 0 and value == b'SECTION'
+                continue
+
+            if code != 0:
+                if builder is not None:
+                    entity_tags.append((code, value))
+                continue
+
+            # Group code 0 closes the previous entity
+            if builder is not None:
+                entity = builder(entity_tags)
+                if layers is None or entity.layer in layers:
+                    yield entity
+                count += 1
+                if progress is not None and count % progress_interval == 0:
+                    progress(f.tell(), total_size)
+                entity_tags = []
+
+            if value == b'ENDSEC':
+                break
+            builder = builders.get(value)
+
+        if progress is not None:
+            progress(total_size, total_size)
+
+
+def read_blocks(filename):
+    # Block name -> Block from the BLOCKS section, with every supported
+    # entity of each definition including nested INSERTs. Layers are not
+    # filtered here, a block's geometry belongs to the layers it is inserted on.
+    blocks = {}
+    with open(filename, 'rb') as f:
+        if f.read(len(_BINARY_SENTINEL)) == _BINARY_SENTINEL:
+            raise ValueError(f"{filename}: binary DXF is not supported")
+        f.seek(0)
+
+        section_start = False
+        in_blocks = False
+        header = None  # tags of the BLOCK record being read
+        name, base, entities = None, (0.0, 0.0), []
+        builder = None
+        entity_tags = []
+        for code, value in iter_tags(f):
+            if not in_blocks:
+                if section_start and code == 2:
+                    if value == b'BLOCKS':
+                        in_blocks = True
+                    elif value == b'ENTITIES':
+                        break
+                section_start = code == 0 and value == b'SECTION'
+                continue
+
+            if code != 0:
+                if header is not None:
+                    header.append((code, value))
+                elif builder is not None:
+                    entity_tags.append((code, value))
+                continue
+
+            if header is not None:
+                x = y = 0.0
+                for tag, tag_value in header:
+                    if tag == 2:
+                        name = _decode(tag_value)
+                    elif tag == 10:
+                        x = float(tag_value)
+                    elif tag == 20:
+                        y = float(tag_value)
+                base, entities, header = (x, y), [], None
+            elif builder is not None:
+                entities.append(builder(entity_tags))
+                entity_tags = []
+
+            builder = None
+            if value == b'BLOCK':
+                header = []
+            elif value == b'ENDBLK':
+                # Model and paper space blocks hold no reusable geometry
+                if name is not None and not name.lower().startswith(('*model_space', '*paper_space')):
+                    blocks[name] = Block(name, base, entities)
+                name = None
+            elif value == b'ENDSEC':
+                break
+            else:
+                builder = _BUILDERS.get(value)
+    return blocks
+
+
+def read_layer_colors(filename):
+    # Layer name -> AutoCAD color index from the LAYER table. Negative
+    # indices mark layers that are switched off, as in the file.
+    colors = {}
+    with open(filename, 'rb') as f:
+        if f.read(len(_BINARY_SENTINEL)) == _BINARY_SENTINEL:
+            raise ValueError(f"{filename}: binary DXF is not supported")
+        f.seek(0)
+
+        section_start = False
+        in_tables = False
+        in_layer = False
+        name = color = None
+        for code, value in iter_tags(f):
+            if not in_tables:
+                if section_start and code == 2:
+                    if value == b'TABLES':
+                        in_tables = True
+                    elif value in (b'BLOCKS', b'ENTITIES'):
+                        # TABLES always comes first, the file has none
+                        break
+                section_start = code == 0 and value == b'SECTION'
+                continue
+
+            if code == 0:
+                if in_layer and name is not None:
+                    colors[name] = 7 if color is None else color
+                in_layer = value == b'LAYER'
+                name = color = None
+                if value == b'ENDSEC':
+                    break
+            elif in_layer:
+                if code == 2:
+                    name = _decode(value)
+                elif code == 62:
+                    color = int(value)
+    return colors
@@ -0,0 +1,402 @@
+import io
+import itertools
+import os
+import re
+from math import atan2, cos, degrees, hypot, sin
+
+import numpy as np
+
+from geometry_store import LINE, CIRCLE, ARC, LWPOLYLINE, KIND_NAMES
+
+# Writing drawings back to DXF without building an ezdxf document.
+#
+# write_dxf streams a new R2000 drawing from GeometryStores: a header, the
+# layer table and one LINE, CIRCLE, ARC or LWPOLYLINE per stored entity,
+# formatted in blocks of numpy rows and written through one large buffer.
+#
+# save_incremental rewrites the DXF a store was read from. The file is
+# indexed line by line with numpy; the k-th LINE of its ENTITIES section is
+# store.lines[k] and so on for every kind, as the stream reader builds them.
+# Only the coordinate values of entities whose transform is not the identity
+# are replaced, every other byte, entity types the viewer does not read
+# included, is copied through. Moved INSERTs get a new position, scale and
+# rotation; block copies whose items were moved apart are replaced by
+# LWPOLYLINEs appended to the section.
+
+FIRST_HANDLE = 0x100
+WRITE_BUFFER = 1 << 22
+IDENTITY = np.array(((1.0, 0.0, 0.0), (0.0, 1.0, 0.0)))
+
+_BINARY_SENTINEL = b'AutoCAD Binary DXF'
+
+# Group codes replaced per kind and the column of the placed store they take
+_FIELDS = {
+    LINE: (('10', 0), ('20', 1), ('11', 2), ('21', 3)),
+    CIRCLE: (('10', 0), ('20', 1), ('40', 2)),
+    ARC: (('10', 0), ('20', 1), ('40', 2), ('50', 3), ('51', 4)),
+}
+
+
+def write_header(f, layers, handseed):
+    # HEADER and TABLES sections, layers as (name, color index) pairs. The
+    # seed must be above every handle in the file.
+    f.write(f'0\nSECTION\n2\nHEADER\n9\n$ACADVER\n1\nAC1015\n9\n$HANDSEED\n5\n{handseed:X}\n0\nENDSEC\n')
+    f.write('0\nSECTION\n2\nTABLES\n0\nTABLE\n2\nLAYER\n')
+    for name, color in layers:
+        f.write(f'0\nLAYER\n2\n{name}\n70\n0\n62\n{color}\n6\nCONTINUOUS\n')
+    f.write('0\nENDTAB\n0\nENDSEC\n')
+
+
+def _layers(layer, n):
+    # One layer name for every row, or the names given per row
+    return itertools.repeat(layer, n) if isinstance(layer, str) else layer
+
+
+class DxfWriter:
+    # Formats entities in blocks of numpy rows, one join per block. Rows get
+    # handles counted up from handle unless handles are given; rows given
+    # handle 0 still get a new one.
+    def __init__(self, f, handle=FIRST_HANDLE):
+        self.f = f
+        self.handle = handle
+        self.count = 0
+
+    def _handles(self, n, handles=None):
+        if handles is None:
+            result = range(self.handle, self.handle + n)
+            self.handle += n
+        else:
+            result = np.array(handles, dtype=np.uint64)
+            missing = np.flatnonzero(result == 0)
+            result[missing] = np.arange(self.handle, self.handle + len(missing), dtype=np.uint64)
+            self.handle += len(missing)
+            result = result.tolist()
+        self.count += n
+        return result
+
+    def lines(self, rows, layer='0', handles=None):
+        rows = np.asarray(rows, dtype=np.float64).reshape(-1, 4)
+        self.f.write(''.join(f'0\nLINE\n5\n{h:X}\n100\nAcDbEntity\n8\n{l}\n100\nAcDbLine\n10\n{x0!r}\n20\n{y0!r}\n30\n0.0\n11\n{x1!r}\n21\n{y1!r}\n31\n0.0\n'
+                             for h, l, (x0, y0, x1, y1) in zip(self._handles(len(rows), handles), _layers(layer, len(rows)), rows.tolist())))
+
+    def circles(self, rows, layer='0', handles=None):
+        rows = np.asarray(rows, dtype=np.float64).reshape(-1, 3)
+        self.f.write(''.join(f'0\nCIRCLE\n5\n{h:X}\n100\nAcDbEntity\n8\n{l}\n100\nAcDbCircle\n10\n{x!r}\n20\n{y!r}\n30\n0.0\n40\n{r!r}\n'
+                             for h, l, (x, y, r) in zip(self._handles(len(rows), handles), _layers(layer, len(rows)), rows.tolist())))
+
+    def arcs(self, rows, layer='0', handles=None):
+        rows = np.asarray(rows, dtype=np.float64).reshape(-1, 5)
+        self.f.write(''.join(f'0\nARC\n5\n{h:X}\n100\nAcDbEntity\n8\n{l}\n100\nAcDbCircle\n10\n{x!r}\n20\n{y!r}\n30\n0.0\n40\n{r!r}\n100\nAcDbArc\n50\n{a0!r}\n51\n{a1!r}\n'
+                             for h, l, (x, y, r, a0, a1) in zip(self._handles(len(rows), handles), _layers(layer, len(rows)), rows.tolist())))
+
+    def inserts(self, names, rows, layer='0', handles=None):
+        # rows (N, 5) x, y, x scale, y scale, rotation in degrees
+        rows = np.asarray(rows, dtype=np.float64).reshape(-1, 5)
+        self.f.write(''.join(f'0\nINSERT\n5\n{h:X}\n100\nAcDbEntity\n8\n{l}\n100\nAcDbBlockReference\n2\n{name}\n10\n{x!r}\n20\n{y!r}\n30\n0.0\n'
+                             f'41\n{sx!r}\n42\n{sy!r}\n50\n{r!r}\n'
+                             for h, l, name, (x, y, sx, sy, r) in zip(self._handles(len(rows), handles), _layers(layer, len(rows)),
+                                                                      names, rows.tolist())))
+
+    def polylines(self, vertices, counts, closed=True, layer='0', handles=None):
+        # vertices (M, 3) x, y, bulge for all polylines, counts vertices per
+        # polyline, closed one flag for all or one per polyline
+        vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 3).tolist()
+        counts = np.asarray(counts).tolist()
+        closed = np.broadcast_to(np.asarray(closed, dtype=bool), (len(counts),)).tolist()
+        out = []
+        start = 0
+        for h, l, n, c in zip(self._handles(len(counts), handles), _layers(layer, len(counts)), counts, closed):
+            out.append(f'0\nLWPOLYLINE\n5\n{h:X}\n100\nAcDbEntity\n8\n{l}\n100\nAcDbPolyline\n90\n{n}\n70\n{1 if c else 0}\n')
+            for x, y, b in vertices[start:start + n]:
+                out.append(f'10\n{x!r}\n20\n{y!r}\n42\n{b!r}\n' if b else f'10\n{x!r}\n20\n{y!r}\n')
+            start += n
+        self.f.write(''.join(out))
+
+    def entities(self, store, block=20000):
+        # Every entity of a GeometryStore on its own layer, keeping the handles it has
+        names = np.array(store.layers, dtype=object)
+        for kind, write, rows in ((LINE, self.lines, store.lines), (CIRCLE, self.circles, store.circles),
+                                  (ARC, self.arcs, store.arcs)):
+            for start in range(0, len(rows), block):
+                part = slice(start, start + block)
+                write(rows[part], names[store.layer_columns[kind][part]], store.handle_columns[kind][part])
+        offsets = store.poly_offsets
+        for start in range(0, len(store.poly_closed), block):
+            stop = min(start + block, len(store.poly_closed))
+            self.polylines(store.poly_vertices[offsets[start]:offsets[stop]], np.diff(offsets[start:stop + 1]),
+                           store.poly_closed[start:stop], names[store.layer_columns[LWPOLYLINE][start:stop]],
+                           store.handle_columns[LWPOLYLINE][start:stop])
+
+
+def write_dxf(filename, stores, layer_colors=None):
+    # New drawing of the entities of stores, already placed where they are
+    # to be written. Handles of the stores are kept, entities without one
+    # get a handle above all of them. Returns the number of entities written.
+    layer_colors = layer_colors or {}
+    names = list(dict.fromkeys(['0'] + [name for store in stores for name in store.layers]))
+    handles = np.concatenate([np.zeros(0, dtype=np.uint64)] + [c for store in stores for c in store.handle_columns])
+    first = max(int(handles.max()) + 1 if len(handles) else 0, FIRST_HANDLE)
+    tmp = filename + '.tmp'
+    with open(tmp, 'w', encoding='cp1252', errors='replace', newline='\n', buffering=WRITE_BUFFER) as f:
+        write_header(f, [(name, layer_colors.get(name, 7)) for name in names], first + int((handles == 0).sum()))
+        f.write('0\nSECTION\n2\nENTITIES\n')
+        writer = DxfWriter(f, first)
+        for store in stores:
+            writer.entities(store)
+        f.write('0\nENDSEC\n0\nEOF\n')
+    os.replace(tmp, filename)
+    return writer.count
+
+
+def insert_parameters(matrix):
+    # (x, y, x scale, y scale, rotation in degrees) of the INSERT placing a
+    # block by matrix, the inverse of insert_matrices; None for shears
+    (a, b, x), (c, d, y) = np.asarray(matrix, dtype=np.float64).tolist()
+    sx = hypot(a, c)
+    if sx == 0:
+        return None
+    angle = atan2(c, a)
+    sy = (a * d - b * c) / sx
+    if not np.allclose((b, d), (-sin(angle) * sy, cos(angle) * sy), atol=1e-9 * max(sx, abs(sy))):
+        return None
+    return x, y, sx, sy, degrees(angle)
+
+
+def insert_changes(instances, handles, deltas, tolerance=1e-6):
+    # Sorts moved block copies into INSERTs that can be rewritten and INSERTs
+    # that have to be exploded. instances is the drawing's own InstanceSet,
+    # handles and deltas (K, 2, 3) give the INSERT of every item drawn for a
+    # block copy and the transform applied to it since loading. Returns
+    # handle -> new block to drawing matrix for copies moved as a whole and
+    # the set of handles whose items moved apart, or that no single INSERT
+    # (MINSERT arrays only rotate and move) can place any more. Deltas
+    # within tolerance of the identity, or of each other, count as equal.
+    handles = np.asarray(handles, dtype=np.uint64)
+    deltas = np.asarray(deltas, dtype=np.float64).reshape(-1, 2, 3)
+    moved = np.unique(handles[~np.all(np.isclose(deltas, IDENTITY, rtol=0, atol=tolerance), axis=(1, 2))])
+    if len(moved) and moved[0] == 0:
+        raise ValueError("a moved block copy has no INSERT handle")
+    order = np.argsort(handles, kind='stable')
+    keys, group_starts = np.unique(handles[order], return_index=True)
+    groups = dict(zip(keys.tolist(), np.split(order, group_starts[1:])))
+    rows, first_rows, cells = np.unique(instances.handles, return_index=True, return_counts=True)
+    first_rows = dict(zip(rows.tolist(), zip(first_rows.tolist(), cells.tolist())))
+
+    inserts, exploded = {}, set()
+    for handle in moved.tolist():
+        group = deltas[groups[handle]]
+        delta = group[0]
+        row, cell_count = first_rows.get(handle, (None, 0))
+        if row is None:
+            raise ValueError(f"block copy of unknown INSERT {handle:X}")
+        matrix = (delta[:, :2] @ instances.matrices[row])
+        matrix[:, 2] += delta[:, 2]
+        rotation_only = np.allclose(delta[:, :2] @ delta[:, :2].T, np.eye(2)) and np.linalg.det(delta[:, :2]) > 0
+        if (np.allclose(group, delta, rtol=0, atol=tolerance) and (cell_count == 1 or rotation_only)
+                and insert_parameters(matrix) is not None):
+            inserts[handle] = matrix
+        else:
+            exploded.add(handle)
+    return inserts, exploded
+
+
+def _line_bounds(buf, crlf):
+    # Start of every line and the end of its text, before any \r\n
+    newlines = np.flatnonzero(buf == 10)
+    if len(buf) and buf[-1] != 10:
+        newlines = np.append(newlines, len(buf))
+    starts = np.empty_like(newlines)
+    starts[:1] = 0
+    starts[1:] = newlines[:-1] + 1
+    ends = newlines - (buf.take(newlines - 1, mode='clip') == 13) if crlf else newlines
+    return starts, ends
+
+
+def _matches(buf, starts, ends, text, code=False):
+    # Lines whose text is text. Group codes may be padded with spaces on the
+    # left. Lines are first filtered on their last character.
+    text = text.encode()
+    rows = np.flatnonzero(buf.take(ends - 1, mode='clip') == text[-1])
+    s, e = starts[rows], ends[rows]
+    first = e - len(text) if code else s
+    keep = (first >= s) if code else (e - s == len(text))
+    for k, c in enumerate(text[:-1]):
+        keep &= buf.take(first + k, mode='clip') == c
+    if code:
+        keep &= (first == s) | (buf.take(first - 1, mode='clip') == 32)
+    match = np.zeros(len(starts), dtype=bool)
+    match[rows[keep]] = True
+    return match
+
+
+def _tag_lines(records, index):
+    # Group code lines of the records at positions index, with the position
+    # in index each belongs to; records end with the section's ENDSEC
+    first = records[index] + 2
+    counts = (records[index + 1] - first) // 2
+    owner = np.repeat(np.arange(len(index)), counts)
+    lines = np.repeat(first - 2 * (np.cumsum(counts) - counts), counts) + 2 * np.arange(counts.sum())
+    return lines, owner
+
+
+class _Edits:
+    # Byte ranges of the source replaced by new text, applied in file order
+    def __init__(self, data, starts, ends):
+        self.data = data
+        self.line_starts = starts
+        self.line_ends = ends
+        self.starts = []
+        self.ends = []
+        self.texts = []
+
+    def values(self, lines, values):
+        # Replaces the text of value lines, keeping their line endings
+        self.starts.append(self.line_starts[lines])
+        self.ends.append(self.line_ends[lines])
+        self.texts.extend(repr(v).encode() for v in np.asarray(values, dtype=np.float64).tolist())
+
+    def add(self, start, end, text):
+        self.starts.append(np.array([start], dtype=np.int64))
+        self.ends.append(np.array([end], dtype=np.int64))
+        self.texts.append(text)
+
+    def write(self, f):
+        if not self.texts:
+            f.write(self.data)
+            return
+        starts, ends = np.concatenate(self.starts), np.concatenate(self.ends)
+        order = np.lexsort((ends, starts))
+        view = memoryview(self.data)
+        texts = self.texts
+        done = 0
+        for start, end, k in zip(starts[order].tolist(), ends[order].tolist(), order.tolist()):
+            f.write(view[done:start])
+            f.write(texts[k])
+            done = end
+        f.write(view[done:])
+
+
+def save_incremental(source, target, store, matrices, inserts=None, removed=(), added=None):
+    # Writes the DXF source, which store was read from, to target with the
+    # entities of store moved by matrices (one (n, 2, 3) array per kind).
+    # inserts maps INSERT handles to new block to drawing matrices, the
+    # INSERTs in removed are dropped and the entities of the store added are
+    # appended with new handles. Raises ValueError when the file does not
+    # match store or an entity cannot be found; target is then untouched.
+    # Returns the number of entities written.
+    inserts = inserts or {}
+    with open(source, 'rb') as f:
+        data = f.read()
+    if data.startswith(_BINARY_SENTINEL):
+        raise ValueError(f"{source}: binary DXF is not supported")
+    buf = np.frombuffer(data, dtype=np.uint8)
+    starts, ends = _line_bounds(buf, b'\r' in data)
+    newline = b'\r\n' if len(starts) > 1 and ends[0] + 2 == starts[1] else b'\n'
+
+    section = re.search(rb'(?:^|\n)[ \t]*0\r?\nSECTION\r?\n[ \t]*2\r?\nENTITIES\r?\n', data)
+    if section is None:
+        raise ValueError(f"{source} has no ENTITIES section")
+    first_code = np.searchsorted(starts, section.end())
+    code_starts, code_ends = starts[first_code:-1:2], ends[first_code:-1:2]
+    records = first_code + 2 * np.flatnonzero(_matches(buf, code_starts, code_ends, '0', code=True))
+    endsec = np.flatnonzero(_matches(buf, starts[records + 1], ends[records + 1], 'ENDSEC'))
+    if not len(endsec):
+        raise ValueError(f"{source}: ENTITIES section is not closed")
+    records = records[:endsec[0] + 1]
+    type_starts, type_ends = starts[records[:-1] + 1], ends[records[:-1] + 1]
+    type_lengths = type_ends - type_starts
+
+    def records_of(name):
+        # Positions in records of the entities of type name
+        rows = np.flatnonzero(type_lengths == len(name))
+        return rows[_matches(buf, type_starts[rows], type_ends[rows], name)]
+
+    positions = [records_of(name) for name in KIND_NAMES]
+    if tuple(len(p) for p in positions) != store.counts():
+        raise ValueError(f"{source} does not hold the entities of the loaded drawing")
+
+    edits = _Edits(data, starts, ends)
+    changed = [np.flatnonzero(np.any(m != IDENTITY, axis=(1, 2))) for m in matrices]
+    placed = store.take(changed).placed([m[c] for m, c in zip(matrices, changed)])
+    for kind, ids in enumerate(changed):
+        if not len(ids):
+            continue
+        index = positions[kind][ids]
+        lines, owner = _tag_lines(records, index)
+        line_starts, line_ends = starts[lines], ends[lines]
+
+        # The ordinal match is checked against the handles that were read
+        handles = store.handle_columns[kind][ids]
+        first = records[index] + 2
+        has_handle = ((handles != 0) & (first < records[index + 1]) &
+                      _matches(buf, starts[first], ends[first], '5', code=True))
+        for line, handle in zip(first[has_handle].tolist(), handles[has_handle].tolist()):
+            if int(data[starts[line + 1]:ends[line + 1]], 16) != handle:
+                raise ValueError(f"{source} does not hold the entities of the loaded drawing")
+
+        if kind == LWPOLYLINE:
+            # Vertices are the 10, 20 (and optional 42) tags in file order
+            x, y, bulge = (_matches(buf, line_starts, line_ends, code, code=True) for code in ('10', '20', '42'))
+            counted = np.cumsum(x)
+            before = np.concatenate(([0], counted))[np.searchsorted(owner, np.arange(len(ids)))]
+            vertex = counted - 1 - before[owner]
+            lengths = np.diff(placed.poly_offsets)
+            valid = (vertex >= 0) & (vertex < lengths[owner])
+            rows = placed.poly_offsets[owner] + vertex
+            for mask, column in ((x, 0), (y, 1), (bulge, 2)):
+                mask = mask & valid
+                edits.values(lines[mask] + 1, placed.poly_vertices[rows[mask], column])
+        else:
+            columns = (placed.lines, placed.circles, placed.arcs)[kind]
+            for code, column in _FIELDS[kind]:
+                mask = _matches(buf, line_starts, line_ends, code, code=True)
+                edits.values(lines[mask] + 1, columns[owner[mask], column])
+
+    # INSERTs are found by handle
+    wanted = set(inserts) | set(removed)
+    found = set()
+    for position in records_of('INSERT').tolist() if wanted else []:
+        tags = {}
+        for line in range(int(records[position]) + 2, int(records[position + 1]), 2):
+            tags.setdefault(data[starts[line]:ends[line]].strip(), line + 1)
+        line = tags.get(b'5')
+        handle = int(data[starts[line]:ends[line]], 16) if line is not None else 0
+        if handle not in wanted:
+            continue
+        found.add(handle)
+        if handle in removed:
+            edits.add(int(starts[records[position]]), int(starts[records[position + 1]]), b'')
+            continue
+        x, y, sx, sy, rotation = insert_parameters(inserts[handle])
+        missing = []
+        for code, value in ((b'10', x), (b'20', y), (b'41', sx), (b'42', sy), (b'50', rotation)):
+            if code in tags:
+                edits.values(np.array([tags[code]]), [value])
+            else:
+                missing.append(newline.join((b'', code, repr(value).encode())))
+        if missing:
+            after = int(ends[tags.get(b'30') or tags.get(b'20') or records[position] + 1])
+            edits.add(after, after, b''.join(missing))
+    if wanted - found:
+        raise ValueError(f"{source} has no INSERT {min(wanted - found):X}")
+
+    count = sum(len(ids) for ids in changed) + len(inserts) + len(removed)
+    if added is not None and len(added):
+        # New handles start at the file's seed, which moves past them
+        seed = re.search(rb'\$HANDSEED\r?\n[ \t]*5\r?\n[ \t]*([0-9A-Fa-f]+)', data[:section.start()])
+        used = np.concatenate([c for c in store.handle_columns] + [store.instances.handles])
+        first = max(int(used.max()) + 1 if len(used) else 0, int(seed.group(1), 16) if seed else 0, FIRST_HANDLE)
+        text = io.StringIO()
+        writer = DxfWriter(text, first)
+        writer.entities(added)
+        edits.add(int(starts[records[-1]]), int(starts[records[-1]]),
+                  text.getvalue().encode('cp1252', 'replace').replace(b'\n', newline))
+        if seed:
+            edits.add(seed.start(1), seed.end(1), f'{writer.handle:X}'.encode())
+        count += writer.count
+
+    tmp = target + '.tmp'
+    with open(tmp, 'wb', buffering=WRITE_BUFFER) as f:
+        edits.write(f)
+    os.replace(tmp, target)
+    return count
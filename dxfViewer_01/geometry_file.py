@@ -0,0 +1,202 @@
+import mmap
+import os
+import struct
+
+import numpy as np
+
+from geometry_store import GeometryStore
+from profile_engine import ProfileSet
+
+# Binary file of detected profiles (and optionally the entities they came
+# from), laid out so it can be memory mapped and used in place:
+#
+#   header     magic, version, section count                  16 bytes
+#   sections   per section: name, dtype, shape, offset, size   64 bytes each
+#   data       the arrays, little endian, each 64 byte aligned
+#
+# The profile index (offsets and per profile bounds) lets a reader pull out
+# one profile by touching only the pages it lives on. Layer names are stored
+# as one NUL separated UTF-8 blob.
+
+GEOMETRY_EXTENSION = '.dxfgeom'
+MAGIC = b'DXFGEOM\0'
+VERSION = 1
+
+_HEADER = struct.Struct('<8sII')
+_SECTION = struct.Struct('<16s8sQQQQ')  # name, dtype, rows, columns, offset, bytes
+_ALIGN = 64
+
+_PROFILE_SECTIONS = ('vertices', 'offsets', 'closed', 'layers', 'edges', 'edge_offsets', 'dangling')
+_STORE_SECTIONS = ('lines', 'circles', 'arcs', 'poly_vertices', 'poly_offsets', 'poly_closed')
+_DTYPES = {
+    'vertices': '<f8', 'offsets': '<i8', 'closed': '|b1', 'layers': '<i4', 'edges': '<i8', 'edge_offsets': '<i8',
+    'dangling': '<i8', 'bounds': '<f8', 'layer_names': '|u1', 'layer_colors': '<i4',
+    'lines': '<f8', 'circles': '<f8', 'arcs': '<f8', 'poly_vertices': '<f8', 'poly_offsets': '<i8',
+    'poly_closed': '|b1', 'store_layers': '<i4', 'store_handles': '<u8',
+}
+
+
+def profile_bounds(profiles):
+    # (P, 4) xmin, ymin, xmax, ymax of every profile from its vertices. Bulged
+    # segments may bow out a little further, the index is meant for culling.
+    vertices, offsets = profiles.vertices, profiles.offsets
+    bounds = np.full((len(offsets) - 1, 4), np.nan)
+    non_empty = np.flatnonzero(np.diff(offsets) > 0)
+    if len(non_empty):
+        starts = offsets[non_empty]
+        bounds[non_empty, 0] = np.minimum.reduceat(vertices[:, 0], starts)
+        bounds[non_empty, 1] = np.minimum.reduceat(vertices[:, 1], starts)
+        bounds[non_empty, 2] = np.maximum.reduceat(vertices[:, 0], starts)
+        bounds[non_empty, 3] = np.maximum.reduceat(vertices[:, 1], starts)
+    return bounds
+
+
+def write_geometry_file(filename, profiles, store=None, layers=None, layer_colors=None):
+    # Writes profiles, and the store they were found in if given. layers are
+    # the names profiles.layers index into, store.layers by default;
+    # layer_colors maps layer names to AutoCAD color indices.
+    if layers is None:
+        layers = store.layers if store is not None else []
+    layers = list(layers)
+    layer_colors = layer_colors or {}
+
+    arrays = [(name, getattr(profiles, name)) for name in _PROFILE_SECTIONS]
+    arrays.append(('bounds', profile_bounds(profiles)))
+    arrays.append(('layer_names', np.frombuffer('\0'.join(layers).encode('utf-8'), dtype=np.uint8)))
+    arrays.append(('layer_colors', np.array([layer_colors.get(name, 7) for name in layers], dtype=np.int32)))
+    if store is not None:
+        arrays += [(name, getattr(store, name)) for name in _STORE_SECTIONS]
+        arrays += [(f'store_layers{k}', c) for k, c in enumerate(store.layer_columns)]
+        arrays += [(f'store_handles{k}', c) for k, c in enumerate(store.handle_columns)]
+
+    sections = []
+    offset = _align(_HEADER.size + _SECTION.size * len(arrays))
+    for name, array in arrays:
+        dtype = _DTYPES[name.rstrip('0123456789')]
+        array = np.ascontiguousarray(array, dtype=dtype)
+        rows = array.shape[0] if array.ndim else 1
+        columns = array.shape[1] if array.ndim > 1 else 0
+        sections.append((name, dtype, rows, columns, offset, array))
+        offset = _align(offset + array.nbytes)
+
+    tmp = filename + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, len(sections)))
+        for name, dtype, rows, columns, data_offset, array in sections:
+            f.write(_SECTION.pack(name.encode(), dtype.encode(), rows, columns, data_offset, array.nbytes))
+        for name, dtype, rows, columns, data_offset, array in sections:
+            f.write(b'\0' * (data_offset - f.tell()))
+            f.write(array.tobytes())
+        f.write(b'\0' * (offset - f.tell()))
+    os.replace(tmp, filename)
+
+
+def _align(offset):
+    return (offset + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+class GeometryFile:
+    # Read side of the format. Every array is a read-only view straight
+    # into the mapped file, nothing is copied or read before it is used.
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = open(filename, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError(f"{filename}: not a geometry file")
+        try:
+            self._sections = self._readSections()
+        except ValueError:
+            self.close()
+            raise
+        names = bytes(self.array('layer_names')).decode('utf-8')
+        self.layers = names.split('\0') if names else []
+        self.layer_colors = dict(zip(self.layers, self.array('layer_colors').tolist()))
+        self._offsets = self.array('offsets')
+
+    def _readSections(self):
+        if len(self._map) < _HEADER.size:
+            raise ValueError(f"{self.filename}: not a geometry file")
+        magic, version, count = _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{self.filename}: not a geometry file")
+        if version > VERSION:
+            raise ValueError(f"{self.filename}: format version {version} is newer than this reader")
+        sections = {}
+        for k in range(count):
+            name, dtype, rows, columns, offset, nbytes = _SECTION.unpack_from(self._map, _HEADER.size + k * _SECTION.size)
+            if offset + nbytes > len(self._map):
+                raise ValueError(f"{self.filename}: truncated")
+            sections[name.rstrip(b'\0').decode()] = (dtype.rstrip(b'\0').decode(), rows, columns, offset)
+        return sections
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        # Arrays handed out keep the mapping alive until they are released
+        self._sections = {}
+        self._file.close()
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __contains__(self, name):
+        return name in self._sections
+
+    def array(self, name):
+        dtype, rows, columns, offset = self._sections[name]
+        shape = (rows, columns) if columns else (rows,)
+        if not rows:
+            return np.zeros(shape, dtype=dtype)
+        return np.frombuffer(self._map, dtype=dtype, count=rows * max(columns, 1), offset=offset).reshape(shape)
+
+    # Random access to single profiles
+
+    def profile(self, i):
+        # (n, 3) x, y, bulge vertices of profile i
+        start, end = self._offsets[i], self._offsets[i + 1]
+        dtype, rows, columns, offset = self._sections['vertices']
+        if end == start:
+            return np.zeros((0, 3))
+        return np.frombuffer(self._map, dtype=dtype, count=(end - start) * 3,
+                             offset=offset + int(start) * 24).reshape(-1, 3)
+
+    def isClosed(self, i):
+        return bool(self.array('closed')[i])
+
+    def layer(self, i):
+        layer = int(self.array('layers')[i])
+        return self.layers[layer] if 0 <= layer < len(self.layers) else None
+
+    def bounds(self, i=None):
+        # Bounds of profile i, or the (P, 4) bounds of all of them
+        bounds = self.array('bounds')
+        return bounds if i is None else bounds[i]
+
+    def query_rect(self, xmin, ymin, xmax, ymax):
+        # Indices of the profiles whose bounds intersect the rectangle
+        b = self.array('bounds')
+        return np.flatnonzero((b[:, 0] <= xmax) & (b[:, 2] >= xmin) & (b[:, 1] <= ymax) & (b[:, 3] >= ymin))
+
+    # Whole sets, as used by the viewer and the headless pipeline
+
+    def profiles(self):
+        return ProfileSet(*(self.array(name) for name in _PROFILE_SECTIONS))
+
+    def hasStore(self):
+        return 'lines' in self._sections
+
+    def store(self):
+        # GeometryStore saved alongside the profiles, None if there was none
+        if not self.hasStore():
+            return None
+        return GeometryStore(*(self.array(name) for name in _STORE_SECTIONS), layers=self.layers,
+                             layer_columns=[self.array(f'store_layers{k}') for k in range(4)],
+                             handle_columns=[self.array(f'store_handles{k}') for k in range(4)])
@@ -0,0 +1,359 @@
+from array import array
+
+import numpy as np
+
+from dxf_stream import iter_entities
+
+
+LINE, CIRCLE, ARC, LWPOLYLINE = 0, 1, 2, 3
+KIND_NAMES = ('LINE', 'CIRCLE', 'ARC', 'LWPOLYLINE')
+
+
+def _handle_to_int(handle):
+    try:
+        return int(handle, 16)
+    except (TypeError, ValueError):
+        return 0
+
+
+class GeometryStore:
+    # Array-backed storage for the geometry of a drawing, one typed column
+    # set per entity kind:
+    #   lines          (N, 4) float64  x0, y0, x1, y1
+    #   circles        (N, 3) float64  cx, cy, r
+    #   arcs           (N, 5) float64  cx, cy, r, start_angle, end_angle (degrees, CCW)
+    #   poly_vertices  (M, 3) float64  x, y, bulge
+    #   poly_offsets   (P + 1,) int64  vertices of polyline i are poly_vertices[poly_offsets[i]:poly_offsets[i + 1]]
+    #   poly_closed    (P,) bool
+    # Every kind also has a layer column (int32 index into self.layers) and a
+    # handle column (uint64, 0 when the entity had no handle). Block INSERTs
+    # are kept apart in self.instances, their blocks are never expanded into
+    # the columns.
+
+    def __init__(self, lines=None, circles=None, arcs=None,
+                 poly_vertices=None, poly_offsets=None, poly_closed=None,
+                 layers=None, layer_columns=None, handle_columns=None, instances=None):
+        self.lines = _float_array(lines, 4)
+        self.circles = _float_array(circles, 3)
+        self.arcs = _float_array(arcs, 5)
+        self.poly_vertices = _float_array(poly_vertices, 3)
+        self.poly_offsets = np.zeros(1, dtype=np.int64) if poly_offsets is None else np.asarray(poly_offsets, dtype=np.int64)
+        self.poly_closed = np.zeros(0, dtype=bool) if poly_closed is None else np.asarray(poly_closed, dtype=bool)
+        self.layers = list(layers or [])
+
+        counts = self.counts()
+        layer_columns = layer_columns or [None] * 4
+        handle_columns = handle_columns or [None] * 4
+        self.layer_columns = [np.zeros(n, dtype=np.int32) if c is None else np.asarray(c, dtype=np.int32)
+                              for n, c in zip(counts, layer_columns)]
+        self.handle_columns = [np.zeros(n, dtype=np.uint64) if c is None else np.asarray(c, dtype=np.uint64)
+                               for n, c in zip(counts, handle_columns)]
+        self.instances = instances if instances is not None else InstanceSet()
+
+    @classmethod
+    def from_entities(cls, entities):
+        builder = GeometryStoreBuilder()
+        for entity in entities:
+            builder.add(entity)
+        return builder.build()
+
+    @classmethod
+    def from_file(cls, filename, layers=None, types=None):
+        return cls.from_entities(iter_entities(filename, layers=layers, types=types))
+
+    def counts(self):
+        return (len(self.lines), len(self.circles), len(self.arcs), len(self.poly_closed))
+
+    def __len__(self):
+        return sum(self.counts())
+
+    @property
+    def nbytes(self):
+        columns = [self.lines, self.circles, self.arcs, self.poly_vertices, self.poly_offsets, self.poly_closed]
+        return sum(c.nbytes for c in columns + self.layer_columns + self.handle_columns) + self.instances.nbytes
+
+    def polyline(self, i):
+        return self.poly_vertices[self.poly_offsets[i]:self.poly_offsets[i + 1]]
+
+    def layer_id(self, name):
+        try:
+            return self.layers.index(name)
+        except ValueError:
+            return -1
+
+    def entity_bounds(self):
+        # Per-entity (xmin, ymin, xmax, ymax), one (n, 4) array per kind
+        lines = self.lines
+        line_bounds = np.column_stack((np.minimum(lines[:, 0], lines[:, 2]), np.minimum(lines[:, 1], lines[:, 3]),
+                                       np.maximum(lines[:, 0], lines[:, 2]), np.maximum(lines[:, 1], lines[:, 3])))
+
+        c = self.circles
+        circle_bounds = np.column_stack((c[:, 0] - c[:, 2], c[:, 1] - c[:, 2], c[:, 0] + c[:, 2], c[:, 1] + c[:, 2]))
+
+        arc_bounds = _arc_bounds(self.arcs)
+
+        v = self.poly_vertices
+        n_poly = len(self.poly_closed)
+        if n_poly and len(v):
+            starts = self.poly_offsets[:-1]
+            # reduceat needs non-empty segments, empty polylines get NaN bounds
+            empty = self.poly_offsets[1:] == starts
+            safe_starts = np.minimum(starts, len(v) - 1)
+            poly_bounds = np.column_stack((np.minimum.reduceat(v[:, 0], safe_starts), np.minimum.reduceat(v[:, 1], safe_starts),
+                                           np.maximum.reduceat(v[:, 0], safe_starts), np.maximum.reduceat(v[:, 1], safe_starts)))
+            poly_bounds[empty] = np.nan
+        else:
+            poly_bounds = np.full((n_poly, 4), np.nan)
+
+        return [line_bounds, circle_bounds, arc_bounds, poly_bounds]
+
+    def bounds(self):
+        # Overall (xmin, ymin, xmax, ymax), None for an empty store. Polyline
+        # bulges are bounded by their chord vertices only.
+        all_bounds = np.concatenate(self.entity_bounds())
+        if not len(all_bounds) or np.isnan(all_bounds).all():
+            return None
+        return (np.nanmin(all_bounds[:, 0]), np.nanmin(all_bounds[:, 1]),
+                np.nanmax(all_bounds[:, 2]), np.nanmax(all_bounds[:, 3]))
+
+    def query_rect(self, xmin, ymin, xmax, ymax):
+        # Indices of the entities whose bounds intersect the rectangle, one array per kind
+        result = []
+        for b in self.entity_bounds():
+            hit = (b[:, 0] <= xmax) & (b[:, 2] >= xmin) & (b[:, 1] <= ymax) & (b[:, 3] >= ymin)
+            result.append(np.flatnonzero(hit))
+        return result
+
+    def select_layers(self, names):
+        # New store holding only the entities on the given layers
+        ids = np.array([self.layer_id(n) for n in names], dtype=np.int32)
+        masks = [np.isin(column, ids) for column in self.layer_columns]
+        return self.take(masks)
+
+    def take(self, masks):
+        # New store holding the entities selected by one boolean mask or index array per kind
+        lines, circles, arcs, polys = [m if m.dtype == bool else m.astype(np.int64)
+                                       for m in (np.asarray(m) for m in masks)]
+        poly_ids = np.flatnonzero(polys) if polys.dtype == bool else polys
+        starts = self.poly_offsets[poly_ids]
+        lengths = self.poly_offsets[poly_ids + 1] - starts
+        vertex_ids = np.repeat(starts - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths) + np.arange(lengths.sum())
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+        return GeometryStore(self.lines[lines], self.circles[circles], self.arcs[arcs],
+                             self.poly_vertices[vertex_ids], offsets, self.poly_closed[poly_ids], self.layers,
+                             [c[m] for c, m in zip(self.layer_columns, (lines, circles, arcs, poly_ids))],
+                             [c[m] for c, m in zip(self.handle_columns, (lines, circles, arcs, poly_ids))],
+                             self.instances)
+
+    def transformed(self, matrix):
+        # Copy of the store with a 2D affine transform applied. matrix is
+        # ((a, b, tx), (c, d, ty)) or a 3x3 array mapping column vectors. The
+        # transform must be a similarity (uniform scale, rotation, mirroring)
+        # so circles and arcs stay circular.
+        m = np.asarray(matrix, dtype=np.float64)[:2]
+        store = self.placed([np.broadcast_to(m, (n, 2, 3)) for n in self.counts()])
+        store.instances = self.instances.transformed(matrix)
+        return store
+
+    def placed(self, matrices):
+        # Copy of the store with every entity moved by its own transform, one
+        # (n, 2, 3) array per kind in store order. Every transform must be a
+        # similarity as for transformed; block instances are left where they are.
+        lines_m, circles_m, arcs_m, polys_m = [np.asarray(m, dtype=np.float64).reshape(-1, 2, 3) for m in matrices]
+        polys_m = np.repeat(polys_m, np.diff(self.poly_offsets), axis=0)
+
+        def similarity(m):
+            # Scale, rotation in degrees and mirroring of every transform
+            linear = m[:, :, :2]
+            det = linear[:, 0, 0] * linear[:, 1, 1] - linear[:, 0, 1] * linear[:, 1, 0]
+            scale = np.sqrt(abs(det))
+            if not np.allclose(linear @ linear.transpose(0, 2, 1), np.eye(2) * (scale * scale)[:, None, None]):
+                raise ValueError("only similarity transforms are supported")
+            return scale, np.degrees(np.arctan2(linear[:, 1, 0], linear[:, 0, 0])), det < 0
+
+        def apply(points, m):
+            return np.einsum('kij,kj->ki', m[:, :, :2], points) + m[:, :, 2]
+
+        lines = np.column_stack((apply(self.lines[:, 0:2], lines_m), apply(self.lines[:, 2:4], lines_m)))
+        scale = similarity(circles_m)[0]
+        circles = np.column_stack((apply(self.circles[:, 0:2], circles_m), self.circles[:, 2] * scale))
+
+        scale, rotation, mirrored = similarity(arcs_m)
+        arcs = self.arcs.copy()
+        arcs[:, 0:2] = apply(self.arcs[:, 0:2], arcs_m)
+        arcs[:, 2] *= scale
+        # A mirror reverses the sweep direction, so start and end swap
+        arcs[:, 3] = np.where(mirrored, rotation - self.arcs[:, 4], self.arcs[:, 3] + rotation) % 360
+        arcs[:, 4] = np.where(mirrored, rotation - self.arcs[:, 3], self.arcs[:, 4] + rotation) % 360
+
+        mirrored = similarity(polys_m)[2]
+        poly_vertices = self.poly_vertices.copy()
+        poly_vertices[:, 0:2] = apply(self.poly_vertices[:, 0:2], polys_m)
+        poly_vertices[mirrored, 2] = -poly_vertices[mirrored, 2]
+
+        return GeometryStore(lines, circles, arcs, poly_vertices, self.poly_offsets.copy(), self.poly_closed.copy(),
+                             self.layers, [c.copy() for c in self.layer_columns], [c.copy() for c in self.handle_columns],
+                             self.instances)
+
+    def translated(self, dx, dy):
+        return self.transformed(((1.0, 0.0, dx), (0.0, 1.0, dy)))
+
+
+class GeometryStoreBuilder:
+    # Accumulates stream records in flat typed arrays so no per-entity Python
+    # objects are kept alive, then converts them to NumPy columns once.
+
+    def __init__(self):
+        self._layers = {}
+        self._lines = array('d')
+        self._circles = array('d')
+        self._arcs = array('d')
+        self._poly_vertices = array('d')
+        self._poly_offsets = array('q', [0])
+        self._poly_closed = array('b')
+        self._layer_columns = [array('i') for _ in range(4)]
+        self._handle_columns = [array('Q') for _ in range(4)]
+        self._blocks = {}
+        self._insert_blocks = array('i')
+        self._insert_matrices = array('d')
+        self._insert_layers = array('i')
+        self._insert_handles = array('Q')
+
+    def _layer(self, name):
+        layer_id = self._layers.get(name)
+        if layer_id is None:
+            layer_id = self._layers[name] = len(self._layers)
+        return layer_id
+
+    def _tag(self, kind, entity):
+        self._layer_columns[kind].append(self._layer(entity.layer))
+        self._handle_columns[kind].append(_handle_to_int(entity.handle))
+
+    def add(self, entity):
+        dxftype = entity.dxftype
+        if dxftype == 'LINE':
+            self._lines.extend((entity.start[0], entity.start[1], entity.end[0], entity.end[1]))
+            self._tag(LINE, entity)
+        elif dxftype == 'CIRCLE':
+            self._circles.extend((entity.center[0], entity.center[1], entity.radius))
+            self._tag(CIRCLE, entity)
+        elif dxftype == 'ARC':
+            self._arcs.extend((entity.center[0], entity.center[1], entity.radius, entity.start_angle, entity.end_angle))
+            self._tag(ARC, entity)
+        elif dxftype == 'LWPOLYLINE':
+            for point in entity.points:
+                self._poly_vertices.extend(point)
+            self._poly_offsets.append(len(self._poly_vertices) // 3)
+            self._poly_closed.append(entity.closed)
+            self._tag(LWPOLYLINE, entity)
+        elif dxftype == 'INSERT':
+            block = self._blocks.setdefault(entity.name, len(self._blocks))
+            matrices = insert_matrices(entity)
+            self._insert_matrices.extend(matrices.ravel().tolist())
+            self._insert_blocks.extend([block] * len(matrices))
+            self._insert_layers.extend([self._layer(entity.layer)] * len(matrices))
+            self._insert_handles.extend([_handle_to_int(entity.handle)] * len(matrices))
+
+    def build(self):
+        layers = sorted(self._layers, key=self._layers.get)
+        return GeometryStore(
+            np.frombuffer(self._lines, dtype=np.float64).reshape(-1, 4),
+            np.frombuffer(self._circles, dtype=np.float64).reshape(-1, 3),
+            np.frombuffer(self._arcs, dtype=np.float64).reshape(-1, 5),
+            np.frombuffer(self._poly_vertices, dtype=np.float64).reshape(-1, 3),
+            np.frombuffer(self._poly_offsets, dtype=np.int64),
+            np.frombuffer(self._poly_closed, dtype=np.int8).astype(bool),
+            layers,
+            [np.frombuffer(c, dtype=np.int32) for c in self._layer_columns],
+            [np.frombuffer(c, dtype=np.uint64) for c in self._handle_columns],
+            InstanceSet(sorted(self._blocks, key=self._blocks.get),
+                        np.frombuffer(self._insert_blocks, dtype=np.int32),
+                        np.frombuffer(self._insert_matrices, dtype=np.float64).reshape(-1, 2, 3),
+                        np.frombuffer(self._insert_layers, dtype=np.int32),
+                        np.frombuffer(self._insert_handles, dtype=np.uint64)),
+        )
+
+
+class InstanceSet:
+    # Placements of blocks, one row per placed copy (a MINSERT array gives
+    # one row per cell):
+    #   blocks    list of block names
+    #   block_ids (K,) int32         index into blocks
+    #   matrices  (K, 2, 3) float64  affine map ((a, b, tx), (c, d, ty)) from
+    #                                block coordinates to the parent's
+    #   layers    (K,) int32         layer index, into the owning store's layers
+    #   handles   (K,) uint64        handle of the INSERT, 0 when it had none
+
+    def __init__(self, blocks=None, block_ids=None, matrices=None, layers=None, handles=None):
+        self.blocks = list(blocks or [])
+        self.block_ids = np.zeros(0, dtype=np.int32) if block_ids is None else np.asarray(block_ids, dtype=np.int32)
+        self.matrices = np.zeros((0, 2, 3)) if matrices is None else np.asarray(matrices, dtype=np.float64).reshape(-1, 2, 3)
+        self.layers = np.zeros(len(self.block_ids), dtype=np.int32) if layers is None else np.asarray(layers, dtype=np.int32)
+        self.handles = np.zeros(len(self.block_ids), dtype=np.uint64) if handles is None else np.asarray(handles, dtype=np.uint64)
+
+    def __len__(self):
+        return len(self.block_ids)
+
+    @property
+    def nbytes(self):
+        return self.block_ids.nbytes + self.matrices.nbytes + self.layers.nbytes + self.handles.nbytes
+
+    def transformed(self, matrix):
+        # Copy with a 2D affine transform applied after every placement
+        m = np.vstack((np.asarray(matrix, dtype=np.float64)[:2], (0.0, 0.0, 1.0)))
+        placed = np.concatenate((self.matrices, np.broadcast_to((0.0, 0.0, 1.0), (len(self), 1, 3))), axis=1)
+        return InstanceSet(self.blocks, self.block_ids.copy(), (m @ placed)[:, :2], self.layers.copy(),
+                           self.handles.copy())
+
+
+def insert_matrices(insert):
+    # (K, 2, 3) block to parent maps of an INSERT, one per MINSERT cell. The
+    # block's base point is not included, see blocks.flatten_instances.
+    angle = np.radians(insert.rotation)
+    cos, sin = np.cos(angle), np.sin(angle)
+    sx, sy = insert.scale
+    # Array spacing is measured along the rotated but unscaled block axes
+    i, j = np.meshgrid(np.arange(insert.columns), np.arange(insert.rows), indexing='ij')
+    dx, dy = i.ravel() * insert.column_spacing, j.ravel() * insert.row_spacing
+    x, y = insert.position
+    matrices = np.empty((len(dx), 2, 3))
+    matrices[:, 0, 0], matrices[:, 0, 1] = cos * sx, -sin * sy
+    matrices[:, 1, 0], matrices[:, 1, 1] = sin * sx, cos * sy
+    matrices[:, 0, 2] = x + cos * dx - sin * dy
+    matrices[:, 1, 2] = y + sin * dx + cos * dy
+    return matrices
+
+
+def _float_array(values, width):
+    if values is None:
+        return np.zeros((0, width), dtype=np.float64)
+    return np.asarray(values, dtype=np.float64).reshape(-1, width)
+
+
+def sweep_angles(start_angles, end_angles):
+    # CCW sweep in degrees from start to end, in (0, 360]
+    sweep = (end_angles - start_angles) % 360
+    return np.where(sweep == 0, 360.0, sweep)
+
+
+def _arc_bounds(arcs):
+    cx, cy, r, start, end = arcs.T
+    sweep = sweep_angles(start, end)
+    start_rad = np.radians(start)
+    end_rad = np.radians(start + sweep)
+    xs = [cx + r * np.cos(start_rad), cx + r * np.cos(end_rad)]
+    ys = [cy + r * np.sin(start_rad), cy + r * np.sin(end_rad)]
+    xmin, xmax = np.minimum(*xs), np.maximum(*xs)
+    ymin, ymax = np.minimum(*ys), np.maximum(*ys)
+    # Axis extremes at 0, 90, 180 and 270 degrees are included when the sweep crosses them
+    for quadrant in range(4):
+        crossed = (quadrant * 90 - start) % 360 <= sweep
+        if quadrant == 0:
+            xmax = np.where(crossed, cx + r, xmax)
+        elif quadrant == 1:
+            ymax = np.where(crossed, cy + r, ymax)
+        elif quadrant == 2:
+            xmin = np.where(crossed, cx - r, xmin)
+        else:
+            ymin = np.where(crossed, cy - r, ymin)
+    return np.column_stack((xmin, ymin, xmax, ymax))
@@ -0,0 +1,114 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+# Named timing spans and counters for the hot paths of the viewer: loading
+# (read, convert, build store, find profiles, tessellate, paths), scene
+# insertion, painting and snapping. Spans are kept in a bounded ring so a
+# long session does not grow without limit, and can be written out as a
+# Chrome trace (chrome://tracing, ui.perfetto.dev). Nothing here imports
+# PyQt5, the headless tools can record into it as well.
+#
+#   with profiler.span('find profiles', entities=len(store)):
+#       profiles = find_profiles(store)
+#   profiler.count('vertices', len(profiles.vertices))
+
+
+class Profiler:
+    def __init__(self, max_events=200000):
+        self.enabled = True
+        self._lock = threading.Lock()
+        self._events = deque(maxlen=max_events)
+        self._stats = defaultdict(lambda: [0, 0.0, 0.0, 0.0])  # count, total, max, last
+        self._counters = defaultdict(int)
+        self._thread_names = {}
+        self._origin = time.perf_counter()
+
+    @contextmanager
+    def span(self, name, **args):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter() - start, args)
+
+    def record(self, name, start, duration, args=None):
+        # A finished span, start in perf_counter seconds
+        if not self.enabled:
+            return
+        thread = threading.current_thread()
+        with self._lock:
+            self._thread_names.setdefault(thread.ident, thread.name)
+            self._events.append((name, thread.ident, start, duration, args or None))
+            stats = self._stats[name]
+            stats[0] += 1
+            stats[1] += duration
+            stats[2] = max(stats[2], duration)
+            stats[3] = duration
+
+    def count(self, name, n=1):
+        if self.enabled:
+            with self._lock:
+                self._counters[name] += n
+
+    def counters(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def summary(self):
+        # name -> (count, total, mean, max, last) in seconds, over the whole session
+        with self._lock:
+            return {name: (count, total, total / count, longest, last)
+                    for name, (count, total, longest, last) in self._stats.items()}
+
+    def clear(self):
+        with self._lock:
+            self._events.clear()
+            self._stats.clear()
+            self._counters.clear()
+
+    def chrome_trace(self):
+        # Trace Event Format dict: complete events in microseconds plus thread names
+        with self._lock:
+            events = list(self._events)
+            counters = dict(self._counters)
+            thread_names = dict(self._thread_names)
+        pid = os.getpid()
+        trace = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+                 for tid, name in thread_names.items()]
+        for name, tid, start, duration, args in events:
+            event = {'name': name, 'ph': 'X', 'pid': pid, 'tid': tid,
+                     'ts': (start - self._origin) * 1e6, 'dur': duration * 1e6}
+            if args:
+                event['args'] = args
+            trace.append(event)
+        if counters:
+            end = max((start + duration for _, _, start, duration, _ in events), default=self._origin)
+            trace.append({'name': 'counters', 'ph': 'C', 'pid': pid, 'tid': 0,
+                          'ts': (end - self._origin) * 1e6, 'args': counters})
+        return {'traceEvents': trace, 'displayTimeUnit': 'ms'}
+
+    def write_chrome_trace(self, filename):
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump(self.chrome_trace(), f)
+
+    def report(self):
+        # Plain text table of the spans and counters, slowest total first
+        lines = []
+        summary = sorted(self.summary().items(), key=lambda item: -item[1][1])
+        for name, (count, total, mean, longest, last) in summary:
+            lines.append(f"{name:<14} {count:>7}x  last {last * 1e3:8.2f} ms  mean {mean * 1e3:8.2f} ms  "
+                         f"max {longest * 1e3:8.2f} ms  total {total:7.2f} s")
+        for name, value in sorted(self.counters().items()):
+            lines.append(f"{name:<14} {value:>12,}")
+        return '\n'.join(lines)
+
+
+# Shared by the whole process
+profiler = Profiler()
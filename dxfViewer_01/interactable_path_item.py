@@ -1,58 +1,294 @@
-from PyQt5.QtWidgets import QGraphicsItem, QGraphicsPathItem, QGraphicsRectItem
-from PyQt5.QtCore import QTimer, QPointF, Qt
-from PyQt5.QtGui import QPainter, QPainterPath, QPen, QColor, QBrush
+from PyQt5.QtWidgets import QGraphicsItem, QGraphicsPathItem
+from PyQt5.QtCore import QTimer, QPointF, QRectF, Qt
+from PyQt5.QtGui import QPainter, QPainterPath, QPen, QColor, QBrush, QTransform
 from PyQt5 import QtCore
+import numpy as np
+from simplify import simplify
+from path_builder import polygon_from_array, polygon_to_array
+from selection_index import touches_rect, contains_point, distance_to
+from style import MAX_PEN_WIDTH
+from instrumentation import profiler
 
 class InteractablePathItem(QGraphicsPathItem):
-    def __init__(self, path, parent=None):
+    def __init__(self, path, parent=None, shared=None):
         super().__init__(parent)
-        self.setPath(path)
+        self._cache = {}
+        self._style = None
+        self._layer = None
+        self.setPath(path, shared)
         self.setFlag(QGraphicsItem.ItemIsSelectable, True)
         self.setFlag(QGraphicsItem.ItemIsMovable, True)
+        self.setFlag(QGraphicsItem.ItemSendsGeometryChanges, True)
         self._grabber_size = 20
-        self._grabbers = []
+        self._grabbers_visible = False
         self._snap_threshold = 20
         self._snap_timer = QTimer()
         self._snap_timer.setInterval(200)  # Set the snap interval to 100 milliseconds
         self._snap_timer.timeout.connect(self.snapAndUpdateGrabbers)
 
-    def paint(self, painter, option, widget=None):
-        painter.setRenderHint(QPainter.Antialiasing)
-        painter.setRenderHint(QPainter.SmoothPixmapTransform)
-        painter.setBrush(QBrush(QColor(20, 170, 170)))
+    def setPath(self, path, shared=None):
+        # Items drawing the same path, such as the instances of a block, can
+        # pass the same shared dict: snap points, grabbers and simplified
+        # paths are then built once for all of them, in item coordinates
+        self._invalidateTiles()
+        self.prepareGeometryChange()
+        self._path_rect = path.controlPointRect()
+        super().setPath(path)
+        self._cache = {} if shared is None else shared
+        self._updateIndexes()
+        self._invalidateTiles()
+
+    def setPen(self, pen):
+        super().setPen(pen)
+        self._invalidateTiles()
+
+    def setPathStyle(self, style, layer=None):
+        # Draws with the pens of a shared StyleModel from now on, which
+        # repaints the scene itself when it changes
+        self._style = style
+        self._layer = layer
+        self._invalidateTiles()
+        self.update()
+
+    def pathStyle(self):
+        return self._style
+
+    def layer(self):
+        return self._layer
+
+    def pen(self):
+        if self._style is not None:
+            return self._style.pen(self._layer)
+        return super().pen()
+
+    def setBrush(self, brush):
+        super().setBrush(brush)
+        self._invalidateTiles()
+
+    def _invalidateTiles(self, scene=None):
+        # Tells the views that cached tiles under this item are out of date
+        scene = scene or self.scene()
+        if hasattr(scene, 'isBatched') and scene.isBatched():
+            # The scene works out the rect once the batch is done
+            scene.invalidateStatic(QRectF(), self)
+        elif hasattr(scene, 'invalidateStatic'):
+            scene.invalidateStatic(self.sceneBoundingRect(), self)
+
+    def snapPoints(self):
+        # Path vertices in item coordinates, the same points grabbers are drawn at
+        if 'snap' not in self._cache:
+            path = self.path()
+            points = []
+            for i in range(path.elementCount()):
+                path_elem = path.elementAt(i)
+                if path_elem.type != QPainterPath.ElementType.MoveToElement:
+                    points.append((path_elem.x, path_elem.y))
+            self._cache['snap'] = np.array(points, dtype=np.float64).reshape(-1, 2)
+        return self._cache['snap']
+
+    def sceneSnapPoints(self):
+        t = self.sceneTransform()
+        points = self.snapPoints()
+        return np.column_stack((t.m11() * points[:, 0] + t.m21() * points[:, 1] + t.dx(),
+                                t.m12() * points[:, 0] + t.m22() * points[:, 1] + t.dy()))
+
+    def _snapIndex(self, scene=None):
+        scene = scene or self.scene()
+        return getattr(scene, 'snap_index', None)
+
+    def _updateSnapIndex(self):
+        index = self._snapIndex()
+        if index is not None:
+            index.set_points(self, self.sceneSnapPoints())
+
+    def outline(self):
+        # Subpaths of the path as flat (N, 2) points and (S + 1,) offsets in
+        # item coordinates, what clicks and selections are tested against
+        if 'outline' not in self._cache:
+            polygons = [polygon_to_array(p) for p in self.path().toSubpathPolygons()]
+            points = np.concatenate(polygons) if polygons else np.zeros((0, 2))
+            offsets = np.concatenate(([0], np.cumsum([len(p) for p in polygons], dtype=np.int64)))
+            self._cache['outline'] = (points, offsets.astype(np.int64))
+        return self._cache['outline']
+
+    def sceneOutline(self):
+        points, offsets = self.outline()
+        t = self.sceneTransform()
+        return np.column_stack((t.m11() * points[:, 0] + t.m21() * points[:, 1] + t.dx(),
+                                t.m12() * points[:, 0] + t.m22() * points[:, 1] + t.dy())), offsets
+
+    def sceneBounds(self):
+        # (xmin, ymin, xmax, ymax) of the path in the scene, tight under rotations too
+        t = self.sceneTransform()
+        if t.type() <= QTransform.TxTranslate:
+            r = self._path_rect.translated(t.dx(), t.dy())
+            return r.left(), r.top(), r.right(), r.bottom()
+        points, _ = self.sceneOutline()
+        if not len(points):
+            r = t.mapRect(self._path_rect)
+            return r.left(), r.top(), r.right(), r.bottom()
+        (x0, y0), (x1, y1) = points.min(axis=0).tolist(), points.max(axis=0).tolist()
+        return x0, y0, x1, y1
+
+    def isFilled(self):
+        # Closed profiles are filled and picked anywhere inside, open chains only on the line
+        return self.brush().style() != Qt.NoBrush
+
+    def _selectionIndex(self, scene=None):
+        scene = scene or self.scene()
+        return getattr(scene, 'selection_index', None)
+
+    def _updateIndexes(self):
+        self._updateSnapIndex()
+        index = self._selectionIndex()
+        if index is not None:
+            bounds = self.sceneBounds()
+            index.set_bounds(self, bounds)
+            self._updatePickable(index)
+            if hasattr(self.scene(), 'growSceneBounds'):
+                self.scene().growSceneBounds(bounds)
+
+    def _updatePickable(self, index=None):
+        index = index or self._selectionIndex()
+        if index is not None:
+            index.set_pickable(self, self.isVisible() and bool(self.flags() & QGraphicsItem.ItemIsSelectable))
+
+    def _hitTolerance(self):
+        # The scene's pick tolerance, set by the view for each click, in item units
+        tolerance = getattr(self.scene(), 'hit_tolerance', 0.0)
+        if not tolerance:
+            return 0.0
+        return tolerance / max(abs(self.sceneTransform().determinant()) ** 0.5, 1e-12)
+
+    def contains(self, point):
+        # Exact test on the outline instead of the stroked shape Qt builds
+        points, offsets = self.outline()
+        runs = np.zeros(len(offsets) - 1, dtype=np.int64)
+        x, y = point.x(), point.y()
+        if self.isFilled() and contains_point(points, offsets, runs, 1, x, y)[0]:
+            return True
+        return bool(distance_to(points, offsets, runs, 1, x, y)[0] <= self._hitTolerance())
+
+    def collidesWithPath(self, path, mode=Qt.IntersectsItemShape):
+        # Clicks in a transformed view arrive as a pixel sized path in item
+        # coordinates; tested like contains, against the outline
+        if mode != Qt.IntersectsItemShape:
+            return super().collidesWithPath(path, mode)
+        r = path.controlPointRect()
+        tolerance = self._hitTolerance()
+        points, offsets = self.outline()
+        runs = np.zeros(len(offsets) - 1, dtype=np.int64)
+        rect = (r.left() - tolerance, r.top() - tolerance, r.right() + tolerance, r.bottom() + tolerance)
+        if touches_rect(points, offsets, runs, 1, rect)[0]:
+            return True
+        return bool(self.isFilled() and contains_point(points, offsets, runs, 1, r.center().x(), r.center().y())[0])
+
+    # Douglas-Peucker tolerances of the simplified paths, as fractions of the item extent
+    LOD_FRACTIONS = (1 / 16, 1 / 64, 1 / 256, 1 / 1024)
+
+    def lodPath(self, level):
+        # Path simplified at LOD_FRACTIONS[level] of the item extent, built on
+        # first use and cached together with its tolerance in item units
+        lod_paths = self._cache.setdefault('lod', {})
+        if level not in lod_paths:
+            rect = self._path_rect
+            tolerance = max(rect.width(), rect.height()) * self.LOD_FRACTIONS[level]
+            path = QPainterPath()
+            path.setFillRule(self.path().fillRule())
+            for polygon in self.path().toSubpathPolygons():
+                path.addPolygon(polygon_from_array(simplify(polygon_to_array(polygon), tolerance)))
+            lod_paths[level] = (tolerance, path)
+        return lod_paths[level]
+
+    def pathForLevelOfDetail(self, lod):
+        # Coarsest simplified path whose error stays under half a device pixel
+        rect = self._path_rect
+        extent = max(rect.width(), rect.height())
+        max_error = 0.5 / lod
+        for level, fraction in enumerate(self.LOD_FRACTIONS):
+            if extent * fraction <= max_error:
+                return self.lodPath(level)[1]
+        return self.path()
+
+    def renderCommand(self, lod):
+        # What paint draws at a given level of detail, as plain values that can
+        # also be rendered away from the item (see draw_render_command)
+        rect = self._path_rect
+        size_px = max(rect.width(), rect.height()) * lod
+        if size_px < 1:
+            # Sub-pixel items are not drawn at all
+            return None
+        if size_px < 4:
+            # A few pixels wide: the bounding box is indistinguishable from the outline
+            return (rect, self.pen().color())
+        # Open chains carry no brush and must not be filled
+        if self.brush().style() != Qt.NoBrush:
+            brush = QBrush(QColor(20, 170, 170))
+        else:
+            brush = QBrush(Qt.NoBrush)
         pen = self.pen()
         if self.isSelected():
             pen.setStyle(Qt.DotLine)
         else:
             pen.setStyle(Qt.SolidLine)
-        painter.setPen(pen)
-        painter.drawPath(self.path())
-
-    def createGrabber(self, pos):
-        grabber_rect = QtCore.QRectF(-self._grabber_size / 2, -self._grabber_size / 2, self._grabber_size, self._grabber_size)
-        grabber = QGraphicsRectItem(grabber_rect, self)
-        grabber.setPen(QPen(QColor(255, 255, 0)))
-        # grabber.setBrush(QBrush(QColor(255, 255, 255)))
-        grabber.setFlag(QGraphicsItem.ItemIsMovable, True)
-        grabber.setFlag(QGraphicsItem.ItemIsSelectable, False)
-        grabber.setPos(pos)
-        grabber.hide()
-        return grabber
+        # Antialiasing only pays off once the outline spans a fair number of pixels
+        return (self.pathForLevelOfDetail(lod), pen, brush, size_px > 32)
+
+    def updateContents(self):
+        # Unselected items of a tiled scene are drawn by the view from its
+        # tile cache; flagged as having no contents, Qt leaves them out of
+        # the paint pass altogether and only selected items are painted live
+        scene = self.scene()
+        tiled = not self.isSelected() and hasattr(scene, 'isStaticTiled') and scene.isStaticTiled()
+        if bool(self.flags() & QGraphicsItem.ItemHasNoContents) != tiled:
+            self.setFlag(QGraphicsItem.ItemHasNoContents, tiled)
+            if not tiled:
+                self.update()
+
+    def paint(self, painter, option, widget=None):
+        command = self.renderCommand(option.levelOfDetailFromTransform(painter.worldTransform()))
+        if command is not None:
+            draw_render_command(painter, command)
+        if self._grabbers_visible:
+            self.paintGrabbers(painter, option.exposedRect)
+
+    def boundingRect(self):
+        # Leaves room for the grabber overlay drawn around the vertices and
+        # for the widest pen a style can use, so pen changes never have to
+        # recompute geometry
+        margin = max(self._grabber_size, MAX_PEN_WIDTH) / 2
+        return self._path_rect.adjusted(-margin, -margin, margin, margin)
+
+    def grabberRects(self):
+        # One rect per vertex, built on first use and kept until the path changes
+        if 'grabbers' not in self._cache:
+            half = self._grabber_size / 2
+            self._cache['grabbers'] = [QtCore.QRectF(x - half, y - half, self._grabber_size, self._grabber_size)
+                                       for x, y in self.snapPoints().tolist()]
+        return self._cache['grabbers']
+
+    def paintGrabbers(self, painter, exposed_rect):
+        # Grabbers are drawn as one batch, limited to the vertices inside the exposed area
+        points = self.snapPoints()
+        half = self._grabber_size / 2
+        visible = np.flatnonzero((points[:, 0] >= exposed_rect.left() - half) & (points[:, 0] <= exposed_rect.right() + half) &
+                                 (points[:, 1] >= exposed_rect.top() - half) & (points[:, 1] <= exposed_rect.bottom() + half))
+        if not len(visible):
+            return
+        rects = self.grabberRects()
+        painter.setPen(QPen(QColor(255, 255, 0)))
+        painter.setBrush(Qt.NoBrush)
+        painter.drawRects([rects[i] for i in visible.tolist()])
 
     def showGrabbers(self):
-        self._grabbers = []
-        for i in range(self.path().elementCount()):
-            path_elem = self.path().elementAt(i)
-            if path_elem.type != QPainterPath.ElementType.MoveToElement:
-                grabber = self.createGrabber(QPointF(path_elem.x, path_elem.y))
-                self._grabbers.append(grabber)
-        if self.isSelected():
-            for grabber in self._grabbers:
-                grabber.show()
+        if not self._grabbers_visible:
+            self._grabbers_visible = True
+            self.update()
 
     def hideGrabbers(self):
-        for grabber in self._grabbers:
-            grabber.hide()
+        if self._grabbers_visible:
+            self._grabbers_visible = False
+            self.update()
 
     def mousePressEvent(self, event):
         super().mousePressEvent(event)
@@ -66,50 +302,79 @@ class InteractablePathItem(QGraphicsPathItem):
         super().mouseReleaseEvent(event)
 
     def snapToClosest(self):
-        scene_items = self.scene().items()
-        interactable_items = [item for item in scene_items if isinstance(item, InteractablePathItem) and item is not self]
-
-        for grabber1 in self._grabbers:
-            closest_item = None
-            closest_distance = float('inf')
-            closest_point = None
-
-            for item in interactable_items:
-                for grabber2 in item._grabbers:
-                    distance = (grabber1.scenePos() - grabber2.scenePos()).manhattanLength()
-                    if distance < closest_distance:
-                        closest_distance = distance
-                        closest_item = item
-                        closest_point = grabber2.scenePos()
-
-            if closest_distance <= self._snap_threshold:
-                delta = closest_point - grabber1.scenePos()
-                self.setPos(self.pos() + delta)
-                break
-            
+        # Looks up the closest vertex of any other item in the scene-wide snap
+        # index, only items near this one are considered and pairs that did
+        # not move since the last snap come from the index's cache
+        index = self._snapIndex()
+        if index is None:
+            return
+        with profiler.span('snap'):
+            hit = index.closest_to(self, self._snap_threshold)
+        if hit is not None:
+            _, (x, y), _, (sx, sy) = hit
+            self.setPos(self.pos() + QPointF(x - sx, y - sy))
 
     def itemChange(self, change, value):
-        if change == QGraphicsItem.ItemSelectedChange:
+        if change == QGraphicsItem.ItemSceneChange:
+            for index in (self._snapIndex(), self._selectionIndex()):
+                if index is not None:
+                    index.remove(self)
+            self._invalidateTiles()
+        elif change in (QGraphicsItem.ItemPositionChange, QGraphicsItem.ItemTransformChange):
+            # Selected items are drawn live, only static moves touch the tiles
+            if not self.isSelected():
+                self._invalidateTiles()
+        elif change in (QGraphicsItem.ItemSceneHasChanged, QGraphicsItem.ItemPositionHasChanged,
+                        QGraphicsItem.ItemTransformHasChanged):
+            self._updateIndexes()
+            if change == QGraphicsItem.ItemSceneHasChanged:
+                self.updateContents()
+            if change == QGraphicsItem.ItemSceneHasChanged or not self.isSelected():
+                self._invalidateTiles()
+        elif change == QGraphicsItem.ItemSelectedChange:
             if value:
-                self.highlightGrabbers()
+                self.showGrabbers()
             else:
                 self.hideGrabbers()
+        elif change == QGraphicsItem.ItemSelectedHasChanged:
+            # The item moves between the live layer and the tiles
+            self.updateContents()
+            self._invalidateTiles()
+        elif change in (QGraphicsItem.ItemVisibleHasChanged, QGraphicsItem.ItemFlagsHaveChanged):
+            self._updatePickable()
         return super().itemChange(change, value)
 
     def highlightGrabbers(self):
-        self.hideGrabbers()
-        self.showGrabbers()
-
-    def snapGrabbers(self):
-        for grabber1 in self._grabbers:
-            for grabber2 in self._grabbers:
-                if grabber1 is not grabber2:
-                    distance = (grabber1.pos() - grabber2.pos()).manhattanLength()
-                    if distance <= self._snap_threshold:
-                        grabber1.setPos(grabber2.pos())
-                        break
+        if self.isSelected():
+            self.showGrabbers()
+        else:
+            self.hideGrabbers()
 
     def snapAndUpdateGrabbers(self):
         self.snapToClosest()
         self.highlightGrabbers()
-        self._snap_timer.stop()
\ No newline at end of file
+        self._snap_timer.stop()
+
+
+def detach_render_command(command):
+    # Copy of a render command owning its own path and pen, for painting on
+    # another thread while the item's own path and pen change or go away
+    if len(command) == 2:
+        rect, color = command
+        return QRectF(rect), QColor(color)
+    path, pen, brush, antialias = command
+    return QPainterPath(path), QPen(pen), QBrush(brush), antialias
+
+
+def draw_render_command(painter, command):
+    # Draws a command made by InteractablePathItem.renderCommand
+    if len(command) == 2:
+        rect, color = command
+        painter.fillRect(rect, color)
+        return
+    path, pen, brush, antialias = command
+    painter.setRenderHint(QPainter.Antialiasing, antialias)
+    painter.setRenderHint(QPainter.SmoothPixmapTransform)
+    painter.setBrush(brush)
+    painter.setPen(pen)
+    painter.drawPath(path)
@@ -1,12 +1,28 @@
-from PyQt5.QtWidgets import QMainWindow, QPushButton, QGraphicsView, QGraphicsScene, QLabel, QWidget, QVBoxLayout, QSpinBox, QColorDialog, QFileDialog
-from PyQt5.QtGui import QPainter, QPainterPath, QPen, QColor, QBrush
-from PyQt5.QtCore import Qt
-import ezdxf
-import shapely.geometry as geom
-import shapely.ops as ops
-from shapely.affinity import rotate
+from PyQt5.QtWidgets import QMainWindow, QPushButton, QGraphicsView, QGraphicsRectItem, QGraphicsPathItem, QLabel, QWidget, QVBoxLayout, QSpinBox, QDoubleSpinBox, QCheckBox, QColorDialog, QFileDialog, QProgressBar
+from PyQt5.QtGui import QPainter, QPainterPath, QPen, QColor, QBrush, QTransform
+from PyQt5.QtCore import Qt, QThread, QTimer, QRectF
+import numpy as np
+import time
 from custom_graphics_view import CustomGraphicsView
 from interactable_path_item import InteractablePathItem
+from profile_scene import ProfileScene
+from dxf_loader import DxfLoader
+from tessellate import DEFAULT_CHORD_TOLERANCE, tessellate_runs
+from style import aci_color, MAX_PEN_WIDTH
+from parse_cache import ParseCache
+from geometry_file import GEOMETRY_EXTENSION, write_geometry_file
+from profile_engine import ProfileSet, concatenate_profiles
+from virtual_scene import SceneVirtualizer
+from blocks import explode
+from dxf_writer import insert_changes, save_incremental, write_dxf
+from geometry_store import GeometryStore
+from nest_runner import NestRunner
+from containment import hole_owners, profile_parents
+from path_builder import polygon_to_array
+from toolpath import plan_toolpath, rapid_moves, sequenced
+from measure import DEFAULT_MIN_HOLE, DEFAULT_MIN_WEB, check_drawing, entity_measures, profile_measures
+from report_view import ReportWindow
+from instrumentation import profiler
 
 
 
@@ -24,9 +40,70 @@ class MainWindow(QMainWindow):
         button.move(20, 20)
         button.clicked.connect(self.openFile)
 
-        load_dxf_button = QPushButton('Load DXF', self)
-        load_dxf_button.move(200, 20)
-        load_dxf_button.clicked.connect(self.load_dxf)
+        self.cancel_load_button = QPushButton('Cancel Load', self)
+        self.cancel_load_button.move(340, 20)
+        self.cancel_load_button.setEnabled(False)
+        self.cancel_load_button.clicked.connect(self.cancel_load)
+
+        self.export_button = QPushButton('Export', self)
+        self.export_button.move(780, 20)
+        self.export_button.setEnabled(False)
+        self.export_button.clicked.connect(self.exportFile)
+
+        self.save_button = QPushButton('Save DXF', self)
+        self.save_button.move(880, 20)
+        self.save_button.setEnabled(False)
+        self.save_button.clicked.connect(self.saveDxf)
+
+        self.load_progress_bar = QProgressBar(self)
+        self.load_progress_bar.move(460, 20)
+        self.load_progress_bar.resize(300, 25)
+        self.load_progress_bar.setFormat('%p%')
+        self.load_progress_bar.hide()
+
+        self._loader = None
+        self._loader_thread = None
+        # Threads of cancelled loads and nesting runs still finishing work
+        # that can't be interrupted, kept until they are done
+        self._cancelled_threads = []
+        # Results a cancelled loader queued before it was disconnected are
+        # still delivered; they are dropped until a marker queued behind
+        # them comes through
+        self._stale_loads = 0
+        self._load_start = None
+        # Drawing the scene was loaded from, saves copy it with the changes
+        self.filename = None
+        self.store = None
+        self.profiles = None
+        self.layer_colors = {}
+        # Profile id -> item drawing it, so exports can pick up where profiles
+        # were dragged; holes share the item of the profile they belong to
+        self.profile_items = {}
+        # Set instead of profile_items when the scene is virtualized
+        self.virtualizer = None
+        # Block instances: (block name, profile ids, item, instance row) per
+        # instance item, the flattened InstanceSet, the layer names it indexes
+        # and block name -> BlockPaths
+        self.instance_items = []
+        self.instances = None
+        self.instance_layers = []
+        self.block_geometry = {}
+        # Nesting: the items being placed, the linear part of their transform
+        # when nesting started, the lower left corner of the first sheet and
+        # the sheet outlines drawn under the parts
+        self._nester = None
+        self._nester_thread = None
+        self.nest_items = []
+        self.nest_linear = []
+        self.nest_origin = (0.0, 0.0)
+        self.sheet_items = []
+        # Planned cut order of the placed profiles and the rapid moves drawn for it
+        self.toolpath = None
+        self.toolpath_item = None
+        # Measurements and issues of the drawing, in a window of their own
+        self.report = None
+        # Parsed drawings and their profiles are kept on disk between sessions
+        self.parse_cache = ParseCache()
 
         # Create graphics view for displaying drawing
         self.view = CustomGraphicsView(self)
@@ -34,7 +111,7 @@ class MainWindow(QMainWindow):
         self.view.setRenderHint(QPainter.SmoothPixmapTransform)
         self.view.setOptimizationFlag(QGraphicsView.DontAdjustForAntialiasing, True)
         self.view.setOptimizationFlag(QGraphicsView.DontSavePainterState, True)
-        self.view.setViewportUpdateMode(QGraphicsView.FullViewportUpdate)
+        self.view.setViewportUpdateMode(QGraphicsView.SmartViewportUpdate)
         self.view.setDragMode(QGraphicsView.NoDrag)
         self.view.setTransformationAnchor(QGraphicsView.AnchorUnderMouse)
         self.view.setResizeAnchor(QGraphicsView.AnchorUnderMouse)
@@ -44,7 +121,7 @@ class MainWindow(QMainWindow):
         self.view.move(20, 60)
         # self.view.resize(960, 620)
         self.view.setTransform(self.view.transform().scale(1, -1))
-        self.scene = QGraphicsScene(self)
+        self.scene = ProfileScene(self)
         self.view.setScene(self.scene)
 
         self.cursor_position_label = QLabel(self)
@@ -58,13 +135,13 @@ class MainWindow(QMainWindow):
         # Add the column of options on the right-hand side
         options_widget = QWidget(self)
         options_layout = QVBoxLayout(options_widget)
-        options_widget.setGeometry(self.width() - 200, 60, 180, 300)
+        options_widget.setGeometry(self.width() - 200, 60, 180, 820)
 
         # Pen thickness option
         pen_thickness_label = QLabel("Pen Thickness", options_widget)
         options_layout.addWidget(pen_thickness_label)
         self.pen_thickness_spinbox = QSpinBox(options_widget)
-        self.pen_thickness_spinbox.setRange(1, 20)
+        self.pen_thickness_spinbox.setRange(1, MAX_PEN_WIDTH)
         options_layout.addWidget(self.pen_thickness_spinbox)
 
         # Pen color option
@@ -73,90 +150,598 @@ class MainWindow(QMainWindow):
         self.pen_color_button = QPushButton("Choose color", options_widget)
         options_layout.addWidget(self.pen_color_button)
 
+        # Chord tolerance used when flattening arcs and circles
+        chord_tolerance_label = QLabel("Chord Tolerance", options_widget)
+        options_layout.addWidget(chord_tolerance_label)
+        self.chord_tolerance_spinbox = QDoubleSpinBox(options_widget)
+        self.chord_tolerance_spinbox.setDecimals(4)
+        self.chord_tolerance_spinbox.setRange(0.0001, 10)
+        self.chord_tolerance_spinbox.setSingleStep(0.005)
+        self.chord_tolerance_spinbox.setValue(DEFAULT_CHORD_TOLERANCE)
+        options_layout.addWidget(self.chord_tolerance_spinbox)
+
+        # Draw every layer in its DXF color rather than the pen color
+        self.layer_colors_checkbox = QCheckBox("Layer Colors", options_widget)
+        self.layer_colors_checkbox.setChecked(self.scene.path_style.useLayerColors())
+        options_layout.addWidget(self.layer_colors_checkbox)
+
+        # Only keep items for the profiles around the visible area, applies to the next load
+        self.virtual_scene_checkbox = QCheckBox("Virtual Scene", options_widget)
+        options_layout.addWidget(self.virtual_scene_checkbox)
+
+        # Blit unselected geometry from pre-rendered tiles instead of repainting it
+        self.tile_cache_checkbox = QCheckBox("Tile Cache", options_widget)
+        self.tile_cache_checkbox.setChecked(self.view.isTileCacheEnabled())
+        options_layout.addWidget(self.tile_cache_checkbox)
+
+        # Load, paint and snap timings over the view, and the same as a Chrome trace
+        self.timings_checkbox = QCheckBox("Show Timings", options_widget)
+        options_layout.addWidget(self.timings_checkbox)
+        self.export_trace_button = QPushButton("Export Trace", options_widget)
+        options_layout.addWidget(self.export_trace_button)
+
+        # Automatic nesting of the closed profiles onto sheets
+        options_layout.addWidget(QLabel("Sheet Width / Height", options_widget))
+        self.sheet_width_spinbox = QDoubleSpinBox(options_widget)
+        self.sheet_height_spinbox = QDoubleSpinBox(options_widget)
+        for spinbox, value in ((self.sheet_width_spinbox, 3000), (self.sheet_height_spinbox, 1500)):
+            spinbox.setRange(1, 1e6)
+            spinbox.setValue(value)
+            options_layout.addWidget(spinbox)
+        options_layout.addWidget(QLabel("Part Spacing", options_widget))
+        self.nest_spacing_spinbox = QDoubleSpinBox(options_widget)
+        self.nest_spacing_spinbox.setRange(0, 1e4)
+        self.nest_spacing_spinbox.setValue(5)
+        options_layout.addWidget(self.nest_spacing_spinbox)
+        options_layout.addWidget(QLabel("Rotation Steps", options_widget))
+        self.nest_rotations_spinbox = QSpinBox(options_widget)
+        self.nest_rotations_spinbox.setRange(1, 72)
+        self.nest_rotations_spinbox.setValue(4)
+        options_layout.addWidget(self.nest_rotations_spinbox)
+        self.nest_button = QPushButton("Nest", options_widget)
+        self.nest_button.setEnabled(False)
+        options_layout.addWidget(self.nest_button)
+
+        # Cut order of the profiles, holes first, with the rapid moves drawn
+        self.order_cuts_button = QPushButton("Order Cuts", options_widget)
+        self.order_cuts_button.setEnabled(False)
+        options_layout.addWidget(self.order_cuts_button)
+
+        # Measurements and design rule checks, listed in a report window
+        options_layout.addWidget(QLabel("Min Web / Min Hole", options_widget))
+        self.min_web_spinbox = QDoubleSpinBox(options_widget)
+        self.min_hole_spinbox = QDoubleSpinBox(options_widget)
+        for spinbox, value in ((self.min_web_spinbox, DEFAULT_MIN_WEB), (self.min_hole_spinbox, DEFAULT_MIN_HOLE)):
+            spinbox.setRange(0.0, 1000.0)
+            spinbox.setDecimals(3)
+            spinbox.setValue(value)
+            options_layout.addWidget(spinbox)
+        self.check_button = QPushButton("Check Drawing", options_widget)
+        self.check_button.setEnabled(False)
+        options_layout.addWidget(self.check_button)
+
         # Connect signals to slots
         self.pen_thickness_spinbox.valueChanged.connect(self.set_pen_thickness)
         self.pen_color_button.clicked.connect(self.choose_pen_color)
+        self.tile_cache_checkbox.toggled.connect(self.view.setTileCacheEnabled)
+        self.layer_colors_checkbox.toggled.connect(self.scene.path_style.setUseLayerColors)
+        self.timings_checkbox.toggled.connect(self.view.setTimingOverlayVisible)
+        self.export_trace_button.clicked.connect(self.exportTrace)
+        self.nest_button.clicked.connect(self.toggleNesting)
+        self.order_cuts_button.clicked.connect(self.orderCuts)
+        self.check_button.clicked.connect(self.checkDrawing)
 
     def set_pen_thickness(self, thickness):
-        for item in self.scene.items():
-            if isinstance(item, InteractablePathItem):
-                pen = item.pen()
-                pen.setWidth(thickness)
-                item.setPen(pen)
+        self.scene.path_style.setPenWidth(thickness)
 
     def choose_pen_color(self):
-        all_items = [item for item in self.scene.items() if isinstance(item, InteractablePathItem)]
-        if all_items:
-            initial_color = all_items[0].pen().color()
-            color = QColorDialog.getColor(initial_color, self, "Choose Pen Color")
-            if color.isValid():
-                for item in all_items:
-                    pen = item.pen()
-                    pen.setColor(color)
-                    item.setPen(pen)
+        style = self.scene.path_style
+        color = QColorDialog.getColor(style.penColor(), self, "Choose Pen Color")
+        if color.isValid():
+            style.setPenColor(color)
+            self.layer_colors_checkbox.setChecked(False)
+
+    def setLayerColors(self, colors):
+        if self._stale_loads:
+            return
+        self.layer_colors = colors
+        self.scene.path_style.setLayerColors({name: aci_color(index) for name, index in colors.items()})
 
 
     def openFile(self):
-        filename, _ = QFileDialog.getOpenFileName(self, 'Open file', '.', "DXF files (*.dxf)")
+        filename, _ = QFileDialog.getOpenFileName(self, 'Open file', '.',
+                                                  f"Drawings (*.dxf *{GEOMETRY_EXTENSION});;DXF files (*.dxf);;"
+                                                  f"Geometry files (*{GEOMETRY_EXTENSION})")
+        if filename:
+            self.load_dxf(filename)
+
+    def exportFile(self):
+        filename, _ = QFileDialog.getSaveFileName(self, 'Export profiles', '.', f"Geometry files (*{GEOMETRY_EXTENSION})")
+        if filename:
+            if not filename.lower().endswith(GEOMETRY_EXTENSION):
+                filename += GEOMETRY_EXTENSION
+            self.export_geometry(filename)
+
+    def exportTrace(self):
+        filename, _ = QFileDialog.getSaveFileName(self, 'Export trace', 'trace.json', "Chrome trace (*.json)")
+        if filename:
+            profiler.write_chrome_trace(filename)
+            print(f"Wrote trace to {filename}")
+
+    def export_geometry(self, filename):
+        # Writes the profiles as they are placed in the scene, with the
+        # parsed entities alongside so the file can stand in for the DXF,
+        # in cut order once it has been planned
+        placed, layers = self.placedProfiles()
+        if self.toolpath is not None and len(self.toolpath.starts) == len(placed):
+            placed = sequenced(placed, self.toolpath)
+        write_geometry_file(filename, placed, self.store, layers=layers, layer_colors=self.layer_colors)
+        print(f"Exported {len(placed)} profiles to {filename}")
+
+    def placedProfiles(self):
+        # Profiles where their items are placed, block copies included, and
+        # the layer names they index
+        profiles = self.profiles
+        vertices = profiles.vertices
+        matrices = self.profileTransforms()
+        if not np.array_equal(matrices, np.broadcast_to(((1.0, 0.0, 0.0), (0.0, 1.0, 0.0)), matrices.shape)):
+            # Bulges keep their meaning under rotations, a mirror flips them
+            per_vertex = np.repeat(matrices, np.diff(profiles.offsets), axis=0)
+            vertices = vertices.copy()
+            vertices[:, :2] = np.einsum('kij,kj->ki', per_vertex[:, :, :2], vertices[:, :2]) + per_vertex[:, :, 2]
+            mirrored = np.linalg.det(per_vertex[:, :, :2]) < 0
+            vertices[mirrored, 2] = -vertices[mirrored, 2]
+        placed = ProfileSet(vertices, profiles.offsets, profiles.closed, profiles.layers,
+                            profiles.edges, profiles.edge_offsets, profiles.dangling)
+        layers = self.store.layers
+        if self.instance_items:
+            # Block instances are written out as plain profiles where they are placed
+            layers = self.instance_layers
+            placed = concatenate_profiles([placed, self.explodedInstances(self.instance_items)])
+        return placed, layers
+
+    def orderCuts(self):
+        # Plans the cut order of the profiles where they are now and draws
+        # the rapid moves between them
+        placed, _ = self.placedProfiles()
+        with profiler.span('order cuts', profiles=len(placed)):
+            points, offsets = tessellate_runs(placed.vertices, placed.offsets, placed.closed,
+                                              self.chord_tolerance_spinbox.value())
+            parents = profile_parents(points, offsets, placed.closed)
+            toolpath = plan_toolpath(placed.vertices, placed.offsets, placed.closed, parents)
+        self.clearToolpath()
+        self.toolpath = toolpath
+        begin, end = rapid_moves(placed.vertices, placed.offsets, placed.closed, toolpath.order, toolpath.starts,
+                                 toolpath.reversed, toolpath.origin)
+        path = QPainterPath()
+        for (x0, y0), (x1, y1) in zip(begin.tolist(), end.tolist()):
+            path.moveTo(x0, y0)
+            path.lineTo(x1, y1)
+        pen = QPen(QColor(255, 200, 0), 0)
+        pen.setStyle(Qt.DashLine)
+        self.toolpath_item = QGraphicsPathItem(path)
+        self.toolpath_item.setPen(pen)
+        self.toolpath_item.setZValue(1)
+        self.scene.addItem(self.toolpath_item)
+        saved = 1 - toolpath.travel_after / toolpath.travel_before if toolpath.travel_before else 0.0
+        print(f"Cut order for {len(toolpath.order)} profiles in {toolpath.seconds:.2f} s: rapid travel "
+              f"{toolpath.travel_before:.1f} -> {toolpath.travel_after:.1f} ({saved:.0%} less)")
+
+    def clearToolpath(self):
+        # The planned order no longer matches where the items are
+        if self.toolpath_item is not None:
+            self.scene.removeItem(self.toolpath_item)
+        self.toolpath_item = None
+        self.toolpath = None
+
+    def checkDrawing(self):
+        # Measures the entities and the profiles where they are placed and
+        # lists them next to every issue the design rule checks find
+        placed, layers = self.placedProfiles()
+        with profiler.span('check drawing', profiles=len(placed)):
+            points, offsets = tessellate_runs(placed.vertices, placed.offsets, placed.closed,
+                                              self.chord_tolerance_spinbox.value())
+            owners = hole_owners(points, offsets, placed.closed)
+            entities = entity_measures(self.store)
+            measures = profile_measures(placed, points, offsets, owners)
+            issues = check_drawing(self.store, placed, points, offsets, owners,
+                                   self.min_web_spinbox.value(), self.min_hole_spinbox.value())
+        self.closeReport()
+        self.report = ReportWindow(entities, placed, measures, issues, self.store.layers, layers)
+        self.report.located.connect(self.showLocation)
+        self.report.show()
+        print(f"Checked {len(entities.kinds)} entities and {len(placed)} profiles: {len(issues.checks)} issues")
+
+    def closeReport(self):
+        if self.report is not None:
+            self.report.close()
+            self.report.deleteLater()
+        self.report = None
+
+    def showLocation(self, x, y):
+        # Brings a spot of the drawing into view, selecting what is there
+        self.view.centerOn(x, y)
+        item = self.scene.itemAtPoint(x, y, self.view.sceneTolerance())
+        self.scene.setSelection([item] if item is not None else [])
+
+    def explodedInstances(self, entries):
+        # Profiles of instance items where they are placed, layers indexing instance_layers
+        layer_ids = {name: i for i, name in enumerate(self.instance_layers)}
+        exploded = []
+        for name, ids, item, _ in entries:
+            t = item.sceneTransform()
+            matrix = ((t.m11(), t.m21(), t.dx()), (t.m12(), t.m22(), t.dy()))
+            exploded.append(explode(self.block_geometry[name].profiles, ids, matrix, layer_ids.get(item.layer(), 0)))
+        return concatenate_profiles(exploded)
+
+    def instanceStore(self, entries):
+        # The same as the LWPOLYLINEs of a store, for writing DXF
+        profiles = self.explodedInstances(entries)
+        return GeometryStore(poly_vertices=profiles.vertices, poly_offsets=profiles.offsets,
+                             poly_closed=profiles.closed, layers=self.instance_layers,
+                             layer_columns=[None, None, None, profiles.layers])
+
+    def saveDxf(self):
+        filename, _ = QFileDialog.getSaveFileName(self, 'Save DXF', self.filename or '.', "DXF files (*.dxf)")
         if filename:
-            print(f"Opening {filename}")
-            doc = ezdxf.readfile(filename)
+            if not filename.lower().endswith('.dxf'):
+                filename += '.dxf'
+            self.save_dxf(filename)
 
-            # Clear scene
-            self.scene.clear()
+    def save_dxf(self, filename):
+        # Writes the drawing with every item where it is now. A drawing read
+        # from a DXF is saved incrementally: the file is copied with only the
+        # moved entities rewritten, so whatever the viewer does not read is
+        # kept. Otherwise, or when that is not possible, the store and the
+        # block copies are written out as a new drawing.
+        matrices = self.profiles.entity_matrices(self.store.counts(), self.profileTransforms())
+        with profiler.span('save dxf', file=filename):
+            if self.filename.lower().endswith('.dxf'):
+                try:
+                    handles, deltas = self.instanceDeltas()
+                    inserts, exploded = insert_changes(self.store.instances, handles, deltas)
+                    added = None
+                    if exploded:
+                        moved_apart = np.flatnonzero(np.isin(handles, np.array(sorted(exploded), dtype=np.uint64)))
+                        added = self.instanceStore([self.instance_items[k] for k in moved_apart.tolist()])
+                    count = save_incremental(self.filename, filename, self.store, matrices, inserts, exploded, added)
+                    print(f"Saved {filename}, {count} entities rewritten")
+                    return
+                except ValueError as e:
+                    print(f"Cannot save incrementally ({e}), writing the whole drawing")
+            stores = [self.store.placed(matrices)]
+            if self.instance_items:
+                stores.append(self.instanceStore(self.instance_items))
+            count = write_dxf(filename, stores, self.layer_colors)
+        print(f"Saved {count} entities to {filename}")
 
-        # Buffer distance for closed profile detection
-        buffer_distance = 1e-3
+    def instanceDeltas(self):
+        # INSERT handle of every instance item and the (K, 2, 3) transform
+        # applied to it since loading
+        if not self.instance_items:
+            return np.zeros(0, dtype=np.uint64), np.zeros((0, 2, 3))
+        rows = [row for _, _, _, row in self.instance_items]
+        current = np.array([((t.m11(), t.m21(), t.dx()), (t.m12(), t.m22(), t.dy()))
+                            for t in (item.sceneTransform() for _, _, item, _ in self.instance_items)])
+        last = np.broadcast_to((0.0, 0.0, 1.0), (len(rows), 1, 3))
+        original = np.concatenate((self.instances.matrices[rows], last), axis=1)
+        deltas = np.concatenate((current, last), axis=1) @ np.linalg.inv(original)
+        return self.instances.handles[rows], deltas[:, :2]
 
-        # Collect all entities in a list
-        entities = []
+    def load_dxf(self, filename):
+        print(f"Opening {filename}")
+        self.cancel_load()
+        self.stop_nesting()
+        # Timings and counters describe the drawing being loaded
+        profiler.clear()
+        self._load_start = time.perf_counter()
+
+        # Clear scene
+        if self.virtualizer is not None:
+            self.view.visibleRectChanged.disconnect(self.virtualizer.update)
+            self.virtualizer = None
+        self.scene.clear()
+        self.scene.setSceneRect(QRectF())
+        self.filename = filename
+        self.store = None
+        self.profiles = None
+        self.layer_colors = {}
+        self.profile_items = {}
+        self.instance_items = []
+        self.instances = None
+        self.instance_layers = []
+        self.block_geometry = {}
+        self.nest_items = []
+        self.nest_linear = []
+        self.sheet_items = []
+        self.toolpath = None
+        self.toolpath_item = None
+        self.closeReport()
+        self.export_button.setEnabled(False)
+        self.save_button.setEnabled(False)
+        self.nest_button.setEnabled(False)
+        self.order_cuts_button.setEnabled(False)
+        self.check_button.setEnabled(False)
 
         # Set view background color
         self.view.setBackgroundBrush(QColor(10, 10, 20))
-        
-        for entity in doc.entities:
-            if entity.dxftype() == 'LINE':
-                start_point = entity.dxf.start
-                end_point = entity.dxf.end
-                entities.append(geom.LineString([(start_point[0], start_point[1]), (end_point[0], end_point[1])]))
-            elif entity.dxftype() == 'CIRCLE':
-                center = entity.dxf.center
-                radius = entity.dxf.radius
-                entities.append(geom.Point(center).buffer(radius))
-            elif entity.dxftype() == 'ARC':
-                center = entity.dxf.center
-                radius = entity.dxf.radius
-                start_angle = entity.dxf.start_angle
-                end_angle = entity.dxf.end_angle
-                if end_angle < start_angle:
-                    end_angle += 360
-                entities.append(rotate(geom.Point(center).buffer(radius), start_angle, 'center').boundary)
-                entities.append(rotate(geom.Point(center).buffer(radius), end_angle, 'center').boundary)
-            elif entity.dxftype() == 'LWPOLYLINE':
-                vertices = list(entity.vertices())
-                if entity.closed:
-                    vertices.append(vertices[0])
-                entities.append(geom.LineString([(v[0], v[1]) for v in vertices]))
-
-        # Find closed profiles
-        entities = [entity.buffer(buffer_distance) for entity in entities]
-        filled_profiles = ops.unary_union(entities)
-
-        # Draw closed profiles
-        if isinstance(filled_profiles, geom.Polygon):
-            filled_profiles = [filled_profiles]
-
-        for profile in filled_profiles:
-            path = QPainterPath()
-            path.moveTo(*profile.exterior.coords[0])
-            for coords in profile.exterior.coords[1:]:
-                path.lineTo(*coords)
-            path.closeSubpath()
-
-            item = InteractablePathItem(path)
-            item.setPen(QPen(QColor(255, 255, 255)))
-            item.setBrush(QBrush(QColor(255, 0, 255, 127)))
-            self.scene.addItem(item)
+
+        # Parse and convert on a worker thread, items are added as batches arrive
+        self._loader_thread = QThread(self)
+        virtual = self.virtual_scene_checkbox.isChecked()
+        self._loader = DxfLoader(filename, chord_tolerance=self.chord_tolerance_spinbox.value(),
+                                 cache=self.parse_cache, build_paths=not virtual)
+        self._loader.moveToThread(self._loader_thread)
+        self._loader_thread.started.connect(self._loader.run)
+        for signal, slot in self.loaderConnections(self._loader):
+            signal.connect(slot)
+        self._loader.finished.connect(self._loader_thread.quit)
+        self._loader.finished.connect(self._loader.deleteLater)
+        self._loader_thread.finished.connect(self._loader_thread.deleteLater)
+        self._loader_thread.finished.connect(self.onLoadFinished)
+
+        self.cancel_load_button.setEnabled(True)
+        self.load_progress_bar.setRange(0, 0)
+        self.load_progress_bar.show()
+        self._loader_thread.start()
+
+    def loaderConnections(self, loader):
+        # Signals of a DxfLoader and the slots taking its results
+        return ((loader.progress, self.onLoadProgress),
+                (loader.pathsReady, self.addProfilePaths),
+                (loader.pointsReady, self.setProfilePoints),
+                (loader.instancesReady, self.addInstances),
+                (loader.layersReady, self.setLayerColors),
+                (loader.storeReady, self.setStore),
+                (loader.profilesReady, self.setProfiles),
+                (loader.failed, self.onLoadFailed))
+
+    def cancel_load(self):
+        if self._loader is not None:
+            try:
+                self._loader.cancel()
+                # Stop accepting results that are already queued, they belong
+                # to the drawing being dropped
+                for signal, slot in self.loaderConnections(self._loader):
+                    try:
+                        signal.disconnect(slot)
+                    except TypeError:
+                        pass
+            except RuntimeError:
+                # Deleted, it has finished
+                pass
+            self._loader = None
+            self._stale_loads += 1
+            QTimer.singleShot(0, self.onStaleResultsDropped)
+        self.keepCancelledThread(self._loader_thread)
+        self._loader_thread = None
+        self.cancel_load_button.setEnabled(False)
+        self.load_progress_bar.hide()
+
+    def keepCancelledThread(self, thread):
+        # Keeps a cancelled worker's thread until it has finished
+        try:
+            if thread is not None and not thread.isFinished():
+                self._cancelled_threads.append(thread)
+                thread.finished.connect(self.onCancelledThreadFinished)
+        except RuntimeError:
+            pass
+
+    def setStore(self, store):
+        # Parsed geometry shared by the renderer, profile detection and snapping
+        if self._stale_loads:
+            return
+        self.store = store
+
+    def setProfiles(self, profiles):
+        if self._stale_loads:
+            return
+        self.profiles = profiles
+        print(f"{profiles.loop_count()} closed profiles, {profiles.chain_count()} open chains, "
+              f"{len(profiles.dangling)} dangling entities")
+
+    def makeProfileItem(self, path, closed, layer, item=None, shared=None):
+        # New item for a profile, or item reconfigured for it when recycled
+        if item is None:
+            item = InteractablePathItem(path, shared=shared)
+        else:
+            item.setPath(path, shared)
+        item.setPathStyle(self.scene.path_style, layer)
+        item.setBrush(QBrush(QColor(255, 0, 255, 127)) if closed else QBrush(Qt.NoBrush))
+        return item
+
+    def addProfilePaths(self, paths):
+        if self._stale_loads:
+            return
+        with profiler.span('scene insert', items=len(paths)):
+            for path, closed, layer, ids in paths:
+                item = self.makeProfileItem(path, closed, layer)
+                self.profile_items.update(dict.fromkeys(ids, item))
+                self.scene.addItem(item)
+
+    def addInstances(self, instances, layer_names, geometry):
+        # One item per profile of every placed block copy; the copies of a
+        # block share its paths and their simplified versions
+        if self._stale_loads:
+            return
+        self.instances = instances
+        self.instance_layers = layer_names
+        self.block_geometry = geometry
+        with profiler.span('scene insert', items=len(instances)):
+            for b, name in enumerate(instances.blocks):
+                shapes = [(path, closed, ids, {}) for path, closed, ids in geometry[name].paths()]
+                for row in np.flatnonzero(instances.block_ids == b).tolist():
+                    m = instances.matrices[row]
+                    transform = QTransform(m[0, 0], m[1, 0], m[0, 1], m[1, 1], m[0, 2], m[1, 2])
+                    layer = layer_names[instances.layers[row]]
+                    for path, closed, ids, shared in shapes:
+                        item = self.makeProfileItem(path, closed, layer, shared=shared)
+                        item.setTransform(transform)
+                        self.instance_items.append((name, ids, item, row))
+                        self.scene.addItem(item)
+
+    def setProfilePoints(self, points, offsets, owners):
+        # Virtualized scene: items come and go with the visible area
+        if self._stale_loads:
+            return
+        self.virtualizer = SceneVirtualizer(self.scene, self.profiles, points, offsets, self.store.layers,
+                                            self.makeProfileItem, owners=owners, parent=self)
+        self.view.visibleRectChanged.connect(self.virtualizer.update)
+        self.virtualizer.update(self.view.visibleSceneRect())
+
+    def profileTransforms(self):
+        # (P, 2, 3) affine matrices taking every profile from where it was
+        # detected to where its item is now
+        matrices = np.zeros((len(self.profiles), 2, 3))
+        matrices[:, 0, 0] = matrices[:, 1, 1] = 1.0
+        if self.virtualizer is not None:
+            matrices[:, :, 2] = self.virtualizer.positions()
+            return matrices
+        for i, item in self.profile_items.items():
+            t = item.sceneTransform()
+            matrices[i] = ((t.m11(), t.m21(), t.dx()), (t.m12(), t.m22(), t.dy()))
+        return matrices
+
+    def toggleNesting(self):
+        if self._nester is not None:
+            self.stop_nesting()
+        else:
+            self.nestParts()
+
+    def nestParts(self):
+        # Nests every closed item, keeping its current shape (mirrored block
+        # copies stay mirrored), onto sheets laid out under the drawing
+        items = list(dict.fromkeys(self.profile_items.values())) + [item for _, _, item, _ in self.instance_items]
+        items = [item for item in items if item.brush().style() != Qt.NoBrush]
+        parts, linear = [], []
+        for item in items:
+            t = item.sceneTransform()
+            matrix = np.array(((t.m11(), t.m21()), (t.m12(), t.m22())))
+            polygons = [polygon_to_array(p) @ matrix.T for p in item.path().toSubpathPolygons()]
+            parts.append([p for p in polygons if len(p) >= 3])
+            linear.append(matrix)
+        keep = [k for k, polygons in enumerate(parts) if polygons]
+        if not keep:
+            return
+        self.nest_items = [items[k] for k in keep]
+        self.nest_linear = [linear[k] for k in keep]
+        bounds = self.scene.itemsBoundingRect()
+        gap = self.nest_spacing_spinbox.value() + 0.05 * self.sheet_height_spinbox.value()
+        self.nest_origin = (bounds.left(), bounds.top() - gap - self.sheet_height_spinbox.value())
+
+        self._nester_thread = QThread(self)
+        self._nester = NestRunner([parts[k] for k in keep], self.sheet_width_spinbox.value(),
+                                  self.sheet_height_spinbox.value(), self.nest_spacing_spinbox.value(),
+                                  self.nest_rotations_spinbox.value())
+        self._nester.moveToThread(self._nester_thread)
+        self._nester_thread.started.connect(self._nester.run)
+        self._nester.layoutReady.connect(self.applyLayout)
+        self._nester.failed.connect(self.onNestFailed)
+        self._nester.finished.connect(self._nester_thread.quit)
+        self._nester.finished.connect(self._nester.deleteLater)
+        self._nester_thread.finished.connect(self._nester_thread.deleteLater)
+        self._nester_thread.finished.connect(self.onNestFinished)
+        self.nest_button.setText("Stop Nesting")
+        print(f"Nesting {len(keep)} parts")
+        self._nester_thread.start()
+
+    def stop_nesting(self):
+        if self._nester is not None:
+            try:
+                self._nester.cancel()
+                self._nester.layoutReady.disconnect(self.applyLayout)
+            except (RuntimeError, TypeError):
+                pass
+            self._nester = None
+        self.keepCancelledThread(self._nester_thread)
+        self._nester_thread = None
+        self.nest_button.setText("Nest")
+
+    def applyLayout(self, layout):
+        # Moves the nested items onto their sheets, called again for every better layout
+        x0, y0 = self.nest_origin
+        gap = 0.05 * layout.height
+        self.clearToolpath()
+        with profiler.span('apply layout', parts=len(layout)):
+            for sheet in self.sheet_items:
+                self.scene.removeItem(sheet)
+            self.sheet_items = []
+            for s in range(layout.sheets):
+                sheet = QGraphicsRectItem(x0 + s * (layout.width + gap), y0, layout.width, layout.height)
+                sheet.setPen(QPen(QColor(120, 120, 140), 0))
+                sheet.setZValue(-1)
+                self.scene.addItem(sheet)
+                self.sheet_items.append(sheet)
+            for placement in layout.placements:
+                item = self.nest_items[placement.part]
+                m = placement.matrix
+                a = m[:, :2] @ self.nest_linear[placement.part]
+                dx = m[0, 2] + x0 + placement.sheet * (layout.width + gap)
+                dy = m[1, 2] + y0
+                item.setPos(0, 0)
+                item.setTransform(QTransform(a[0, 0], a[1, 0], a[0, 1], a[1, 1], dx, dy))
+        print(f"Nest candidate {layout.candidate}: {len(layout)} parts on {layout.sheets} sheets, "
+              f"{layout.utilization:.1%} utilization, {len(layout.unplaced)} did not fit")
+
+    def onNestFailed(self, message):
+        print(f"Nesting failed: {message}")
+
+    def onNestFinished(self):
+        if self.sender() is self._nester_thread:
+            self._nester = None
+            self._nester_thread = None
+            self.nest_button.setText("Nest")
+
+    def onLoadProgress(self, done, total, stage):
+        if self._stale_loads:
+            return
+        if total:
+            self.load_progress_bar.setRange(0, total)
+            self.load_progress_bar.setValue(done)
+        else:
+            self.load_progress_bar.setRange(0, 0)
+        self.load_progress_bar.setFormat(f"{stage} %p%")
+
+    def onLoadFailed(self, message):
+        if self._stale_loads:
+            return
+        print(f"Failed to load: {message}")
+
+    def onLoadFinished(self):
+        if self.sender() is self._loader_thread:
+            self._loader = None
+            self._loader_thread = None
+            self.cancel_load_button.setEnabled(False)
+            self.load_progress_bar.hide()
+            profiler.record('load', self._load_start, time.perf_counter() - self._load_start)
+            # Only a complete load has an item for every profile
+            self.export_button.setEnabled(self.profiles is not None and
+                                          (self.virtualizer is not None or len(self.profile_items) == len(self.profiles)))
+            self.save_button.setEnabled(self.export_button.isEnabled())
+            self.order_cuts_button.setEnabled(self.export_button.isEnabled())
+            self.check_button.setEnabled(self.export_button.isEnabled())
+            # Nesting moves items, a virtualized scene only has those in view
+            self.nest_button.setEnabled(self.profiles is not None and self.virtualizer is None)
+
+    def onStaleResultsDropped(self):
+        self._stale_loads -= 1
+
+    def onCancelledThreadFinished(self):
+        if self.sender() in self._cancelled_threads:
+            self._cancelled_threads.remove(self.sender())
+
+    def closeEvent(self, event):
+        self.closeReport()
+        self.cancel_load()
+        self.stop_nesting()
+        for thread in self._cancelled_threads:
+            try:
+                thread.quit()
+                thread.wait()
+            except RuntimeError:
+                pass
+        self._cancelled_threads = []
+        super().closeEvent(event)
 
     def resizeEvent(self, event):
         super().resizeEvent(event)
@@ -0,0 +1,289 @@
+from collections import namedtuple
+from math import pi
+
+import numpy as np
+
+from box_index import BoxIndex
+from geometry_store import LINE, CIRCLE, ARC, LWPOLYLINE, sweep_angles
+from profile_engine import bulge_segment_lengths, run_areas2, run_lengths, run_segments
+
+# Measurements and design rule checks of a whole drawing at once. Every
+# function takes the column arrays of a GeometryStore or ProfileSet and
+# returns columns again, one row per entity, profile or issue, so a report
+# of a million rows is a handful of array operations and no Python code
+# runs per row. Nothing here imports PyQt5.
+
+# Issues found by check_drawing, in the checks column
+ZERO_LENGTH, DUPLICATE, SMALL_HOLE, THIN_WEB = 0, 1, 2, 3
+CHECK_NAMES = ('Zero length', 'Duplicate', 'Small hole', 'Thin web')
+# Kind of the issues about profiles rather than single entities
+PROFILE = -1
+
+DEFAULT_MIN_WEB = 1.0
+DEFAULT_MIN_HOLE = 1.0
+
+# Per entity, in store order (lines, circles, arcs, polylines). Lengths are
+# measured along arcs and bulges, areas are those enclosed by circles and
+# closed polylines, 0 for the rest; bounds are (xmin, ymin, xmax, ymax).
+EntityMeasures = namedtuple('EntityMeasures', 'kinds indices layers lengths areas bounds')
+# Per profile. Areas are enclosed by the loop itself, net areas have the
+# loop's holes taken out; open chains have no area.
+ProfileMeasures = namedtuple('ProfileMeasures', 'lengths areas net_areas bounds owners')
+# One row per issue: the check, the entity (kind, index) or profile
+# (PROFILE, index) at fault, the one it clashes with ((-1, -1) if none),
+# the measured value (a length) and where it is.
+Issues = namedtuple('Issues', 'checks kinds indices other_kinds other_indices values xy')
+
+
+def entity_measures(store):
+    lines, circles, arcs = store.lines, store.circles, store.arcs
+    counts = store.counts()
+    sweeps = np.radians(sweep_angles(arcs[:, 3], arcs[:, 4]))
+    poly_areas = np.abs(run_areas2(store.poly_vertices, store.poly_offsets, store.poly_closed)) / 2.0
+    lengths = np.concatenate((np.hypot(lines[:, 2] - lines[:, 0], lines[:, 3] - lines[:, 1]),
+                              2 * pi * circles[:, 2],
+                              arcs[:, 2] * sweeps,
+                              run_lengths(store.poly_vertices, store.poly_offsets, store.poly_closed)))
+    areas = np.concatenate((np.zeros(len(lines)), pi * circles[:, 2] ** 2, np.zeros(len(arcs)),
+                            np.where(store.poly_closed, poly_areas, 0.0)))
+    return EntityMeasures(np.repeat(np.arange(4, dtype=np.int8), counts),
+                          np.concatenate([np.arange(n, dtype=np.int64) for n in counts]),
+                          np.concatenate(store.layer_columns), lengths, areas,
+                          np.concatenate(store.entity_bounds()))
+
+
+def profile_measures(profiles, points, offsets, owners=None):
+    # points and offsets are the tessellated profiles, they give the bounds
+    # with arcs bulging out of their vertices; owners maps holes to their
+    # outline, see containment.hole_owners
+    count = len(profiles)
+    lengths = run_lengths(profiles.vertices, profiles.offsets, profiles.closed)
+    areas = np.where(profiles.closed, np.abs(run_areas2(profiles.vertices, profiles.offsets, profiles.closed)) / 2.0, 0.0)
+    owners = np.full(count, -1, dtype=np.int64) if owners is None else np.asarray(owners, dtype=np.int64)
+    holes = owners >= 0
+    net_areas = areas - np.bincount(owners[holes], weights=areas[holes], minlength=count)
+    return ProfileMeasures(lengths, areas, net_areas, _run_bounds(points, offsets), owners)
+
+
+def _run_bounds(points, offsets):
+    # (P, 4) bounds of every run of points, NaN for empty runs
+    bounds = np.full((len(offsets) - 1, 4), np.nan)
+    starts = offsets[:-1]
+    full = np.diff(offsets) > 0
+    if len(points) and full.any():
+        starts = starts[full]
+        bounds[full] = np.column_stack((np.minimum.reduceat(points[:, 0], starts),
+                                        np.minimum.reduceat(points[:, 1], starts),
+                                        np.maximum.reduceat(points[:, 0], starts),
+                                        np.maximum.reduceat(points[:, 1], starts)))
+    return bounds
+
+
+def check_drawing(store, profiles, points, offsets, owners=None, min_web=DEFAULT_MIN_WEB, min_hole=DEFAULT_MIN_HOLE,
+                  tolerance=1e-6):
+    # Every issue of the drawing: entities and polyline segments no longer
+    # than tolerance, straight segments lying over one another, holes of a
+    # smaller diameter than min_hole and closed profiles coming closer than
+    # min_web to each other. Entity checks run on the store, profile checks
+    # on the profiles (tessellated into points and offsets), wherever they
+    # are placed. A check is skipped when its limit is 0.
+    parts = [zero_length(store, tolerance), duplicate_segments(store, tolerance)]
+    if min_hole > 0:
+        parts.append(small_holes(profiles, owners, min_hole))
+    if min_web > 0:
+        parts.append(thin_webs(points, offsets, profiles.closed, min_web))
+    return concatenate_issues(parts)
+
+
+def concatenate_issues(parts):
+    return Issues(*(np.concatenate([getattr(part, name) for part in parts]) for name in Issues._fields))
+
+
+def _issues(check, kinds, indices, values, xy, other_kinds=None, other_indices=None):
+    n = len(values)
+
+    def column(values, dtype):
+        return np.broadcast_to(np.asarray(-1 if values is None else values, dtype=dtype), (n,)).copy()
+
+    return Issues(column(check, np.int8), column(kinds, np.int8), column(indices, np.int64),
+                  column(other_kinds, np.int8), column(other_indices, np.int64), column(values, np.float64),
+                  np.asarray(xy, dtype=np.float64).reshape(-1, 2))
+
+
+def zero_length(store, tolerance=1e-6):
+    # Lines, circles, arcs and polyline segments of length tolerance or less.
+    # A polyline is reported once per such segment.
+    lines, circles, arcs = store.lines, store.circles, store.arcs
+    line_lengths = np.hypot(lines[:, 2] - lines[:, 0], lines[:, 3] - lines[:, 1])
+    arc_lengths = arcs[:, 2] * np.radians(sweep_angles(arcs[:, 3], arcs[:, 4]))
+    p, q, b, runs = run_segments(store.poly_vertices, store.poly_offsets, store.poly_closed)
+    segment_lengths = bulge_segment_lengths(p, q, b)
+    parts = []
+    for kind, lengths, xy, ids in ((LINE, line_lengths, lines[:, :2], None),
+                                   (CIRCLE, 2 * pi * circles[:, 2], circles[:, :2], None),
+                                   (ARC, arc_lengths, arcs[:, :2], None),
+                                   (LWPOLYLINE, segment_lengths, p, runs)):
+        short = np.flatnonzero(lengths <= tolerance)
+        parts.append(_issues(ZERO_LENGTH, kind, short if ids is None else ids[short], lengths[short], xy[short]))
+    return concatenate_issues(parts)
+
+
+def straight_segments(store):
+    # Start and end points of the lines and straight polyline segments,
+    # with the (kind, index) of the entity each one comes from
+    p, q, b, runs = run_segments(store.poly_vertices, store.poly_offsets, store.poly_closed)
+    straight = b == 0
+    lines = store.lines
+    return (np.concatenate((lines[:, :2], p[straight])), np.concatenate((lines[:, 2:], q[straight])),
+            np.concatenate((np.full(len(lines), LINE), np.full(straight.sum(), LWPOLYLINE))).astype(np.int8),
+            np.concatenate((np.arange(len(lines)), runs[straight])))
+
+
+def duplicate_segments(store, tolerance=1e-6):
+    # Straight segments overlapping an earlier one on the same line by more
+    # than tolerance, reported against the earlier one reaching furthest
+    p, q, kinds, indices = straight_segments(store)
+    first, second, overlap = overlapping_segments(p, q, tolerance)
+    xy = (p[second] + q[second]) / 2
+    return _issues(DUPLICATE, kinds[second], indices[second], overlap, xy, kinds[first], indices[first])
+
+
+def overlapping_segments(p, q, tolerance=1e-6):
+    # (first, second, overlap) of collinear segments p->q sharing more than
+    # tolerance of their length. Segments are grouped by the line they lie
+    # on, its direction and distance from the origin rounded to tolerance,
+    # and sorted along it; each one is compared with the furthest reaching
+    # segment before it in its group. Lines straddling a rounding step are
+    # missed, exact and near exact copies are always found.
+    d = q - p
+    lengths = np.hypot(d[:, 0], d[:, 1])
+    ids = np.flatnonzero(lengths > tolerance)
+    empty = np.zeros(0, dtype=np.int64)
+    if len(ids) < 2:
+        return empty, empty, np.zeros(0)
+    p, d, lengths = p[ids], d[ids], lengths[ids]
+    u = d / lengths[:, None]
+    # One direction per line: pointing right, or up when vertical
+    flip = (u[:, 0] < 0) | ((u[:, 0] == 0) & (u[:, 1] < 0))
+    u[flip] = -u[flip]
+    t0 = (p * u).sum(axis=1)
+    t1 = t0 + np.where(flip, -lengths, lengths)
+    t0, t1 = np.minimum(t0, t1), np.maximum(t0, t1)
+    offset = p[:, 0] * u[:, 1] - p[:, 1] * u[:, 0]
+    # An angle step that moves the far end of the longest segment by tolerance
+    angle_keys = np.round(np.arctan2(u[:, 1], u[:, 0]) / (tolerance / max(lengths.max(), 1.0))).astype(np.int64)
+    offset_keys = np.round(offset / tolerance).astype(np.int64)
+    order = np.lexsort((t0, offset_keys, angle_keys))
+    angle_keys, offset_keys, t0, t1 = angle_keys[order], offset_keys[order], t0[order], t1[order]
+    new_group = np.concatenate(([True], (angle_keys[1:] != angle_keys[:-1]) | (offset_keys[1:] != offset_keys[:-1])))
+    group = np.cumsum(new_group) - 1
+
+    # Running maximum of t1 within each group, lifted group by group so one
+    # accumulate serves them all, with the position reaching it
+    span = t1.max() - t0.min() + 1.0
+    lifted = t1 - t0.min() + group * span
+    reach = np.maximum.accumulate(lifted)
+    positions = np.arange(len(lifted))
+    at = np.maximum.accumulate(np.where(lifted == reach, positions, 0))
+    previous = np.concatenate(([-1], at[:-1]))
+    valid = ~new_group
+    before = np.where(valid, reach[np.maximum(positions - 1, 0)] - group * span + t0.min(), -np.inf)
+    overlap = np.minimum(before, t1) - t0
+    duplicate = valid & (overlap > tolerance)
+    second = positions[duplicate]
+    return ids[order[previous[duplicate]]], ids[order[second]], overlap[duplicate]
+
+
+def small_holes(profiles, owners, min_diameter):
+    # Holes with less area than a circle of min_diameter, valued at the
+    # diameter of the circle with their area
+    if owners is None:
+        return _issues(SMALL_HOLE, PROFILE, [], [], [])
+    owners = np.asarray(owners, dtype=np.int64)
+    holes = np.flatnonzero((owners >= 0) & profiles.closed)
+    areas = np.abs(run_areas2(profiles.vertices, profiles.offsets, profiles.closed))[holes] / 2.0
+    diameters = 2 * np.sqrt(areas / pi)
+    small = diameters < min_diameter
+    holes = holes[small]
+    # Centre of the hole's vertices
+    lengths = np.diff(profiles.offsets)
+    owner = np.repeat(np.arange(len(lengths)), lengths)
+    xy = np.column_stack([np.bincount(owner, weights=profiles.vertices[:, axis], minlength=len(lengths))[holes]
+                          for axis in (0, 1)]) / lengths[holes, None]
+    return _issues(SMALL_HOLE, PROFILE, holes, diameters[small], xy, PROFILE, owners[holes])
+
+
+def thin_webs(points, offsets, closed, min_web, max_pairs=1 << 22):
+    # Pairs of closed profiles coming closer than min_web, from the
+    # tessellated points and offsets: the closest approach of two polylines
+    # is at a vertex of one of them, so vertices are measured against the
+    # segments of other profiles whose boxes, grown by min_web, contain
+    # them. Only segments sharing a grid cell with another profile's can be
+    # that close, the rest are dropped first. Reported once per pair at
+    # the closest vertex.
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    closed = np.asarray(closed, dtype=bool)
+    tested = closed & (np.diff(offsets) >= 2)
+    if tested.sum() < 2:
+        return _issues(THIN_WEB, PROFILE, [], [], [])
+    p, q, _, runs = run_segments(np.column_stack((points, np.zeros(len(points)))), offsets, closed)
+    keep = tested[runs]
+    p, q, runs = p[keep], q[keep], runs[keep]
+    lo, hi = np.minimum(p, q), np.maximum(p, q)
+    near = _shared_cells(np.column_stack((lo - min_web / 2, hi + min_web / 2)), runs,
+                         2 * max(min_web, float(np.median(hi - lo))))
+    p, q, runs, lo, hi = p[near], q[near], runs[near], lo[near], hi[near]
+    if not len(runs):
+        return _issues(THIN_WEB, PROFILE, [], [], [])
+
+    index = BoxIndex(np.column_stack((lo - min_web, hi + min_web)))
+    # Both ends of every remaining segment, ends shared by two segments twice
+    vertices, owner = np.concatenate((p, q)), np.concatenate((runs, runs))
+    found = []
+    # Chunks of vertices sized so the candidate pairs stay bounded
+    step = max(1, max_pairs // 16)
+    for k in range(0, len(vertices), step):
+        point_ids, segment_ids = index.query_points(vertices[k:k + step])
+        point_ids += k
+        other = owner[point_ids] != runs[segment_ids]
+        point_ids, segment_ids = point_ids[other], segment_ids[other]
+        distances = _point_segment_distances(vertices[point_ids], p[segment_ids], q[segment_ids])
+        close = distances < min_web
+        found.append((owner[point_ids[close]], runs[segment_ids[close]], distances[close], point_ids[close]))
+    a, b, distances, at = (np.concatenate(columns) for columns in zip(*found))
+    # Closest approach of every unordered pair
+    first, second = np.minimum(a, b), np.maximum(a, b)
+    order = np.lexsort((distances, second, first))
+    first, second, distances, at = first[order], second[order], distances[order], at[order]
+    unique = np.concatenate(([True], (first[1:] != first[:-1]) | (second[1:] != second[:-1]))) if len(first) else \
+        np.zeros(0, dtype=bool)
+    return _issues(THIN_WEB, PROFILE, first[unique], distances[unique], vertices[at[unique]], PROFILE, second[unique])
+
+
+def _shared_cells(bounds, owners, cell):
+    # (N,) whether each box covers a grid cell that a box of another owner covers too
+    k0 = np.floor(bounds[:, :2] / cell).astype(np.int64)
+    spans = np.floor(bounds[:, 2:] / cell).astype(np.int64) - k0 + 1
+    counts = spans[:, 0] * spans[:, 1]
+    rows = np.repeat(np.arange(len(bounds)), counts)
+    local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    keys = ((k0[rows, 0] + local % spans[rows, 0]) << 32) | ((k0[rows, 1] + local // spans[rows, 0]) & 0xffffffff)
+    order = np.argsort(keys)
+    keys, rows = keys[order], rows[order]
+    cell_owners = owners[rows]
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    mixed = np.minimum.reduceat(cell_owners, starts) != np.maximum.reduceat(cell_owners, starts)
+    mixed = np.repeat(mixed, np.diff(np.append(starts, len(keys))))
+    shared = np.zeros(len(bounds), dtype=bool)
+    shared[rows[mixed]] = True
+    return shared
+
+
+def _point_segment_distances(xy, p, q):
+    d = q - p
+    length2 = (d * d).sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.clip(np.where(length2 > 0, ((xy - p) * d).sum(axis=1) / length2, 0.0), 0.0, 1.0)
+    closest = p + d * t[:, None]
+    return np.hypot(xy[:, 0] - closest[:, 0], xy[:, 1] - closest[:, 1])
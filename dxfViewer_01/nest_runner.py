@@ -0,0 +1,46 @@
+import time
+
+from PyQt5.QtCore import QObject, pyqtSignal, pyqtSlot
+
+from instrumentation import profiler
+from nesting import DEFAULT_RESOLUTION, nest_iter
+
+
+class NestRunner(QObject):
+    # Runs the nesting candidates off the GUI thread and hands back every
+    # layout that improves on the previous one as it arrives
+    layoutReady = pyqtSignal(object)
+    finished = pyqtSignal()
+    failed = pyqtSignal(str)
+
+    def __init__(self, parts, width, height, spacing=0.0, rotations=4, resolution=DEFAULT_RESOLUTION,
+                 candidates=None, jobs=None):
+        super().__init__()
+        self.parts = parts
+        self.width = width
+        self.height = height
+        self.spacing = spacing
+        self.rotations = rotations
+        self.resolution = resolution
+        self.candidates = candidates
+        self.jobs = jobs
+        self._cancelled = False
+
+    def cancel(self):
+        # Checked between candidates; candidates already running finish in the pool
+        self._cancelled = True
+
+    @pyqtSlot()
+    def run(self):
+        try:
+            with profiler.span('nest', parts=len(self.parts)):
+                for layout in nest_iter(self.parts, self.width, self.height, self.spacing, self.rotations,
+                                        self.resolution, self.candidates, self.jobs):
+                    if self._cancelled:
+                        break
+                    profiler.record('nest candidate', time.perf_counter() - layout.seconds, layout.seconds,
+                                    {'candidate': layout.candidate, 'sheets': layout.sheets})
+                    self.layoutReady.emit(layout)
+        except Exception as e:
+            self.failed.emit(f"{type(e).__name__}: {e}")
+        self.finished.emit()
@@ -0,0 +1,318 @@
+import os
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from parallel_profiles import worker_pool
+
+# Automatic nesting of closed profiles onto rectangular sheets. Sheets and
+# parts are rasterized onto one grid and a part's free positions on a sheet
+# are found for all offsets at once: the correlation of the sheet occupancy
+# with the part mask, computed with FFTs, is zero exactly where the part does
+# not overlap anything. Parts go in largest first, every rotation step is
+# tried and the position that keeps the used length of the sheet shortest
+# wins (bottom-left fill).
+#
+# Part masks are conservative: every cell the outline passes through is
+# occupied, and the mask a part is tested with is grown by the spacing, so
+# placed parts never overlap as long as spacing is at least one cell.
+# Holes stay empty and smaller parts can be placed inside them.
+#
+# Several candidate orders (largest first, then randomly perturbed) are
+# nested in parallel on the worker pool and nest_iter yields every layout
+# that beats the best so far, so a viewer can show the first result early.
+#
+#   for layout in nest_iter(parts, 3000, 1500, spacing=5, rotations=4):
+#       print(layout.sheets, layout.utilization)
+
+DEFAULT_RESOLUTION = 384
+MAX_CACHED_MASKS = 256
+# Parts are only tried on the most recent sheets, earlier ones are nearly
+# full and testing them again costs an FFT each
+OPEN_SHEETS = 4
+
+# matrix (2, 3) maps part coordinates to the coordinates of its sheet,
+# whose lower left corner is the origin
+Placement = namedtuple('Placement', 'part sheet angle matrix')
+
+
+class Layout:
+    # Result of one candidate: placements of the parts that fit and the
+    # indices of those that did not
+    def __init__(self, placements, unplaced, sheets, width, height, area, length, candidate=0, seconds=0.0):
+        self.placements = placements
+        self.unplaced = unplaced
+        self.sheets = sheets
+        self.width = width
+        self.height = height
+        # Total area of the placed parts, holes excluded
+        self.area = area
+        # Used width of the last sheet
+        self.length = length
+        self.candidate = candidate
+        self.seconds = seconds
+
+    def __len__(self):
+        return len(self.placements)
+
+    @property
+    def utilization(self):
+        # Share of the used sheet area covered by parts, the last sheet
+        # counted up to its used width
+        used = (max(self.sheets - 1, 0) * self.width + self.length) * self.height
+        return self.area / used if used > 0 else 0.0
+
+    def fitness(self):
+        # Smaller is better: fewest parts left over, then fewest sheets, then
+        # the shortest last sheet
+        return (len(self.unplaced), self.sheets, self.length)
+
+
+def polygons_area(polygons):
+    # Even-odd area of a part: its largest polygon minus the others
+    areas = sorted((abs(_shoelace(p)) for p in polygons), reverse=True)
+    return areas[0] - sum(areas[1:]) if areas else 0.0
+
+
+def _shoelace(points):
+    x, y = points[:, 0], points[:, 1]
+    return (np.dot(x, np.roll(y, -1)) - np.dot(np.roll(x, -1), y)) / 2
+
+
+def _rotated(polygons, angle):
+    # Polygons rotated about the origin by angle degrees, the (2, 2) rotation
+    # and the lower left corner of their bounds
+    a = np.radians(angle)
+    rotation = np.array(((np.cos(a), -np.sin(a)), (np.sin(a), np.cos(a))))
+    rotated = [p @ rotation.T for p in polygons]
+    stacked = np.concatenate(rotated)
+    return rotated, rotation, stacked.min(axis=0), stacked.max(axis=0)
+
+
+def rasterize(polygons, cell, shape):
+    # Conservative even-odd mask of polygons whose bounds start at the
+    # origin: cells whose centre is inside, plus every cell an edge passes
+    # through (sampled at a quarter cell)
+    rows, cols = shape
+    toggles = np.zeros((rows, cols + 1), dtype=np.int32)
+    boundary = []
+    for p in polygons:
+        a, b = p, np.roll(p, -1, axis=0)
+        low, high = np.minimum(a[:, 1], b[:, 1]), np.maximum(a[:, 1], b[:, 1])
+        # Rows whose centre line the edge crosses, half open in y
+        first = np.ceil(low / cell - 0.5).astype(np.int64)
+        last = np.ceil(high / cell - 0.5).astype(np.int64)
+        first, last = np.clip(first, 0, rows), np.clip(last, 0, rows)
+        count = np.maximum(last - first, 0)
+        edge = np.repeat(np.arange(len(a)), count)
+        row = np.repeat(first - np.cumsum(count) + count, count) + np.arange(len(edge))
+        y = (row + 0.5) * cell
+        ax, ay, bx, by = a[edge, 0], a[edge, 1], b[edge, 0], b[edge, 1]
+        x = ax + (y - ay) * (bx - ax) / (by - ay)
+        col = np.clip(np.ceil(x / cell - 0.5).astype(np.int64), 0, cols)
+        np.add.at(toggles, (row, col), 1)
+
+        lengths = np.hypot(*(b - a).T)
+        steps = np.maximum(np.ceil(lengths / (cell / 4)).astype(np.int64), 1) + 1
+        t = np.arange(steps.sum()) - np.repeat(np.cumsum(steps) - steps, steps)
+        t = t / np.repeat(steps - 1, steps)
+        s = np.repeat(np.arange(len(a)), steps)
+        boundary.append(a[s] + (b[s] - a[s]) * t[:, None])
+    mask = np.cumsum(toggles, axis=1)[:, :cols] % 2 == 1
+    samples = np.floor(np.concatenate(boundary) / cell).astype(np.int64)
+    mask[np.clip(samples[:, 1], 0, rows - 1), np.clip(samples[:, 0], 0, cols - 1)] = True
+    return mask
+
+
+def dilate(mask, radius):
+    # Mask grown by radius cells in every direction (square structuring element)
+    if radius <= 0:
+        return mask
+    rows, cols = mask.shape
+    grown = np.zeros((rows + 2 * radius, cols + 2 * radius), dtype=bool)
+    for dy in range(2 * radius + 1):
+        grown[dy:dy + rows, radius:radius + cols] |= mask
+    wide = grown.copy()
+    for dx in range(2 * radius + 1):
+        wide[:, dx:dx + cols] |= grown[:, radius:radius + cols]
+    return wide
+
+
+def _fast_size(n):
+    # Smallest product of 2, 3 and 5 not below n
+    best = 1 << int(np.ceil(np.log2(max(n, 1))))
+    p3 = 1
+    while p3 < best:
+        p5 = p3
+        while p5 < best:
+            p2 = p5
+            while p2 < n:
+                p2 *= 2
+            best = min(best, p2)
+            p5 *= 5
+        p3 *= 3
+    return best
+
+
+class _Sheet:
+    # Occupancy grid of one sheet, padded by the spacing radius on every side
+    # and up to the FFT size
+    def __init__(self, shape, pad, padded):
+        self.grid = np.zeros(padded, dtype=np.float32)
+        self.free = shape[0] * shape[1]
+        self.failed = set()
+        self._spectrum = None
+        self.length = 0.0
+
+    def spectrum(self):
+        if self._spectrum is None:
+            self._spectrum = np.fft.rfft2(self.grid)
+        return self._spectrum
+
+    def occupy(self, mask, row, col, pad):
+        rows, cols = mask.shape
+        self.grid[row + pad:row + pad + rows, col + pad:col + pad + cols][mask] = 1.0
+        self.free -= int(mask.sum())
+        self._spectrum = None
+
+
+class _Nester:
+    # Places parts one at a time; rotated masks and their spectra are cached
+    # per distinct shape, so repeated parts are rasterized once
+
+    def __init__(self, parts, width, height, spacing=0.0, rotations=4, resolution=DEFAULT_RESOLUTION):
+        self.parts = parts
+        self.width, self.height = float(width), float(height)
+        self.cell = max(self.width, self.height) / resolution
+        self.shape = (int(np.ceil(self.height / self.cell)), int(np.ceil(self.width / self.cell)))
+        self.pad = int(np.ceil(spacing / self.cell)) if spacing > 0 else 0
+        # Padded up to sizes the FFT handles quickly, the extra cells stay free
+        self.padded = (_fast_size(self.shape[0] + 2 * self.pad), _fast_size(self.shape[1] + 2 * self.pad))
+        self.angles = [360.0 * k / max(rotations, 1) for k in range(max(rotations, 1))]
+        self.keys = [_shape_key(p) for p in parts]
+        self.areas = np.array([polygons_area(p) for p in parts])
+        self._cache = {}
+
+    def _variant(self, part, angle):
+        # (mask, spectrum of the spaced mask, rows, cols of valid positions,
+        # rotation, lower left corner) of a part at one rotation, None when it
+        # is larger than the sheet
+        key = (self.keys[part], angle)
+        variant = self._cache.get(key)
+        if variant is None and key not in self._cache:
+            rotated, rotation, low, high = _rotated(self.parts[part], angle)
+            size = high - low
+            rows = int(np.floor((self.height - size[1]) / self.cell)) + 1
+            cols = int(np.floor((self.width - size[0]) / self.cell)) + 1
+            if rows <= 0 or cols <= 0:
+                variant = None
+            else:
+                shape = (max(int(np.ceil(size[1] / self.cell)), 1), max(int(np.ceil(size[0] / self.cell)), 1))
+                mask = rasterize([p - low for p in rotated], self.cell, shape)
+                # rfft2 of the zero padded mask, transforming only the rows it covers
+                spaced = dilate(mask, self.pad).astype(np.float32)
+                spectrum = np.fft.fft(np.fft.rfft(spaced, n=self.padded[1], axis=1), n=self.padded[0], axis=0)
+                variant = (mask, np.conj(spectrum), rows, cols, rotation, low)
+            if len(self._cache) < MAX_CACHED_MASKS:
+                self._cache[key] = variant
+        return variant
+
+    def _best_position(self, sheet, part):
+        # (score, row, col, angle, variant) of the best free position of part
+        # on sheet over all rotations, None when it does not fit
+        best = None
+        for angle in self.angles:
+            key = (self.keys[part], angle)
+            if key in sheet.failed:
+                continue
+            variant = self._variant(part, angle)
+            if variant is None:
+                continue
+            mask, spectrum, rows, cols, _, _ = variant
+            if mask.sum() > sheet.free:
+                continue
+            overlap = np.fft.irfft2(sheet.spectrum() * spectrum, s=self.padded)[:rows, :cols]
+            free = overlap < 0.5
+            columns = free.any(axis=0)
+            if not columns.any():
+                sheet.failed.add(key)
+                continue
+            # Shortest used length first, then lowest
+            col = int(np.argmax(columns))
+            row = int(np.argmax(free[:, col]))
+            score = (col + mask.shape[1]) * self.padded[0] + row
+            if best is None or score < best[0]:
+                best = (score, row, col, angle, variant)
+        return best
+
+    def run(self, order, candidate=0):
+        start = time.perf_counter()
+        sheets, placements, unplaced = [], [], []
+        area = 0.0
+        for part in order:
+            if all(self._variant(part, angle) is None for angle in self.angles):
+                unplaced.append(part)
+                continue
+            first = max(len(sheets) - OPEN_SHEETS, 0)
+            for s, sheet in enumerate(sheets[first:] + [None], first):
+                if sheet is None:
+                    sheet = _Sheet(self.shape, self.pad, self.padded)
+                    sheets.append(sheet)
+                found = self._best_position(sheet, part)
+                if found is not None:
+                    break
+            else:
+                unplaced.append(part)
+                continue
+            _, row, col, angle, (mask, _, _, _, rotation, low) = found
+            sheet.occupy(mask, row, col, self.pad)
+            x, y = col * self.cell, row * self.cell
+            sheet.length = max(sheet.length, x + mask.shape[1] * self.cell)
+            matrix = np.column_stack((rotation, (x, y) - low))
+            placements.append(Placement(part, s, angle, matrix))
+            area += self.areas[part]
+        length = min(sheets[-1].length, self.width) if sheets else 0.0
+        return Layout(placements, unplaced, len(sheets), self.width, self.height, area, length, candidate,
+                      time.perf_counter() - start)
+
+
+def _shape_key(polygons):
+    # Parts with the same outline and holes, wherever they are, share a key
+    low = np.concatenate(polygons).min(axis=0)
+    return hash(tuple(np.round(p - low, 6).tobytes() for p in polygons))
+
+
+def candidate_order(areas, candidate):
+    # Largest first for candidate 0, later candidates perturb the areas
+    areas = np.asarray(areas, dtype=np.float64)
+    if candidate:
+        areas = areas * np.random.default_rng(candidate).uniform(0.7, 1.3, len(areas))
+    return np.argsort(-areas, kind='stable').tolist()
+
+
+def _nest_candidate(job):
+    parts, width, height, spacing, rotations, resolution, candidate = job
+    nester = _Nester(parts, width, height, spacing, rotations, resolution)
+    return nester.run(candidate_order(nester.areas, candidate), candidate)
+
+
+def nest(parts, width, height, spacing=0.0, rotations=4, resolution=DEFAULT_RESOLUTION, candidate=0):
+    # One layout of parts, each a list of (N, 2) polygons (outline and
+    # holes), on as many width x height sheets as needed
+    return _nest_candidate((parts, width, height, spacing, rotations, resolution, candidate))
+
+
+def nest_iter(parts, width, height, spacing=0.0, rotations=4, resolution=DEFAULT_RESOLUTION, candidates=None,
+              jobs=None):
+    # Nests candidates orders (one per job by default) over jobs worker
+    # processes and yields every layout better than the ones before it
+    jobs = jobs or os.cpu_count() or 1
+    candidates = candidates or max(jobs, 1)
+    work = [(parts, width, height, spacing, rotations, resolution, c) for c in range(candidates)]
+    results = map(_nest_candidate, work) if jobs <= 1 else worker_pool(jobs).imap_unordered(_nest_candidate, work)
+    best = None
+    for layout in results:
+        if best is None or layout.fitness() < best.fitness():
+            best = layout
+            yield layout
@@ -0,0 +1,188 @@
+import atexit
+import multiprocessing
+import os
+
+import numpy as np
+
+from geometry_store import InstanceSet, sweep_angles
+from instrumentation import profiler
+from profile_engine import concatenate_profiles, find_profiles
+
+# Profile detection spread over a process pool. Profiles never span two
+# connected pieces of a drawing, so the store is split into pieces whose
+# entity endpoints cannot snap together, every batch of pieces goes through
+# find_profiles in a worker and the results are stitched back into one
+# ProfileSet with global entity references.
+#
+# Pieces come from a coarse grid: the cells holding the two endpoints of an
+# open entity are joined, as are the cells touched by the tolerance box
+# around every endpoint, so endpoints that could snap always share a piece.
+# Within a piece the entities keep their relative order and find_profiles
+# walks them exactly as it does serially. The merged profiles are ordered by
+# their first entity, which makes the result independent of the number of
+# workers; sort_profiles puts a serial result in the same order.
+
+MIN_ENTITIES = 20000
+GRID_SIZE = 256
+PIECES_PER_JOB = 4
+
+_pool = None
+_pool_size = 0
+
+
+def _endpoints(store):
+    # Positions of every entity (first endpoint, centre of circles) and the
+    # (start, end) pairs of open entities whose endpoints must share a piece
+    lines, arcs, circles = store.lines, store.arcs, store.circles
+    sweep = sweep_angles(arcs[:, 3], arcs[:, 4])
+    start, end = np.radians(arcs[:, 3]), np.radians(arcs[:, 3] + sweep)
+    arc_start = np.column_stack((arcs[:, 0] + arcs[:, 2] * np.cos(start), arcs[:, 1] + arcs[:, 2] * np.sin(start)))
+    arc_end = np.column_stack((arcs[:, 0] + arcs[:, 2] * np.cos(end), arcs[:, 1] + arcs[:, 2] * np.sin(end)))
+
+    offsets, v = store.poly_offsets, store.poly_vertices[:, :2]
+    has_vertices = np.diff(offsets) > 0
+    poly_start = np.zeros((len(store.poly_closed), 2))
+    poly_end = np.zeros((len(store.poly_closed), 2))
+    poly_start[has_vertices] = v[offsets[:-1][has_vertices]]
+    poly_end[has_vertices] = v[offsets[1:][has_vertices] - 1]
+    poly_open = ~store.poly_closed & (np.diff(offsets) >= 2)
+    poly_end[~poly_open] = poly_start[~poly_open]
+
+    starts = np.concatenate((lines[:, :2], circles[:, :2], arc_start, poly_start))
+    ends = np.concatenate((lines[:, 2:], circles[:, :2], arc_end, poly_end))
+    return starts, ends
+
+
+def _components(u, v, count):
+    # Connected component label (smallest member) of count nodes joined by
+    # the edges (u, v): min-label hooking with pointer jumping
+    labels = np.arange(count)
+    while True:
+        lowest = np.minimum(labels[u], labels[v])
+        hooked = labels.copy()
+        for side in (u, v):
+            np.minimum.at(hooked, side, lowest)
+            np.minimum.at(hooked, labels[side], lowest)
+        while True:
+            jumped = hooked[hooked]
+            if np.array_equal(jumped, hooked):
+                break
+            hooked = jumped
+        if np.array_equal(hooked, labels):
+            return labels
+        labels = hooked
+
+
+def split_pieces(store, tolerance, pieces):
+    # Piece number of every entity, one array per kind in store order. Pieces
+    # are cut from the connected components in grid order, so each covers a
+    # roughly contiguous area and holds about the same number of vertices.
+    counts = store.counts()
+    starts, ends = _endpoints(store)
+    if not len(starts):
+        return [np.zeros(n, dtype=np.int64) for n in counts]
+    points = np.concatenate((starts, ends))
+    low = points.min(axis=0)
+    cell = max(float((points.max(axis=0) - low).max()) / GRID_SIZE, 4.0 * tolerance)
+
+    def cells(p):
+        # Tolerance boxes reach one cell past the edges of the grid
+        ij = np.floor((p - low) / cell).astype(np.int64) + 1
+        return ij[:, 0] * (GRID_SIZE + 3) + ij[:, 1]
+
+    margin = 2.0 * tolerance
+    corners = [cells(points + (dx, dy)) for dx in (-margin, margin) for dy in (-margin, margin)]
+    n = len(starts)
+    keys, compact = np.unique(np.concatenate([cells(points)] + corners), return_inverse=True)
+    own = compact[:2 * n]
+    u = np.concatenate([own[:n]] + [own] * 4)
+    v = np.concatenate([own[n:]] + [compact[(k + 1) * 2 * n:(k + 2) * 2 * n] for k in range(4)])
+    component = _components(u, v, len(keys))[own[:n]]
+
+    # Polylines weigh their vertex count, everything else one vertex
+    weights = np.ones(n, dtype=np.int64)
+    weights[n - counts[3]:] = np.maximum(np.diff(store.poly_offsets), 1)
+    per_component = np.bincount(component, weights, minlength=len(keys))
+    before = np.cumsum(per_component) - per_component
+    piece = np.minimum((before * pieces // max(per_component.sum(), 1)).astype(np.int64), pieces - 1)[component]
+    return np.split(piece, np.cumsum(counts)[:-1])
+
+
+def _find_piece(job):
+    store, tolerance = job
+    return find_profiles(store, tolerance)
+
+
+def _global_refs(refs, indices):
+    # (kind, piece index) -> (kind, store index)
+    refs = refs.copy()
+    for kind, index in enumerate(indices):
+        rows = refs[:, 0] == kind
+        refs[rows, 1] = index[refs[rows, 1]]
+    return refs
+
+
+def sort_profiles(profiles):
+    # Profiles ordered by their first entity, dangling entities sorted
+    first = profiles.edges[np.minimum(profiles.edge_offsets[:-1], max(len(profiles.edges) - 1, 0))]
+    if not len(profiles.edges):
+        first = np.zeros((len(profiles), 2), dtype=np.int64)
+    order = np.lexsort((first[:, 1], first[:, 0]))
+    result = profiles.take(order)
+    if len(result.dangling):
+        result.dangling = result.dangling[np.lexsort((result.dangling[:, 1], result.dangling[:, 0]))]
+    return result
+
+
+def worker_pool(jobs):
+    # Spawned rather than forked: the loader calls in from a QThread and a
+    # forked child would inherit the GUI's threads and locks
+    global _pool, _pool_size
+    if _pool is None or _pool_size != jobs:
+        shutdown()
+        _pool = multiprocessing.get_context('spawn').Pool(jobs)
+        _pool_size = jobs
+    return _pool
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.terminate()
+        _pool.join()
+        _pool = None
+
+
+atexit.register(shutdown)
+
+
+def find_profiles_parallel(store, tolerance=1e-3, jobs=None, min_entities=MIN_ENTITIES):
+    # find_profiles over jobs worker processes (all cores by default), in
+    # sort_profiles order. Small drawings, single jobs and drawings that are
+    # one connected piece run serially in this process.
+    jobs = jobs or os.cpu_count() or 1
+    if jobs <= 1 or len(store) < min_entities:
+        return sort_profiles(find_profiles(store, tolerance))
+
+    with profiler.span('split pieces', entities=len(store)):
+        pieces = jobs * PIECES_PER_JOB
+        piece_ids = split_pieces(store, tolerance, pieces)
+        work = []
+        for p in range(pieces):
+            indices = [np.flatnonzero(ids == p) for ids in piece_ids]
+            if sum(len(i) for i in indices):
+                piece = store.take(indices)
+                piece.instances = InstanceSet()
+                work.append((indices, piece))
+    profiler.count('pieces', len(work))
+    if len(work) <= 1:
+        return sort_profiles(find_profiles(store, tolerance))
+
+    with profiler.span('profile workers', pieces=len(work), jobs=jobs):
+        results = worker_pool(jobs).map(_find_piece, [(piece, tolerance) for _, piece in work], chunksize=1)
+
+    with profiler.span('merge pieces'):
+        for (indices, _), profiles in zip(work, results):
+            profiles.edges = _global_refs(profiles.edges, indices)
+            profiles.dangling = _global_refs(profiles.dangling, indices)
+        return sort_profiles(concatenate_profiles(results))
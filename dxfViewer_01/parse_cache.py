@@ -0,0 +1,172 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from geometry_store import GeometryStore, InstanceSet
+from profile_engine import ProfileSet
+
+
+# Bumped whenever the parser, the store layout or profile detection change
+# what would be cached for the same file
+CACHE_VERSION = 2
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024
+
+_STORE_ARRAYS = ('lines', 'circles', 'arcs', 'poly_vertices', 'poly_offsets', 'poly_closed')
+_PROFILE_ARRAYS = ('vertices', 'offsets', 'closed', 'layers', 'edges', 'edge_offsets', 'dangling')
+_INSTANCE_ARRAYS = ('block_ids', 'matrices', 'layers', 'handles')
+
+
+def default_cache_dir():
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'dxfviewer', 'parse')
+
+
+def file_digest(filename, chunk_size=1 << 20):
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+class ParseCache:
+    # Content addressed cache of parsed drawings. An entry is a directory of
+    # .npy files holding the GeometryStore columns and the ProfileSet found
+    # in them, keyed by the SHA-1 of the DXF plus every setting that changes
+    # the result. Entries are memory mapped on load, so reopening a drawing
+    # costs a few file opens whatever its size. The least recently used
+    # entries are removed once the cache grows past max_bytes.
+    #
+    # Hashing a large file still takes a while, so digests are remembered per
+    # (path, size, mtime) in digests.json and only recomputed when the file
+    # changed on disk.
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory or default_cache_dir()
+        self.max_bytes = max_bytes
+        self._digests = None
+
+    def key(self, filename, tolerance, layers=None):
+        settings = json.dumps({'version': CACHE_VERSION, 'tolerance': tolerance,
+                               'layers': None if layers is None else sorted(layers)}, sort_keys=True)
+        return hashlib.sha1((self._digest(filename) + settings).encode()).hexdigest()
+
+    def load(self, filename, tolerance, layers=None):
+        # (store, profiles) of a cached drawing, None on a miss
+        entry = os.path.join(self.directory, self.key(filename, tolerance, layers))
+        try:
+            with open(os.path.join(entry, 'meta.json'), encoding='utf-8') as f:
+                meta = json.load(f)
+            arrays = {name: np.load(os.path.join(entry, name + '.npy'), mmap_mode='r')
+                      for name in meta['arrays']}
+        except (OSError, ValueError, KeyError):
+            return None
+        # Touching the entry marks it as recently used
+        try:
+            os.utime(entry)
+        except OSError:
+            pass
+
+        instances = InstanceSet(meta['blocks'], *(arrays['instances_' + name] for name in _INSTANCE_ARRAYS))
+        store = GeometryStore(*(arrays['store_' + name] for name in _STORE_ARRAYS), layers=meta['layers'],
+                              layer_columns=[arrays[f'store_layer_{k}'] for k in range(4)],
+                              handle_columns=[arrays[f'store_handle_{k}'] for k in range(4)],
+                              instances=instances)
+        profiles = ProfileSet(*(arrays['profiles_' + name] for name in _PROFILE_ARRAYS))
+        return store, profiles
+
+    def save(self, filename, tolerance, store, profiles, layers=None):
+        key = self.key(filename, tolerance, layers)
+        arrays = {'store_' + name: getattr(store, name) for name in _STORE_ARRAYS}
+        arrays.update({f'store_layer_{k}': c for k, c in enumerate(store.layer_columns)})
+        arrays.update({f'store_handle_{k}': c for k, c in enumerate(store.handle_columns)})
+        arrays.update({'profiles_' + name: getattr(profiles, name) for name in _PROFILE_ARRAYS})
+        arrays.update({'instances_' + name: getattr(store.instances, name) for name in _INSTANCE_ARRAYS})
+
+        os.makedirs(self.directory, exist_ok=True)
+        # Written next to the final location and renamed in one step, so a
+        # crash or a concurrent writer never leaves a half written entry
+        tmp = tempfile.mkdtemp(prefix='.tmp-', dir=self.directory)
+        try:
+            for name, array in arrays.items():
+                np.save(os.path.join(tmp, name + '.npy'), np.ascontiguousarray(array))
+            with open(os.path.join(tmp, 'meta.json'), 'w', encoding='utf-8') as f:
+                json.dump({'version': CACHE_VERSION, 'source': os.path.abspath(filename),
+                           'layers': list(store.layers), 'blocks': list(store.instances.blocks),
+                           'arrays': sorted(arrays)}, f)
+            os.replace(tmp, os.path.join(self.directory, key))
+        except OSError:
+            # Another process cached the same drawing first
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.evict()
+
+    def entries(self):
+        # [(last use, size in bytes, path)] of every entry, oldest first
+        entries = []
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return entries
+        for name in names:
+            path = os.path.join(self.directory, name)
+            if name.startswith('.') or not os.path.isdir(path):
+                continue
+            try:
+                size = sum(e.stat().st_size for e in os.scandir(path))
+                entries.append((os.stat(path).st_mtime, size, path))
+            except OSError:
+                continue
+        entries.sort()
+        return entries
+
+    def nbytes(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        for _, _, path in self.entries():
+            shutil.rmtree(path, ignore_errors=True)
+
+    def _digest(self, filename):
+        stat = os.stat(filename)
+        stamp = f"{os.path.abspath(filename)}|{stat.st_size}|{stat.st_mtime_ns}"
+        digests = self._loadDigests()
+        digest = digests.get(stamp)
+        if digest is None:
+            digest = digests[stamp] = file_digest(filename)
+            self._saveDigests()
+        return digest
+
+    def _loadDigests(self):
+        if self._digests is None:
+            try:
+                with open(os.path.join(self.directory, 'digests.json'), encoding='utf-8') as f:
+                    self._digests = json.load(f)
+            except (OSError, ValueError):
+                self._digests = {}
+        return self._digests
+
+    def _saveDigests(self):
+        # Stamps of files that no longer exist are dropped on the way
+        self._digests = {stamp: d for stamp, d in self._digests.items()
+                         if os.path.exists(stamp.rsplit('|', 2)[0])}
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp = os.path.join(self.directory, f'.digests-{os.getpid()}.json')
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(self._digests, f)
+            os.replace(tmp, os.path.join(self.directory, 'digests.json'))
+        except OSError:
+            pass
@@ -0,0 +1,54 @@
+import numpy as np
+from PyQt5.QtGui import QPainterPath, QPolygonF
+
+# QPainterPaths straight from flattened coordinate buffers. The points are
+# copied into a QPolygonF with one memcpy through its data pointer and every
+# profile is a slice of it, so no Python code runs per vertex. QPolygonF and
+# QPainterPath are plain value types and can be built on a worker thread.
+#
+# The holes of a profile (see containment.hole_owners) are added to its path
+# as further subpaths and the default odd-even fill leaves them empty.
+
+
+def polygon_from_array(points):
+    # (N, 2) float64 coordinates -> QPolygonF, one copy
+    points = np.ascontiguousarray(points, dtype=np.float64).reshape(-1, 2)
+    polygon = QPolygonF(len(points))
+    if len(points):
+        buffer = polygon.data()
+        buffer.setsize(points.nbytes)
+        np.frombuffer(buffer, dtype=np.float64).reshape(-1, 2)[:] = points
+    return polygon
+
+
+def polygon_to_array(polygon):
+    # QPolygonF -> (N, 2) float64 coordinates, one copy
+    if not len(polygon):
+        return np.zeros((0, 2))
+    buffer = polygon.data()
+    buffer.setsize(len(polygon) * 16)
+    return np.frombuffer(buffer, dtype=np.float64).reshape(-1, 2).copy()
+
+
+def build_paths(points, offsets, closed, owners=None):
+    # Yields one path per profile that is not a hole, as (path, profile ids)
+    # in profile order; ids lists the profile followed by its holes
+    points = np.ascontiguousarray(points, dtype=np.float64).reshape(-1, 2)
+    offsets = np.asarray(offsets)
+    closed = np.asarray(closed, dtype=bool).tolist()
+    count = len(offsets) - 1
+    holes = [[] for _ in range(count)]
+    if owners is not None:
+        for hole, owner in zip(np.flatnonzero(owners >= 0).tolist(), owners[owners >= 0].tolist()):
+            holes[owner].append(hole)
+    polygon = polygon_from_array(points)
+    starts, lengths = offsets[:-1].tolist(), np.diff(offsets).tolist()
+    for i in range(count):
+        if owners is not None and owners[i] >= 0:
+            continue
+        path = QPainterPath()
+        for k in [i] + holes[i]:
+            path.addPolygon(polygon.mid(starts[k], lengths[k]))
+            if closed[k]:
+                path.closeSubpath()
+        yield path, [i] + holes[i]
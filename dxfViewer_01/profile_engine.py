@@ -0,0 +1,561 @@
+from collections import defaultdict
+from math import atan2, pi
+
+import numpy as np
+
+from geometry_store import LINE, CIRCLE, ARC, LWPOLYLINE, sweep_angles
+
+
+class ProfileSet:
+    # Closed loops and open chains found in a drawing, stored the same way as
+    # GeometryStore polylines so arcs stay exact:
+    #   vertices     (K, 3) float64  x, y, bulge of the segment starting at the vertex
+    #   offsets      (P + 1,) int64  vertices of profile i are vertices[offsets[i]:offsets[i + 1]]
+    #   closed       (P,) bool       closed loops repeat no vertex, the last bulge closes the loop
+    #   layers       (P,) int32      layer index (into the store's layers) of the first entity
+    #   edges        (R, 2) int64    (kind, index) of the entities making up each profile,
+    #   edge_offsets (P + 1,) int64  indexed like vertices
+    #   dangling     (D, 2) int64    (kind, index) of entities that are not part of any closed loop
+
+    def __init__(self, vertices, offsets, closed, layers, edges, edge_offsets, dangling):
+        self.vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 3)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.closed = np.asarray(closed, dtype=bool)
+        self.layers = np.asarray(layers, dtype=np.int32)
+        self.edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+        self.edge_offsets = np.asarray(edge_offsets, dtype=np.int64)
+        self.dangling = np.asarray(dangling, dtype=np.int64).reshape(-1, 2)
+
+    def __len__(self):
+        return len(self.closed)
+
+    def profile(self, i):
+        return self.vertices[self.offsets[i]:self.offsets[i + 1]]
+
+    def profile_edges(self, i):
+        return self.edges[self.edge_offsets[i]:self.edge_offsets[i + 1]]
+
+    def take(self, ids):
+        # New set holding the profiles ids, in that order; dangling entities are kept
+        ids = np.asarray(ids, dtype=np.int64)
+        return ProfileSet(self.vertices[_gather(self.offsets, ids)], _lengths_to_offsets(np.diff(self.offsets)[ids]),
+                          self.closed[ids], self.layers[ids], self.edges[_gather(self.edge_offsets, ids)],
+                          _lengths_to_offsets(np.diff(self.edge_offsets)[ids]), self.dangling)
+
+    def entity_matrices(self, counts, matrices):
+        # One (n, 2, 3) array per entity kind, n from counts, giving every
+        # entity the (P, 2, 3) matrix of its profile; dangling entities keep
+        # the identity
+        result = [np.tile(((1.0, 0.0, 0.0), (0.0, 1.0, 0.0)), (n, 1, 1)) for n in counts]
+        per_edge = np.repeat(np.asarray(matrices, dtype=np.float64), np.diff(self.edge_offsets), axis=0)
+        for kind, kind_matrices in enumerate(result):
+            rows = self.edges[:, 0] == kind
+            kind_matrices[self.edges[rows, 1]] = per_edge[rows]
+        return result
+
+    def loop_count(self):
+        return int(self.closed.sum())
+
+    def chain_count(self):
+        return int(len(self.closed) - self.closed.sum())
+
+
+def _gather(offsets, ids):
+    # Row indices of the runs ids of an offsets array, concatenated
+    starts = offsets[ids]
+    lengths = offsets[ids + 1] - starts
+    return np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+
+
+def _lengths_to_offsets(lengths):
+    return np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+
+
+def snap_endpoints(points, tolerance):
+    # Merges points closer than tolerance using a spatial hash with cells of
+    # the tolerance size, so only the 3x3 neighbouring cells are searched.
+    # Returns the node coordinates and the node id of every input point.
+    cells = np.floor(points / tolerance).astype(np.int64).tolist()
+    grid = defaultdict(list)
+    node_xy = []
+    node_ids = np.empty(len(points), dtype=np.int64)
+    tol2 = tolerance * tolerance
+    for i, ((x, y), (cx, cy)) in enumerate(zip(points.tolist(), cells)):
+        found = -1
+        for gx in (cx - 1, cx, cx + 1):
+            for gy in (cy - 1, cy, cy + 1):
+                for n in grid.get((gx, gy), ()):
+                    nx, ny = node_xy[n]
+                    if (nx - x) ** 2 + (ny - y) ** 2 <= tol2:
+                        found = n
+                        break
+                if found >= 0:
+                    break
+            if found >= 0:
+                break
+        if found < 0:
+            found = len(node_xy)
+            node_xy.append((x, y))
+            grid[(cx, cy)].append(found)
+        node_ids[i] = found
+    return np.array(node_xy, dtype=np.float64).reshape(-1, 2), node_ids
+
+
+def bulge_segment_area2(p, q, bulges):
+    # Twice the signed area between the chords p->q and their arcs, vectorized
+    theta = 4.0 * np.arctan(bulges)
+    chord2 = ((q - p) ** 2).sum(axis=1)
+    half_sin = np.sin(theta / 2.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        area = chord2 / 4.0 * (theta - np.sin(theta)) / (half_sin * half_sin)
+    return np.where(bulges == 0, 0.0, area)
+
+
+def run_area2(vertices, closed=True):
+    # Twice the signed area enclosed by a vertex run with bulges
+    v = np.asarray(vertices, dtype=np.float64).reshape(-1, 3)
+    if closed:
+        p, q, b = v[:, :2], np.roll(v[:, :2], -1, axis=0), v[:, 2]
+    else:
+        p, q, b = v[:-1, :2], v[1:, :2], v[:-1, 2]
+    cross = p[:, 0] * q[:, 1] - q[:, 0] * p[:, 1]
+    return float(cross.sum() + bulge_segment_area2(p, q, b).sum())
+
+
+def bulge_segment_lengths(p, q, bulges):
+    # Length of the straight or bulged segments p->q, vectorized
+    chord = np.hypot(q[:, 0] - p[:, 0], q[:, 1] - p[:, 1])
+    theta = 4.0 * np.arctan(bulges)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        arc = chord * theta / (2.0 * np.sin(theta / 2.0))
+    return np.where(bulges == 0, chord, np.abs(arc))
+
+
+def run_segments(vertices, offsets, closed):
+    # Start point, end point, bulge and run index of every segment of many
+    # vertex runs at once. Closed runs wrap round to their first vertex.
+    vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 3)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    closed = np.asarray(closed, dtype=bool)
+    lengths = np.diff(offsets)
+    run_ids = np.repeat(np.arange(len(lengths)), lengths)
+    nxt = np.arange(1, len(vertices) + 1)
+    last = offsets[1:] - 1
+    has_vertices = lengths > 0
+    nxt[last[has_vertices]] = offsets[:-1][has_vertices]
+    segment = np.ones(len(vertices), dtype=bool)
+    segment[last[has_vertices & ~closed]] = False
+    return (vertices[segment, :2], vertices[nxt[segment], :2], vertices[segment, 2], run_ids[segment])
+
+
+def run_areas2(vertices, offsets, closed):
+    # Twice the signed area of every run, see run_area2. Open runs are
+    # closed by a straight line.
+    p, q, b, run_ids = run_segments(vertices, offsets, np.ones(len(offsets) - 1, dtype=bool))
+    per_segment = p[:, 0] * q[:, 1] - q[:, 0] * p[:, 1]
+    # The closing segment of an open run is straight whatever its stored bulge
+    open_closing = ~np.asarray(closed, dtype=bool)[run_ids] & (np.append(run_ids[1:] != run_ids[:-1], True))
+    per_segment = per_segment + np.where(open_closing, 0.0, bulge_segment_area2(p, q, b))
+    return np.bincount(run_ids, weights=per_segment, minlength=len(offsets) - 1)
+
+
+def run_lengths(vertices, offsets, closed):
+    # Length of every run, arcs measured along the arc
+    p, q, b, run_ids = run_segments(vertices, offsets, closed)
+    return np.bincount(run_ids, weights=bulge_segment_lengths(p, q, b), minlength=len(offsets) - 1)
+
+
+def reverse_loop(vertices):
+    # The same closed loop walked the other way round
+    v = np.asarray(vertices, dtype=np.float64).reshape(-1, 3)[::-1].copy()
+    v[:, 2] = -np.roll(v[:, 2], -1)
+    return v
+
+
+class _Edges:
+    # Every open entity as a graph edge. Edge geometry is kept as a small
+    # vertex run (points with bulges) so it can be emitted in either direction.
+
+    def __init__(self, store):
+        kinds, indices, runs = [], [], []
+
+        for i, (x0, y0, x1, y1) in enumerate(store.lines.tolist()):
+            kinds.append(LINE)
+            indices.append(i)
+            runs.append(((x0, y0, 0.0), (x1, y1, 0.0)))
+
+        arcs = store.arcs
+        if len(arcs):
+            sweep = sweep_angles(arcs[:, 3], arcs[:, 4])
+            start = np.radians(arcs[:, 3])
+            end = np.radians(arcs[:, 3] + sweep)
+            bulge = np.tan(np.radians(sweep) / 4.0)
+            sx = arcs[:, 0] + arcs[:, 2] * np.cos(start)
+            sy = arcs[:, 1] + arcs[:, 2] * np.sin(start)
+            ex = arcs[:, 0] + arcs[:, 2] * np.cos(end)
+            ey = arcs[:, 1] + arcs[:, 2] * np.sin(end)
+            for i, (a, b, c, d, e) in enumerate(zip(sx.tolist(), sy.tolist(), bulge.tolist(), ex.tolist(), ey.tolist())):
+                kinds.append(ARC)
+                indices.append(i)
+                runs.append(((a, b, c), (d, e, 0.0)))
+
+        for i in np.flatnonzero(~store.poly_closed).tolist():
+            run = store.polyline(i)
+            if len(run) < 2:
+                continue
+            kinds.append(LWPOLYLINE)
+            indices.append(i)
+            runs.append(tuple(map(tuple, run.tolist())))
+
+        self.kinds = kinds
+        self.indices = indices
+        self.runs = runs
+        self.layers = [int(store.layer_columns[k][i]) for k, i in zip(kinds, indices)]
+
+        n = len(runs)
+        self.start = np.array([r[0][:2] for r in runs], dtype=np.float64).reshape(n, 2)
+        self.end = np.array([r[-1][:2] for r in runs], dtype=np.float64).reshape(n, 2)
+        self.start_angle, self.end_angle, self.area2 = self._shape(runs)
+
+    @staticmethod
+    def _shape(runs):
+        # Outgoing tangent angle at both ends and twice the signed area
+        # contribution of every edge traversed forward
+        start_angle, end_angle, area2 = [], [], []
+        for run in runs:
+            pts = np.asarray(run, dtype=np.float64)
+            p, q, b = pts[:-1, :2], pts[1:, :2], pts[:-1, 2]
+            d0 = q[0] - p[0]
+            d1 = q[-1] - p[-1]
+            # A bulged segment leaves its start rotated by -2*atan(b) from the chord
+            start_angle.append(atan2(d0[1], d0[0]) - 2.0 * np.arctan(b[0]))
+            end_angle.append(atan2(-d1[1], -d1[0]) + 2.0 * np.arctan(b[-1]))
+            area2.append(run_area2(pts, closed=False))
+        return start_angle, end_angle, area2
+
+    def emit(self, e, reverse, start_xy):
+        # Vertices of edge e without its final point, starting at the snapped node
+        run = self.runs[e]
+        if reverse:
+            out = [(run[-1 - i][0], run[-1 - i][1], -run[-2 - i][2]) for i in range(len(run) - 1)]
+        else:
+            out = [tuple(v) for v in run[:-1]]
+        out[0] = (start_xy[0], start_xy[1], out[0][2])
+        return out
+
+
+class _Graph:
+
+    def __init__(self, edges, tolerance):
+        self.edges = edges
+        n = len(edges.runs)
+        points = np.concatenate((edges.start, edges.end)) if n else np.zeros((0, 2))
+        self.node_xy, ids = snap_endpoints(points, tolerance)
+        self.edge_nodes = np.column_stack((ids[:n], ids[n:])).tolist()
+
+    def head(self, h):
+        # Half-edge h = 2 * edge + side, side 1 walks the edge backwards
+        return self.edge_nodes[h >> 1][1 - (h & 1)]
+
+    def tail(self, h):
+        return self.edge_nodes[h >> 1][h & 1]
+
+    def angle(self, h):
+        return self.edges.end_angle[h >> 1] if h & 1 else self.edges.start_angle[h >> 1]
+
+    def area2(self, h):
+        return -self.edges.area2[h >> 1] if h & 1 else self.edges.area2[h >> 1]
+
+    def adjacency(self, edge_ids):
+        adj = defaultdict(list)
+        for e in edge_ids:
+            a, b = self.edge_nodes[e]
+            adj[a].append(2 * e)
+            adj[b].append(2 * e + 1)
+        return adj
+
+    def walk_chains(self, edge_ids):
+        # Splits the edges into maximal chains through degree-2 nodes. Returns
+        # (chains, cycles), each a list of half-edge lists; cycles only pass
+        # through degree-2 nodes.
+        adj = self.adjacency(edge_ids)
+        visited = set()
+        chains, cycles = [], []
+
+        def follow(h):
+            seq = [h]
+            visited.add(h >> 1)
+            node = self.head(h)
+            while len(adj[node]) == 2:
+                a, b = adj[node]
+                nxt = b if a >> 1 == h >> 1 else a
+                if nxt >> 1 in visited:
+                    break
+                visited.add(nxt >> 1)
+                seq.append(nxt)
+                h = nxt
+                node = self.head(h)
+            return seq
+
+        for node in sorted(adj):
+            if len(adj[node]) != 2:
+                for h in adj[node]:
+                    if h >> 1 not in visited:
+                        chains.append(follow(h))
+        for e in edge_ids:
+            if e not in visited:
+                cycles.append(follow(2 * e))
+        return chains, cycles
+
+    def prune(self, edge_ids):
+        # Repeatedly strips edges hanging off degree-1 nodes. Returns the
+        # surviving edges and the stripped (dangling) ones.
+        adj = self.adjacency(edge_ids)
+        degree = {node: len(hs) for node, hs in adj.items()}
+        alive = set(edge_ids)
+        stack = [node for node, d in degree.items() if d == 1]
+        stripped = []
+        while stack:
+            node = stack.pop()
+            if degree[node] != 1:
+                continue
+            for h in adj[node]:
+                if h >> 1 in alive:
+                    alive.discard(h >> 1)
+                    stripped.append(h >> 1)
+                    degree[node] -= 1
+                    other = self.head(h)
+                    degree[other] -= 1
+                    if degree[other] == 1:
+                        stack.append(other)
+                    break
+        return [e for e in edge_ids if e in alive], stripped
+
+
+def _outer_boundaries(graph, chains):
+    # Faces of the planar graph formed by chains that run between branch
+    # nodes. For every connected component, the outer face (negative area) is
+    # returned as a list of (chain, reversed) steps; chains never used by an
+    # outer face are returned separately as inner chains.
+    if not chains:
+        return [], []
+
+    starts = [graph.tail(c[0]) for c in chains]
+    ends = [graph.head(c[-1]) for c in chains]
+    out_angle = [graph.angle(c[0]) for c in chains]
+    in_angle = [graph.angle(c[-1] ^ 1) for c in chains]
+    area2 = [sum(graph.area2(h) for h in c) for c in chains]
+
+    # Half-chain 2 * c leaves starts[c], 2 * c + 1 leaves ends[c]
+    around = defaultdict(list)
+    for c in range(len(chains)):
+        around[starts[c]].append((out_angle[c] % (2 * pi), 2 * c))
+        around[ends[c]].append((in_angle[c] % (2 * pi), 2 * c + 1))
+    position = {}
+    for node, hs in around.items():
+        hs.sort()
+        around[node] = [h for _, h in hs]
+        for i, h in enumerate(around[node]):
+            position[h] = i
+
+    def head(h):
+        return ends[h >> 1] if not h & 1 else starts[h >> 1]
+
+    # Components by union-find over chain end nodes
+    parent = {}
+
+    def find(x):
+        root = x
+        while parent.get(root, root) != root:
+            root = parent[root]
+        parent[x] = root
+        return root
+
+    for c in range(len(chains)):
+        ra, rb = find(starts[c]), find(ends[c])
+        if ra != rb:
+            parent[ra] = rb
+
+    used = set()
+    best = {}
+    for h0 in range(2 * len(chains)):
+        if h0 in used:
+            continue
+        face = []
+        h = h0
+        while h not in used:
+            used.add(h)
+            face.append(h)
+            node = head(h)
+            hs = around[node]
+            # Next half-chain is the one just clockwise of the way back
+            h = hs[(position[h ^ 1] - 1) % len(hs)]
+        area = sum(area2[x >> 1] * (-1 if x & 1 else 1) for x in face)
+        comp = find(starts[h0 >> 1])
+        if comp not in best or area < best[comp][0]:
+            best[comp] = (area, face)
+
+    outer_faces = [face for _, face in best.values()]
+    on_outer = {h >> 1 for face in outer_faces for h in face}
+    inner = [c for c in range(len(chains)) if c not in on_outer]
+
+    loops, bridges = [], []
+    for face in outer_faces:
+        # Split self-touching boundaries at repeated nodes into simple loops
+        stack, seen = [], {}
+        for h in face:
+            node = starts[h >> 1] if not h & 1 else ends[h >> 1]
+            if node in seen:
+                cut = seen[node]
+                piece = stack[cut:]
+                del stack[cut:]
+                for x in piece:
+                    seen.pop(starts[x >> 1] if not x & 1 else ends[x >> 1], None)
+                _split_piece(piece, loops, bridges)
+            seen[node] = len(stack)
+            stack.append(h)
+        if stack:
+            _split_piece(stack, loops, bridges)
+    inner.extend(sorted(bridges))
+    return [[(h >> 1, bool(h & 1)) for h in loop] for loop in loops], inner
+
+
+def _split_piece(piece, loops, bridges):
+    # A closed walk whose chains are all traversed both ways is a bridge, not a loop
+    chain_ids = [h >> 1 for h in piece]
+    if len(set(chain_ids)) * 2 == len(chain_ids):
+        bridges.extend(set(chain_ids))
+    else:
+        loops.append(piece)
+
+
+def find_profiles(store, tolerance=1e-3):
+    # Topological profile detection: entity endpoints are snapped within the
+    # tolerance, open entities become edges of an endpoint-adjacency graph and
+    # the graph is walked to extract closed loops and open chains. Runs in
+    # near-linear time and keeps arcs exact as bulges.
+    edges = _Edges(store)
+    graph = _Graph(edges, tolerance)
+    builder = _ProfileSetBuilder(store, edges, graph)
+
+    # Entities that are closed on their own
+    for i in range(len(store.circles)):
+        builder.add_circle(store.circles[i], store.layer_columns[CIRCLE][i], (CIRCLE, i))
+    for i in np.flatnonzero(store.poly_closed).tolist():
+        run = store.polyline(i)
+        if len(run):
+            if run_area2(run) < 0:
+                run = reverse_loop(run)
+            builder.add_raw(run, True, store.layer_columns[LWPOLYLINE][i], [(LWPOLYLINE, i)])
+
+    open_edges = []
+    for e, (a, b) in enumerate(graph.edge_nodes):
+        kind, index = edges.kinds[e], edges.indices[e]
+        if a != b:
+            open_edges.append(e)
+        elif kind == ARC and store.arcs[index, 2] > 0:
+            # Full-circle arcs
+            builder.add_circle(store.arcs[index, :3], edges.layers[e], (kind, index))
+        elif kind == LWPOLYLINE and run_area2(edges.runs[e], closed=False) != 0.0:
+            # Polylines that close on themselves
+            builder.add_loop([2 * e])
+        else:
+            # Zero-length lines and collapsed arcs or polylines
+            builder.dangling.append(e)
+
+    alive, stripped = graph.prune(open_edges)
+    builder.dangling.extend(stripped)
+    for chain in graph.walk_chains(stripped)[0]:
+        builder.add_chain(chain)
+
+    chains, cycles = graph.walk_chains(alive)
+    for cycle in cycles:
+        builder.add_loop(cycle)
+
+    loops, inner = _outer_boundaries(graph, chains)
+    for loop in loops:
+        halves = []
+        for c, rev in loop:
+            halves.extend([h ^ 1 for h in reversed(chains[c])] if rev else chains[c])
+        builder.add_loop(halves)
+    for c in inner:
+        builder.add_chain(chains[c])
+
+    return builder.build()
+
+
+class _ProfileSetBuilder:
+
+    def __init__(self, store, edges, graph):
+        self.store = store
+        self.edges = edges
+        self.graph = graph
+        self.vertices = []
+        self.offsets = [0]
+        self.closed = []
+        self.layers = []
+        self.refs = []
+        self.ref_offsets = [0]
+        self.dangling = []
+
+    def add_raw(self, vertices, closed, layer, refs):
+        self.vertices.extend(tuple(v) for v in np.asarray(vertices).tolist())
+        self.offsets.append(len(self.vertices))
+        self.closed.append(closed)
+        self.layers.append(int(layer))
+        self.refs.extend(refs)
+        self.ref_offsets.append(len(self.refs))
+
+    def add_circle(self, circle, layer, ref):
+        cx, cy, r = np.asarray(circle).tolist()
+        self.add_raw([(cx + r, cy, 1.0), (cx - r, cy, 1.0)], True, layer, [ref])
+
+    def _emit(self, halves):
+        out = []
+        for h in halves:
+            out.extend(self.edges.emit(h >> 1, bool(h & 1), self.graph.node_xy[self.graph.tail(h)]))
+        return out
+
+    def add_loop(self, halves):
+        # Loops are stored counter-clockwise
+        area = sum(self.graph.area2(h) for h in halves)
+        if area < 0:
+            halves = [h ^ 1 for h in reversed(halves)]
+        self._add(halves, True)
+
+    def add_chain(self, halves):
+        self._add(halves, False)
+
+    def _add(self, halves, closed):
+        vertices = self._emit(halves)
+        if not closed:
+            x, y = self.graph.node_xy[self.graph.head(halves[-1])]
+            vertices.append((x, y, 0.0))
+        e = halves[0] >> 1
+        self.add_raw(vertices, closed, self.edges.layers[e],
+                     [(self.edges.kinds[h >> 1], self.edges.indices[h >> 1]) for h in halves])
+
+    def build(self):
+        dangling = sorted((self.edges.kinds[e], self.edges.indices[e]) for e in set(self.dangling))
+        return ProfileSet(self.vertices, self.offsets, self.closed, self.layers,
+                          self.refs, self.ref_offsets, dangling)
+
+
+def concatenate_profiles(sets):
+    # One ProfileSet from several, in order. The (kind, index) references of
+    # edges and dangling entities are carried along as they are.
+    sets = [s for s in sets if len(s) or len(s.dangling)]
+    if not sets:
+        return ProfileSet(np.zeros((0, 3)), [0], [], [], np.zeros((0, 2)), [0], np.zeros((0, 2)))
+
+    def stacked_offsets(offsets):
+        out, base = [np.zeros(1, dtype=np.int64)], 0
+        for o in offsets:
+            out.append(o[1:] + base)
+            base += o[-1]
+        return np.concatenate(out)
+
+    return ProfileSet(np.concatenate([s.vertices for s in sets]), stacked_offsets([s.offsets for s in sets]),
+                      np.concatenate([s.closed for s in sets]), np.concatenate([s.layers for s in sets]),
+                      np.concatenate([s.edges for s in sets]), stacked_offsets([s.edge_offsets for s in sets]),
+                      np.concatenate([s.dangling for s in sets]))
@@ -0,0 +1,210 @@
+import numpy as np
+from PyQt5.QtWidgets import QGraphicsScene
+from PyQt5.QtCore import QPointF, QRectF, QTimer, pyqtSignal
+from snap_index import SnapIndex
+from selection_index import SelectionIndex, PolygonGrid, touches_rect, contains_point, distance_to
+from style import StyleModel
+
+
+class ProfileScene(QGraphicsScene):
+    # Scene holding the InteractablePathItems of a drawing together with the
+    # shared indexes the items use while they are dragged around.
+
+    # Scene rect whose static (unselected) geometry changed and the item that
+    # caused it, a null rect and None when the whole scene is affected
+    staticChanged = pyqtSignal(QRectF, object)
+
+    def __init__(self, parent=None, snap_threshold=20):
+        super().__init__(parent)
+        self.snap_index = SnapIndex(cell_size=snap_threshold)
+        # Scene boxes of the items for clicks and rubber bands, and how far
+        # from an outline a click still hits it, in scene units (set by the
+        # view from its zoom)
+        self.selection_index = SelectionIndex()
+        self.hit_tolerance = 0.0
+        self._batched = None
+        # Whether a view draws the unselected items from cached tiles
+        self._static_tiled = False
+        # Qt only grows the scene rect over items with contents, which tiled
+        # items are not; the scene grows it over them itself, once per pass
+        # of the event loop, unless a rect was set
+        self._fixed_rect = False
+        self._grown_bounds = None
+        self._grow_timer = QTimer(self)
+        self._grow_timer.setSingleShot(True)
+        self._grow_timer.setInterval(0)
+        self._grow_timer.timeout.connect(self._applyGrowth)
+        # Pens of the items, a style change repaints the scene once
+        self.path_style = StyleModel(parent=self)
+        self.path_style.changed.connect(self.onStyleChanged)
+
+    def clear(self):
+        super().clear()
+        self.snap_index.clear()
+        self.selection_index.clear()
+        self.invalidateStatic()
+
+    def setSceneRect(self, rect):
+        # A null rect lets the scene grow with its items again
+        self._fixed_rect = not rect.isNull()
+        self._grown_bounds = None
+        super().setSceneRect(rect)
+
+    def addItem(self, item):
+        super().addItem(item)
+        if not hasattr(item, 'updateContents'):
+            r = item.sceneBoundingRect()
+            self.growSceneBounds((r.left(), r.top(), r.right(), r.bottom()))
+
+    def growSceneBounds(self, bounds):
+        # Grows the scene rect over (xmin, ymin, xmax, ymax) bounds
+        xmin, ymin, xmax, ymax = bounds
+        grown = self._grown_bounds
+        if self._fixed_rect or not (xmin <= xmax and ymin <= ymax):
+            return
+        if grown is not None and grown[0] <= xmin and grown[1] <= ymin and grown[2] >= xmax and grown[3] >= ymax:
+            return
+        if grown is not None:
+            bounds = (min(grown[0], xmin), min(grown[1], ymin), max(grown[2], xmax), max(grown[3], ymax))
+        self._grown_bounds = bounds
+        self._grow_timer.start()
+
+    def _applyGrowth(self):
+        if not self._fixed_rect and self._grown_bounds is not None:
+            xmin, ymin, xmax, ymax = self._grown_bounds
+            super().setSceneRect(QRectF(QPointF(xmin, ymin), QPointF(xmax, ymax)))
+
+    def resnap(self, everything=False):
+        # Snaps the items that moved since the last pass, or every item.
+        # Snapping moves an item, which marks it again; a second pass finds
+        # it already in place.
+        if everything:
+            self.snap_index.take_dirty()
+            items = self.items()
+        else:
+            items = self.snap_index.take_dirty()
+        for item in items:
+            if item.scene() is self and hasattr(item, 'snapAndUpdateGrabbers'):
+                item.snapAndUpdateGrabbers()
+
+    # Items changed in one batch beyond which the whole scene is invalidated
+    BATCH_ITEMS = 64
+
+    def isBatched(self):
+        return self._batched is not None
+
+    def invalidateStatic(self, rect=None, item=None):
+        if self._batched is not None:
+            # Sent when the batch ends, see setSelection
+            self._batched.append(item if rect is not None else None)
+            return
+        self.staticChanged.emit(rect if rect is not None else QRectF(), item)
+
+    def isStaticTiled(self):
+        return self._static_tiled
+
+    def setStaticTiled(self, tiled):
+        # Set by a view with a tile cache, unselected items then skip their paint
+        if tiled == self._static_tiled:
+            return
+        self._static_tiled = tiled
+        for item in self.items():
+            if hasattr(item, 'updateContents'):
+                item.updateContents()
+
+    def onStyleChanged(self):
+        self.invalidateStatic()
+        self.update()
+
+    def _candidates(self, xmin, ymin, xmax, ymax):
+        # Selectable visible items whose boxes touch the rect, bottom to top, and their boxes
+        index = self.selection_index
+        rows = index.query(xmin, ymin, xmax, ymax)
+        return index.owners(rows), index.bounds(rows)
+
+    @staticmethod
+    def _outlines(items):
+        # Scene outlines of items as one set of runs, with the item (0..) of every run
+        outlines = [item.sceneOutline() for item in items]
+        if not outlines:
+            return np.zeros((0, 2)), np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        points = np.concatenate([points for points, _ in outlines])
+        runs = np.array([len(offsets) - 1 for _, offsets in outlines])
+        starts = np.cumsum([0] + [len(points) for points, _ in outlines[:-1]])
+        offsets = np.concatenate([offsets[:-1] + start for (_, offsets), start in zip(outlines, starts)] +
+                                 [[len(points)]]).astype(np.int64)
+        return points, offsets, np.repeat(np.arange(len(items)), runs)
+
+    def itemAtPoint(self, x, y, tolerance=0.0):
+        # Topmost item whose outline passes within tolerance of (x, y), or
+        # which is filled and covers it; None if there is none
+        items, _ = self._candidates(x - tolerance, y - tolerance, x + tolerance, y + tolerance)
+        if not items:
+            return None
+        points, offsets, run_owner = self._outlines(items)
+        hit = distance_to(points, offsets, run_owner, len(items), x, y) <= tolerance
+        filled = np.array([item.isFilled() for item in items])
+        if filled.any():
+            hit |= filled & contains_point(points, offsets, run_owner, len(items), x, y)
+        hits = [items[k] for k in np.flatnonzero(hit).tolist()]
+        if not hits:
+            return None
+        # Later items are drawn over earlier ones of the same z
+        return max(enumerate(hits), key=lambda pair: (pair[1].zValue(), pair[0]))[1]
+
+    def itemsInRect(self, xmin, ymin, xmax, ymax, window=False):
+        # Items lying entirely in the rect with window, otherwise items
+        # whose outline passes through it or which are filled and cover it
+        items, bounds = self._candidates(xmin, ymin, xmax, ymax)
+        inside = (bounds[:, 0] >= xmin) & (bounds[:, 2] <= xmax) & (bounds[:, 1] >= ymin) & (bounds[:, 3] <= ymax)
+        if window or inside.all():
+            # Boxes are those of the outlines themselves, they decide on their own
+            return [items[k] for k in np.flatnonzero(inside).tolist()]
+        straddling = np.flatnonzero(~inside)
+        tested = [items[k] for k in straddling.tolist()]
+        points, offsets, run_owner = self._outlines(tested)
+        hit = touches_rect(points, offsets, run_owner, len(tested), (xmin, ymin, xmax, ymax))
+        filled = np.array([item.isFilled() for item in tested])
+        if (filled & ~hit).any():
+            hit |= filled & contains_point(points, offsets, run_owner, len(tested),
+                                           (xmin + xmax) / 2, (ymin + ymax) / 2)
+        inside[straddling[hit]] = True
+        return [items[k] for k in np.flatnonzero(inside).tolist()]
+
+    def itemsInPolygon(self, polygon):
+        # Items with every vertex inside the polygon (a lasso), even-odd
+        polygon = np.asarray(polygon, dtype=np.float64).reshape(-1, 2)
+        if len(polygon) < 3:
+            return []
+        (xmin, ymin), (xmax, ymax) = polygon.min(axis=0), polygon.max(axis=0)
+        items, bounds = self._candidates(xmin, ymin, xmax, ymax)
+        if not items:
+            return []
+        grid = PolygonGrid(polygon)
+        states = grid.box_states(bounds)
+        selected = states == 1
+        tested = np.flatnonzero(states == 0)
+        if len(tested):
+            points, offsets, run_owner = self._outlines([items[k] for k in tested.tolist()])
+            owner = np.repeat(run_owner, np.diff(offsets))
+            outside = np.bincount(owner[~grid.contains(points)], minlength=len(tested)) > 0
+            selected[tested[~outside]] = True
+        return [items[k] for k in np.flatnonzero(selected).tolist()]
+
+    def setSelection(self, items, add=False):
+        # Selects items, replacing the current selection unless add. Tiles
+        # under a few items are invalidated item by item, under many all at once.
+        self._batched = []
+        try:
+            if not add:
+                self.clearSelection()
+            for item in items:
+                item.setSelected(True)
+        finally:
+            changed, self._batched = self._batched, None
+        if len(changed) > self.BATCH_ITEMS or None in changed:
+            self.invalidateStatic()
+            return
+        for item in dict.fromkeys(changed):
+            if item.scene() is self:
+                self.invalidateStatic(item.sceneBoundingRect(), item)
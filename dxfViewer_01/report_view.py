@@ -0,0 +1,153 @@
+import numpy as np
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex, pyqtSignal
+from PyQt5.QtWidgets import QAbstractItemView, QHeaderView, QTabWidget, QTableView
+
+from geometry_store import KIND_NAMES
+from measure import CHECK_NAMES, PROFILE
+
+
+class ColumnTableModel(QAbstractTableModel):
+    # Read-only table over numpy columns, given as (header, values, format)
+    # with format turning one value into its text. Nothing is formatted up
+    # front: the view only asks for the cells on screen, so a million rows
+    # cost their arrays and, once sorted, one order array.
+
+    def __init__(self, columns, parent=None):
+        super().__init__(parent)
+        self._headers = [header for header, _, _ in columns]
+        self._values = [np.asarray(values) for _, values, _ in columns]
+        self._formats = [format for _, _, format in columns]
+        self._rows = len(self._values[0]) if self._values else 0
+        # Source row shown at each row once sorted, None in source order
+        self._order = None
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self._rows
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._values)
+
+    def sourceRow(self, row):
+        return row if self._order is None else int(self._order[row])
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        column = index.column()
+        if role == Qt.DisplayRole:
+            return self._formats[column](self._values[column][self.sourceRow(index.row())])
+        if role == Qt.TextAlignmentRole and self._values[column].dtype.kind in 'fiu':
+            return int(Qt.AlignRight | Qt.AlignVCenter)
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return self._headers[section]
+        return str(section + 1)
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        self.layoutAboutToBeChanged.emit()
+        persistent = self.persistentIndexList()
+        sources = [self.sourceRow(index.row()) for index in persistent]
+        if 0 <= column < len(self._values):
+            self._order = np.argsort(self._values[column], kind='stable')
+            if order == Qt.DescendingOrder:
+                self._order = self._order[::-1].copy()
+        else:
+            self._order = None
+        # Selections and the current cell follow their rows
+        if persistent:
+            rows = np.empty(self._rows, dtype=np.int64)
+            rows[self._order if self._order is not None else np.arange(self._rows)] = np.arange(self._rows)
+            self.changePersistentIndexList(persistent, [self.index(int(rows[source]), index.column())
+                                                        for index, source in zip(persistent, sources)])
+        self.layoutChanged.emit()
+
+
+def _number(value):
+    return f"{value:.4f}" if np.isfinite(value) else ''
+
+
+def _kind_name(kind):
+    if 0 <= kind < len(KIND_NAMES):
+        return KIND_NAMES[kind]
+    return 'Profile' if kind == PROFILE else ''
+
+
+def _names(names):
+    return lambda i: names[i] if 0 <= i < len(names) else ''
+
+
+def _index(value):
+    return str(value) if value >= 0 else ''
+
+
+class ReportWindow(QTabWidget):
+    # Measurements of the entities and profiles of a drawing and the issues
+    # found in it, one table each. Double clicking a row asks for its place
+    # in the drawing: the issue's location or the centre of the bounds.
+
+    located = pyqtSignal(float, float)
+
+    def __init__(self, entities, profiles, profile_measures, issues, entity_layers, profile_layers, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle('Drawing Report')
+        self.resize(900, 600)
+
+        def centres(bounds):
+            return np.column_stack(((bounds[:, 0] + bounds[:, 2]) / 2, (bounds[:, 1] + bounds[:, 3]) / 2))
+
+        bounds = entities.bounds
+        self.addTab(self._table([
+            ('Kind', entities.kinds, _kind_name), ('#', entities.indices, str),
+            ('Layer', entities.layers, _names(entity_layers)), ('Length', entities.lengths, _number),
+            ('Area', entities.areas, _number), ('X min', bounds[:, 0], _number), ('Y min', bounds[:, 1], _number),
+            ('X max', bounds[:, 2], _number), ('Y max', bounds[:, 3], _number)], centres(bounds)),
+            f"Entities ({len(entities.kinds)})")
+
+        bounds = profile_measures.bounds
+        self.addTab(self._table([
+            ('#', np.arange(len(profiles)), str), ('Closed', profiles.closed, lambda c: 'yes' if c else 'no'),
+            ('Layer', profiles.layers, _names(profile_layers)), ('Hole of', profile_measures.owners, _index),
+            ('Perimeter', profile_measures.lengths, _number), ('Area', profile_measures.areas, _number),
+            ('Net Area', profile_measures.net_areas, _number),
+            ('Width', bounds[:, 2] - bounds[:, 0], _number), ('Height', bounds[:, 3] - bounds[:, 1], _number),
+            ('X min', bounds[:, 0], _number), ('Y min', bounds[:, 1], _number)], centres(bounds)),
+            f"Profiles ({len(profiles)})")
+
+        self.addTab(self._table([
+            ('Check', issues.checks, _names(CHECK_NAMES)), ('Kind', issues.kinds, _kind_name),
+            ('#', issues.indices, str), ('Value', issues.values, _number),
+            ('With', np.where(issues.other_indices >= 0, issues.other_kinds, -2), _kind_name),
+            ('With #', issues.other_indices, _index),
+            ('X', issues.xy[:, 0], _number), ('Y', issues.xy[:, 1], _number)], issues.xy),
+            f"Issues ({len(issues.checks)})")
+        if len(issues.checks):
+            self.setCurrentIndex(2)
+
+    def _table(self, columns, xy):
+        view = QTableView(self)
+        model = ColumnTableModel(columns, view)
+        view.setModel(model)
+        view.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        view.setSelectionBehavior(QAbstractItemView.SelectRows)
+        view.setWordWrap(False)
+        view.setAlternatingRowColors(True)
+        # Fixed row heights keep the view from measuring rows it never shows
+        rows = view.verticalHeader()
+        rows.setSectionResizeMode(QHeaderView.Fixed)
+        rows.setDefaultSectionSize(view.fontMetrics().height() + 6)
+        rows.hide()
+        view.horizontalHeader().setStretchLastSection(True)
+        # Unsorted until a header is clicked
+        view.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
+        view.setSortingEnabled(True)
+        view.doubleClicked.connect(lambda index: self._locate(model, xy, index))
+        return view
+
+    def _locate(self, model, xy, index):
+        x, y = xy[model.sourceRow(index.row())]
+        if np.isfinite(x) and np.isfinite(y):
+            self.located.emit(float(x), float(y))
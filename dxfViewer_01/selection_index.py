@@ -0,0 +1,256 @@
+import numpy as np
+
+from box_index import BoxIndex
+
+# Hit testing and area selection without Qt's shape tests. SelectionIndex
+# keeps the scene bounding box of every selectable item in a BoxIndex, so
+# a click or a rubber band only looks at the few items whose boxes it
+# touches; those are then tested exactly against their outlines, polylines
+# given as flat (N, 2) points split into runs by offsets, with the numpy
+# functions below. Several items are tested at once by concatenating their
+# runs, run_owner giving the item (0..count-1) each run belongs to.
+
+
+class SelectionIndex:
+    # Scene boxes (xmin, ymin, xmax, ymax) of owners, normally items, in
+    # the order they were added, which is also Qt's stacking order for
+    # items of equal z. Boxes set after the BoxIndex was built (items being
+    # dragged) are scanned on every query until there are rebuild_after of
+    # them, then the index is built again on the next query. Owners that
+    # cannot be picked (hidden items) stay in the index but are not returned.
+
+    def __init__(self, rebuild_after=512):
+        self.rebuild_after = rebuild_after
+        self._rows = {}
+        self._owners = []
+        self._bounds = np.full((64, 4), np.nan)
+        self._pickable = np.ones(64, dtype=bool)
+        self._removed = 0
+        self._index = None
+        self._loose = set()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, owner):
+        return owner in self._rows
+
+    def clear(self):
+        self._rows.clear()
+        self._owners = []
+        self._bounds = np.full((64, 4), np.nan)
+        self._pickable = np.ones(64, dtype=bool)
+        self._removed = 0
+        self._index = None
+        self._loose = set()
+
+    def set_bounds(self, owner, bounds):
+        row = self._rows.get(owner)
+        if row is None:
+            row = len(self._owners)
+            if row == len(self._bounds):
+                self._bounds = np.vstack((self._bounds, np.full((len(self._bounds), 4), np.nan)))
+                self._pickable = np.concatenate((self._pickable, np.ones(len(self._pickable), dtype=bool)))
+            self._rows[owner] = row
+            self._owners.append(owner)
+        self._bounds[row] = bounds
+        self._loose.add(row)
+        if len(self._loose) > self.rebuild_after:
+            self._index = None
+
+    def set_pickable(self, owner, pickable):
+        row = self._rows.get(owner)
+        if row is not None:
+            self._pickable[row] = pickable
+
+    def remove(self, owner):
+        row = self._rows.pop(owner, None)
+        if row is None:
+            return
+        self._owners[row] = None
+        self._bounds[row] = np.nan
+        self._pickable[row] = True
+        self._loose.discard(row)
+        self._removed += 1
+
+    def _build(self):
+        if self._removed > len(self._owners) // 2:
+            # Mostly holes, compact keeping the order
+            keep = [row for row, owner in enumerate(self._owners) if owner is not None]
+            self._owners = [self._owners[row] for row in keep]
+            bounds = np.full((max(len(keep) * 2, 64), 4), np.nan)
+            bounds[:len(keep)] = self._bounds[keep]
+            pickable = np.ones(len(bounds), dtype=bool)
+            pickable[:len(keep)] = self._pickable[keep]
+            self._bounds, self._pickable = bounds, pickable
+            self._rows = {owner: row for row, owner in enumerate(self._owners)}
+            self._removed = 0
+        self._index = BoxIndex(self._bounds[:len(self._owners)].copy())
+        self._loose = set()
+
+    def query(self, xmin, ymin, xmax, ymax):
+        # Rows of the pickable boxes intersecting the rectangle, bottom to top
+        if self._index is None:
+            self._build()
+        rows = self._index.query(xmin, ymin, xmax, ymax)
+        if self._loose:
+            rows = np.union1d(rows, np.fromiter(self._loose, dtype=np.int64, count=len(self._loose)))
+        # Boxes may have moved since the index was built
+        b = self._bounds[rows]
+        return rows[(b[:, 0] <= xmax) & (b[:, 2] >= xmin) & (b[:, 1] <= ymax) & (b[:, 3] >= ymin) &
+                    self._pickable[rows]]
+
+    def owners(self, rows):
+        return [self._owners[row] for row in rows.tolist()]
+
+    def bounds(self, rows):
+        return self._bounds[rows]
+
+
+def _segments(points, offsets, closing=False):
+    # Start and end point indices and run of every segment; a run of one
+    # point is a segment of zero length, closing adds the edge from the
+    # last point back to the first
+    lengths = np.diff(offsets)
+    runs = np.flatnonzero(lengths > 0)
+    counts = np.maximum(lengths[runs] - 1, 1) + (1 if closing else 0)
+    run_ids = np.repeat(runs, counts)
+    local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    start = offsets[run_ids]
+    n = lengths[run_ids]
+    a = start + np.minimum(local, n - 1)
+    b = start + np.where(local + 1 < n, local + 1, 0)
+    return a, b, run_ids
+
+
+def touches_rect(points, offsets, run_owner, count, rect):
+    # (count,) whether any segment of each owner passes through the rect
+    # (xmin, ymin, xmax, ymax): the boxes overlap and the rect corners are
+    # not all on one side of the segment
+    xmin, ymin, xmax, ymax = rect
+    a, b, runs = _segments(points, offsets)
+    ax, ay, bx, by = points[a, 0], points[a, 1], points[b, 0], points[b, 1]
+    hit = ((np.minimum(ax, bx) <= xmax) & (np.maximum(ax, bx) >= xmin) &
+           (np.minimum(ay, by) <= ymax) & (np.maximum(ay, by) >= ymin))
+    dx, dy = bx - ax, by - ay
+    sides = [np.sign(dx * (cy - ay) - dy * (cx - ax)) for cx, cy in
+             ((xmin, ymin), (xmax, ymin), (xmax, ymax), (xmin, ymax))]
+    hit &= ~(((sides[0] > 0) & (sides[1] > 0) & (sides[2] > 0) & (sides[3] > 0)) |
+             ((sides[0] < 0) & (sides[1] < 0) & (sides[2] < 0) & (sides[3] < 0)))
+    return np.bincount(np.asarray(run_owner)[runs[hit]], minlength=count) > 0
+
+
+def contains_point(points, offsets, run_owner, count, x, y):
+    # (count,) even-odd test of (x, y) against all runs of each owner taken
+    # as closed polygons, holes included
+    a, b, runs = _segments(points, offsets, closing=True)
+    ax, ay, bx, by = points[a, 0], points[a, 1], points[b, 0], points[b, 1]
+    straddles = (ay > y) != (by > y)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_cross = ax + (y - ay) * (bx - ax) / (by - ay)
+    crossings = straddles & (x < x_cross)
+    return np.bincount(np.asarray(run_owner)[runs], weights=crossings, minlength=count) % 2 == 1
+
+
+def distance_to(points, offsets, run_owner, count, x, y):
+    # (count,) distance from (x, y) to the nearest segment of each owner, inf without any
+    a, b, runs = _segments(points, offsets)
+    ax, ay = points[a, 0], points[a, 1]
+    dx, dy = points[b, 0] - ax, points[b, 1] - ay
+    length2 = dx * dx + dy * dy
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.clip(np.where(length2 > 0, ((x - ax) * dx + (y - ay) * dy) / length2, 0.0), 0.0, 1.0)
+    d = np.hypot(ax + t * dx - x, ay + t * dy - y)
+    result = np.full(count, np.inf)
+    np.minimum.at(result, np.asarray(run_owner)[runs], d)
+    return result
+
+
+class PolygonGrid:
+    # Even-odd inside test of many points against one polygon, such as a
+    # lasso. The polygon's box is split into cells and the state of every
+    # cell centre is found from the crossings of its row; points in cells no
+    # edge passes through share the state of the centre, the few in cells
+    # next to an edge are tested exactly against every edge.
+
+    def __init__(self, polygon, cells=256):
+        self.polygon = np.asarray(polygon, dtype=np.float64).reshape(-1, 2)
+        lo, hi = self.polygon.min(axis=0), self.polygon.max(axis=0)
+        self.origin = lo
+        self.size = max(float((hi - lo).max()) / cells, 1e-12)
+        self.shape = tuple(np.floor((hi - lo) / self.size).astype(np.int64) + 1)
+        nx, ny = self.shape
+        a, b = self.polygon, np.roll(self.polygon, -1, axis=0)
+
+        # Crossings of the horizontal line through each row of centres,
+        # counted per column to the left of each centre
+        ys = lo[1] + (np.arange(ny) + 0.5) * self.size
+        straddles = (a[None, :, 1] > ys[:, None]) != (b[None, :, 1] > ys[:, None])
+        rows, edges = np.nonzero(straddles)
+        ya, yb = a[edges, 1], b[edges, 1]
+        x_cross = a[edges, 0] + (ys[rows] - ya) * (b[edges, 0] - a[edges, 0]) / (yb - ya)
+        columns = np.clip(np.ceil((x_cross - lo[0]) / self.size - 0.5), 0, nx).astype(np.int64)
+        counts = np.zeros((ny, nx + 1), dtype=np.int64)
+        np.add.at(counts, (rows, columns), 1)
+        # A crossing right of every centre in its column lands in the next one
+        self.inside = (np.cumsum(counts, axis=1)[:, :nx] % 2 == 1).T
+
+        # Cells an edge may pass through: samples every half cell along each
+        # edge, grown by one cell
+        lengths = np.hypot(*(b - a).T)
+        steps = np.ceil(lengths / (self.size / 2)).astype(np.int64) + 1
+        edge_ids = np.repeat(np.arange(len(a)), steps)
+        t = (np.arange(steps.sum()) - np.repeat(np.cumsum(steps) - steps, steps)) / np.repeat(np.maximum(steps - 1, 1), steps)
+        samples = a[edge_ids] + (b - a)[edge_ids] * t[:, None]
+        cells = np.floor((samples - lo) / self.size).astype(np.int64)
+        self.boundary = np.zeros((nx + 2, ny + 2), dtype=bool)
+        for dx in (0, 1, 2):
+            for dy in (0, 1, 2):
+                self.boundary[cells[:, 0] + dx, cells[:, 1] + dy] = True
+        self.boundary = self.boundary[1:-1, 1:-1]
+
+    def contains(self, points, max_pairs=1 << 22):
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        cells = np.floor((points - self.origin) / self.size).astype(np.int64)
+        nx, ny = self.shape
+        on_grid = (cells[:, 0] >= 0) & (cells[:, 0] < nx) & (cells[:, 1] >= 0) & (cells[:, 1] < ny)
+        result = np.zeros(len(points), dtype=bool)
+        ids = np.flatnonzero(on_grid)
+        cx, cy = cells[ids, 0], cells[ids, 1]
+        result[ids] = self.inside[cx, cy]
+        exact = ids[self.boundary[cx, cy]]
+        a, b = self.polygon, np.roll(self.polygon, -1, axis=0)
+        step = max(1, max_pairs // len(a))
+        for k in range(0, len(exact), step):
+            p = points[exact[k:k + step]]
+            straddles = (a[None, :, 1] > p[:, None, 1]) != (b[None, :, 1] > p[:, None, 1])
+            with np.errstate(divide='ignore', invalid='ignore'):
+                x_cross = a[None, :, 0] + (p[:, None, 1] - a[None, :, 1]) * (b - a)[None, :, 0] / (b - a)[None, :, 1]
+            result[exact[k:k + step]] = (straddles & (p[:, None, 0] < x_cross)).sum(axis=1) % 2 == 1
+        return result
+
+    def box_states(self, bounds):
+        # (N,) 1 for boxes lying in cells all inside the polygon and clear of
+        # its edges, -1 for boxes clear of the edges and all outside, 0 for
+        # the rest, which need their points tested
+        bounds = np.asarray(bounds, dtype=np.float64).reshape(-1, 4)
+        nx, ny = self.shape
+        k0 = np.floor((bounds[:, :2] - self.origin) / self.size).astype(np.int64)
+        k1 = np.floor((bounds[:, 2:] - self.origin) / self.size).astype(np.int64)
+        off = (k0[:, 0] < 0) | (k0[:, 1] < 0) | (k1[:, 0] >= nx) | (k1[:, 1] >= ny)
+        k0, k1 = np.clip(k0, 0, (nx - 1, ny - 1)), np.clip(k1, 0, (nx - 1, ny - 1))
+        states = np.zeros(len(bounds), dtype=np.int64)
+        cells = (k1[:, 0] - k0[:, 0] + 1) * (k1[:, 1] - k0[:, 1] + 1)
+        inside = _box_sums(self.inside & ~self.boundary, k0, k1)
+        outside = _box_sums(~self.inside & ~self.boundary, k0, k1)
+        states[(inside == cells) & ~off] = 1
+        states[outside == cells] = -1
+        return states
+
+
+def _box_sums(mask, k0, k1):
+    # Number of set cells of mask in each inclusive cell range, from a summed area table
+    table = np.zeros((mask.shape[0] + 1, mask.shape[1] + 1), dtype=np.int64)
+    table[1:, 1:] = mask.cumsum(axis=0).cumsum(axis=1)
+    x0, y0, x1, y1 = k0[:, 0], k0[:, 1], k1[:, 0] + 1, k1[:, 1] + 1
+    return table[x1, y1] - table[x0, y1] - table[x1, y0] + table[x0, y0]
@@ -0,0 +1,53 @@
+import numpy as np
+
+
+def douglas_peucker_mask(points, tolerance):
+    # Douglas-Peucker simplification of a polyline (N, 2). Returns a boolean
+    # mask of the points to keep; the first and last points are always kept.
+    # Instead of recursing, every range still to be split is handled in the
+    # same vectorized round, so the Python loop runs O(log N) times.
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    n = len(points)
+    keep = np.zeros(n, dtype=bool)
+    if n <= 2:
+        keep[:] = True
+        return keep
+    keep[0] = keep[-1] = True
+    starts = np.array([0])
+    ends = np.array([n - 1])
+    while len(starts):
+        inner = ends - starts - 1
+        active = inner > 0
+        starts, ends, inner = starts[active], ends[active], inner[active]
+        if not len(starts):
+            break
+
+        range_ids = np.repeat(np.arange(len(starts)), inner)
+        first = np.concatenate(([0], np.cumsum(inner)[:-1]))
+        point_ids = starts[range_ids] + 1 + np.arange(inner.sum()) - first[range_ids]
+
+        p = points[starts][range_ids]
+        d = points[ends][range_ids] - p
+        v = points[point_ids] - p
+        length = np.hypot(d[:, 0], d[:, 1])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            dist = np.abs(v[:, 0] * d[:, 1] - v[:, 1] * d[:, 0]) / length
+        # Closed rings start and end on the same point, measure from that point
+        dist = np.where(length == 0, np.hypot(v[:, 0], v[:, 1]), dist)
+
+        max_dist = np.maximum.reduceat(dist, first)
+        split_range = max_dist > tolerance
+        # First point of each range that reaches its maximum
+        is_max = (dist == max_dist[range_ids]) & split_range[range_ids]
+        hit_ranges, hit_first = np.unique(range_ids[is_max], return_index=True)
+        splits = point_ids[np.flatnonzero(is_max)[hit_first]]
+        keep[splits] = True
+
+        starts = np.concatenate((starts[hit_ranges], splits))
+        ends = np.concatenate((splits, ends[hit_ranges]))
+    return keep
+
+
+def simplify(points, tolerance):
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    return points[douglas_peucker_mask(points, tolerance)]
@@ -0,0 +1,229 @@
+from collections import defaultdict
+
+import numpy as np
+
+
+class SnapIndex:
+    # Uniform grid of snap points for a whole scene. Points are grouped by
+    # owner (normally an InteractablePathItem) so an owner can be moved or
+    # removed without touching anyone else's points. With cells at least as
+    # large as the snap radius a query only needs the 3x3 block of cells
+    # around each point, so lookups stay constant time however many points
+    # the scene holds.
+    #
+    # closest_to() answers the same question per owner from a cache of owner
+    # pairs: the closest pairing between two owners only changes when one of
+    # them moves, so re-snapping everything after one move only recomputes
+    # the pairs of the owner that moved. Owners whose points changed since
+    # the last take_dirty() are tracked for incremental re-snapping.
+
+    def __init__(self, cell_size=20.0):
+        self.cell_size = float(cell_size)
+        self._cells = defaultdict(dict)
+        self._owner_cells = {}
+        self._count = 0
+        self._pairs = {}  # owner -> {other: (distance, source (x, y), target (x, y)) or None}
+        self._pair_radius = None
+        self._dirty = {}
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, owner):
+        return owner in self._owner_cells
+
+    def clear(self):
+        self._cells.clear()
+        self._owner_cells.clear()
+        self._count = 0
+        self._pairs.clear()
+        self._dirty.clear()
+
+    def _group(self, points):
+        # Splits points by grid cell, returns [(cell, point indices)]
+        keys = np.floor(points / self.cell_size).astype(np.int64)
+        if len(points) <= 32:
+            groups = defaultdict(list)
+            for i, cell in enumerate(map(tuple, keys.tolist())):
+                groups[cell].append(i)
+            return list(groups.items())
+        # Pack both cell coordinates into one int64 so a 1D sort can group them
+        packed = (keys[:, 0] << 32) | (keys[:, 1] & 0xffffffff)
+        order = np.argsort(packed, kind='stable')
+        packed = packed[order]
+        starts = np.flatnonzero(np.concatenate(([True], packed[1:] != packed[:-1])))
+        ends = np.append(starts[1:], len(packed))
+        return [(tuple(keys[order[a]].tolist()), order[a:b]) for a, b in zip(starts.tolist(), ends.tolist())]
+
+    def set_points(self, owner, points):
+        # Replaces all snap points of owner with points (N, 2) in scene coordinates
+        self.remove(owner)
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if not len(points):
+            return
+        cells = []
+        for cell, ids in self._group(points):
+            self._cells[cell][owner] = points[ids]
+            cells.append(cell)
+        self._owner_cells[owner] = cells
+        self._count += len(points)
+        self._dirty[owner] = None
+
+    def remove(self, owner):
+        self._dirty.pop(owner, None)
+        # Cached pairs are stored both ways round, so this drops every pair owner is part of
+        for other in self._pairs.pop(owner, ()):
+            self._pairs.get(other, {}).pop(owner, None)
+        cells = self._owner_cells.pop(owner, None)
+        if cells is None:
+            return
+        for cell in cells:
+            bucket = self._cells[cell]
+            self._count -= len(bucket.pop(owner))
+            if not bucket:
+                del self._cells[cell]
+
+    def points(self, owner):
+        cells = self._owner_cells.get(owner)
+        if not cells:
+            return np.zeros((0, 2))
+        return np.concatenate([self._cells[cell][owner] for cell in cells])
+
+    def _candidates(self, cells, exclude):
+        owners, blocks = [], []
+        for cell in cells:
+            for owner, pts in self._cells.get(cell, {}).items():
+                if owner is not exclude:
+                    owners.append((owner, len(pts)))
+                    blocks.append(pts)
+        return owners, blocks
+
+    def nearest(self, point, radius, exclude=None):
+        # Closest snap point to point within radius (Manhattan distance, as
+        # the viewer has always measured snaps), see closest_pair
+        return self.closest_pair(np.asarray(point, dtype=np.float64).reshape(1, 2), radius, exclude)
+
+    def closest_pair(self, points, radius, exclude=None):
+        # Closest pairing between any of points and the indexed snap points
+        # of other owners, within radius. Returns (owner, target (x, y),
+        # distance, index into points) or None.
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if not len(points) or not self._count:
+            return None
+        reach = int(np.ceil(radius / self.cell_size))
+
+        best = None
+        for (kx, ky), source_ids in self._group(points):
+            source_ids = np.asarray(source_ids)
+            cells = [(kx + dx, ky + dy) for dx in range(-reach, reach + 1) for dy in range(-reach, reach + 1)]
+            owners, blocks = self._candidates(cells, exclude)
+            if not blocks:
+                continue
+            targets = np.concatenate(blocks)
+            distance = np.abs(points[source_ids, None, :] - targets[None, :, :]).sum(axis=2)
+            flat = int(np.argmin(distance))
+            s, t = divmod(flat, len(targets))
+            d = float(distance[s, t])
+            if d <= radius and (best is None or d < best[2]):
+                owner = None
+                for o, n in owners:
+                    if t < n:
+                        owner = o
+                        break
+                    t -= n
+                best = (owner, tuple(targets[flat % len(targets)].tolist()), d, int(source_ids[s]))
+        return best
+
+    def take_dirty(self):
+        # Owners whose points were set since the last call, in the order they changed
+        dirty = list(self._dirty)
+        self._dirty.clear()
+        return dirty
+
+    def _near_cells(self, owner, radius):
+        # Cells within radius of any of owner's cells
+        reach = int(np.ceil(radius / self.cell_size))
+        offsets = [(dx, dy) for dx in range(-reach, reach + 1) for dy in range(-reach, reach + 1)]
+        return {(kx + dx, ky + dy) for kx, ky in self._owner_cells.get(owner, ()) for dx, dy in offsets}
+
+    def neighbours(self, owner, radius):
+        # Other owners with points in the cells within radius of owner's points
+        found = {}
+        for cell in self._near_cells(owner, radius):
+            bucket = self._cells.get(cell)
+            if bucket:
+                found.update(dict.fromkeys(bucket))
+        found.pop(owner, None)
+        return list(found)
+
+    def _pairs_with(self, owner, blocks, radius, max_block=1 << 22):
+        # Closest pairing of owner's points with each of several other owners.
+        # blocks is [(other, points)] with every other owner's points near
+        # owner, possibly split over several entries. Returns {other: hit or None}.
+        source = self.points(owner)
+        others = list(dict.fromkeys(other for other, _ in blocks))
+        slot = {other: k for k, other in enumerate(others)}
+        targets = np.concatenate([points for _, points in blocks])
+        labels = np.repeat([slot[other] for other, _ in blocks], [len(points) for _, points in blocks])
+
+        # Points further than radius from the other side's bounding box can never pair up
+        lo, hi = source.min(axis=0) - radius, source.max(axis=0) + radius
+        keep = np.flatnonzero(((targets >= lo) & (targets <= hi)).all(axis=1))
+        targets, labels = targets[keep], labels[keep]
+        hits = dict.fromkeys(others)
+        if not len(targets):
+            return hits
+        lo, hi = targets.min(axis=0) - radius, targets.max(axis=0) + radius
+        source = source[((source >= lo) & (source <= hi)).all(axis=1)]
+
+        # Closest source point for every target point, sources in slices to bound memory
+        nearest = np.full(len(targets), np.inf)
+        nearest_source = np.zeros(len(targets), dtype=np.int64)
+        step = max(1, max_block // max(len(targets), 1))
+        columns = np.arange(len(targets))
+        for a in range(0, len(source), step):
+            distance = np.abs(np.subtract.outer(source[a:a + step, 0], targets[:, 0]))
+            distance += np.abs(np.subtract.outer(source[a:a + step, 1], targets[:, 1]))
+            rows = np.argmin(distance, axis=0)
+            d = distance[rows, columns]
+            closer = d < nearest
+            nearest[closer] = d[closer]
+            nearest_source[closer] = rows[closer] + a
+
+        # Then the closest target point per other owner
+        order = np.lexsort((nearest, labels))
+        first = np.flatnonzero(np.concatenate(([True], labels[order][1:] != labels[order][:-1])))
+        for t in order[first].tolist():
+            if nearest[t] <= radius:
+                hits[others[labels[t]]] = (float(nearest[t]), tuple(source[nearest_source[t]].tolist()),
+                                           tuple(targets[t].tolist()))
+        return hits
+
+    def closest_to(self, owner, radius):
+        # Closest pairing between owner's indexed points and any other
+        # owner's, as (other, target (x, y), distance, source (x, y)) or None.
+        # Pairs are computed once and reused until either side moves.
+        if owner not in self._owner_cells:
+            return None
+        if radius != self._pair_radius:
+            self._pairs.clear()
+            self._pair_radius = radius
+        cached = self._pairs.setdefault(owner, {})
+
+        blocks = []
+        for cell in self._near_cells(owner, radius):
+            bucket = self._cells.get(cell)
+            if bucket:
+                blocks.extend((other, points) for other, points in bucket.items()
+                              if other is not owner and other not in cached)
+        if blocks:
+            for other, hit in self._pairs_with(owner, blocks, radius).items():
+                cached[other] = hit
+                self._pairs.setdefault(other, {})[owner] = None if hit is None else (hit[0], hit[2], hit[1])
+
+        # Cached pairs are dropped as soon as either side moves, so all of them are current
+        best = None
+        for other, hit in cached.items():
+            if hit is not None and (best is None or hit[0] < best[2]):
+                best = (other, hit[2], hit[0], hit[1])
+        return best
@@ -0,0 +1,97 @@
+import colorsys
+
+from PyQt5.QtCore import QObject, pyqtSignal
+from PyQt5.QtGui import QColor, QPen
+
+
+# Widest pen a style hands out. Items reserve half of it around their path
+# once, so pen changes never move bounding rects.
+MAX_PEN_WIDTH = 20
+
+_ACI_STANDARD = {
+    1: (255, 0, 0), 2: (255, 255, 0), 3: (0, 255, 0), 4: (0, 255, 255), 5: (0, 0, 255),
+    6: (255, 0, 255), 7: (255, 255, 255), 8: (128, 128, 128), 9: (192, 192, 192),
+}
+_ACI_VALUES = (1.0, 1.0, 0.8, 0.8, 0.6, 0.6, 0.5, 0.5, 0.3, 0.3)
+
+
+def aci_color(index):
+    # QColor of an AutoCAD color index. 10-249 cycle through hues 15 degrees
+    # apart, each in five shades of full and half saturation; 250-255 are
+    # greys. Color 7 is drawn white, the viewer background being dark.
+    index = abs(int(index))
+    if index in _ACI_STANDARD:
+        return QColor(*_ACI_STANDARD[index])
+    if 10 <= index <= 249:
+        hue = (index // 10 - 1) * 15 / 360.0
+        shade = index % 10
+        r, g, b = colorsys.hsv_to_rgb(hue, 1.0 if shade % 2 == 0 else 0.5, _ACI_VALUES[shade])
+        return QColor(int(r * 255), int(g * 255), int(b * 255))
+    if 250 <= index <= 255:
+        level = int(51 + (index - 250) * 204 / 5)
+        return QColor(level, level, level)
+    return QColor(255, 255, 255)
+
+
+class StyleModel(QObject):
+    # Pens shared by every item of a scene. Items keep a reference to the
+    # model and their layer name instead of a pen of their own, so a style
+    # change is one changed signal rather than a setPen per item. Layers
+    # draw with their DXF color while layer colors are in use, every layer
+    # uses the global color otherwise.
+
+    changed = pyqtSignal()
+
+    def __init__(self, color=None, width=1, parent=None):
+        super().__init__(parent)
+        self._color = QColor(255, 255, 255) if color is None else QColor(color)
+        self._width = min(width, MAX_PEN_WIDTH)
+        self._layer_colors = {}
+        self._use_layer_colors = True
+        self._pens = {}
+
+    def penColor(self):
+        return QColor(self._color)
+
+    def penWidth(self):
+        return self._width
+
+    def setPenColor(self, color):
+        # Picking a color for everything overrides the layer colors
+        self._color = QColor(color)
+        self._use_layer_colors = False
+        self._changed()
+
+    def setPenWidth(self, width):
+        self._width = min(width, MAX_PEN_WIDTH)
+        self._changed()
+
+    def layerColor(self, layer):
+        return self._layer_colors.get(layer)
+
+    def setLayerColors(self, colors):
+        # Layer name -> QColor, replacing the previous ones
+        self._layer_colors = {name: QColor(color) for name, color in colors.items()}
+        self._changed()
+
+    def useLayerColors(self):
+        return self._use_layer_colors
+
+    def setUseLayerColors(self, enabled):
+        if enabled != self._use_layer_colors:
+            self._use_layer_colors = enabled
+            self._changed()
+
+    def pen(self, layer=None):
+        # Pens are built once per layer and handed out until the style changes
+        pen = self._pens.get(layer)
+        if pen is None:
+            color = self._color
+            if self._use_layer_colors and layer in self._layer_colors:
+                color = self._layer_colors[layer]
+            pen = self._pens[layer] = QPen(color, self._width)
+        return QPen(pen)
+
+    def _changed(self):
+        self._pens.clear()
+        self.changed.emit()
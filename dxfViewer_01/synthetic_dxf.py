@@ -0,0 +1,212 @@
+import os
+
+import numpy as np
+
+from dxf_writer import DxfWriter, write_header
+
+# Seeded generators of large synthetic drawings for the benchmarks. Every
+# generator takes a target entity count and a seed and always produces the
+# same file for them. Files are written straight as ASCII DXF, streaming,
+# so 10M entity drawings do not need ezdxf or the memory to hold them.
+#
+#   grid     squares drawn with four LINEs each, every edge shared with a
+#            neighbour: one big planar graph
+#   gasket   rings of CIRCLEs, rounded LWPOLYLINE outlines with bulges and
+#            ARC/LINE slots: arc heavy
+#   nest     dense random polygons with circular holes, as a nesting job
+#            would hand over
+#   noisy    LINE polygons whose shared endpoints are jittered below the
+#            snapping tolerance, plus duplicated edges
+#   parts    INSERTs of a handful of part blocks, rotated and some mirrored
+
+
+def _header(f):
+    # Handles of the generated entities stay far below the seed, so readers
+    # adding table records of their own do not collide with them
+    write_header(f, (('0', 7), ('OUTLINE', 3), ('HOLES', 1)), 0xFFFFFFFFFF)
+
+
+def _entities(f):
+    f.write('0\nSECTION\n2\nENTITIES\n')
+
+
+def _footer(f):
+    f.write('0\nENDSEC\n0\nEOF\n')
+
+
+def _blocks(n, block):
+    # Splits n into block sized chunks
+    while n > 0:
+        yield min(n, block)
+        n -= block
+
+
+def write_grid(f, n, rng):
+    # ~n LINEs on a square grid of unit cells
+    side = max(1, int(np.sqrt(n / 2)))
+    w = DxfWriter(f)
+    rows = np.arange(side + 1, dtype=np.float64) * 10.0
+    for y in rows:
+        w.lines(np.column_stack((rows[:-1], np.full(side, y), rows[1:], np.full(side, y))), 'OUTLINE')
+    for x in rows:
+        w.lines(np.column_stack((np.full(side, x), rows[:-1], np.full(side, x), rows[1:])), 'OUTLINE')
+    return w.count
+
+
+def write_gasket(f, n, rng, block=20000):
+    # Gaskets of about 8 entities: an outline with four bulged corners, a
+    # centre circle, four bolt holes and a slot of two ARCs and two LINEs
+    w = DxfWriter(f)
+    per = 8
+    count = max(1, n // per)
+    side = int(np.ceil(np.sqrt(count)))
+    for start, size in zip(range(0, count, block), _blocks(count, block)):
+        k = np.arange(start, start + size)
+        cx, cy = (k % side) * 120.0, (k // side) * 120.0
+        half = rng.uniform(30, 50, size)
+        corner = rng.uniform(3, 10, size)
+        # Rounded rectangle walked CCW, quarter circle bulges on the corners
+        t = np.tan(np.pi / 8)
+        h, c = half[:, None], corner[:, None]
+        xs = np.hstack((-h + c, h - c, h, h, h - c, -h + c, -h, -h))
+        ys = np.hstack((-h, -h, -h + c, h - c, h, h, h - c, -h + c))
+        bulges = np.tile([0, t, 0, t, 0, t, 0, t], (size, 1))
+        vertices = np.stack((xs + cx[:, None], ys + cy[:, None], bulges), axis=2).reshape(-1, 3)
+        w.polylines(vertices, np.full(size, 8), True, 'OUTLINE')
+
+        w.circles(np.column_stack((cx, cy, half / 4)), 'HOLES')
+        bolt = half * 0.7
+        for dx, dy in ((-1, -1), (1, -1), (1, 1), (-1, 1)):
+            w.circles(np.column_stack((cx + dx * bolt, cy + dy * bolt, rng.uniform(1.5, 3, size))), 'HOLES')
+
+        # Slot right of the centre circle
+        sx, sy, r, length = cx + half * 0.45, cy, half * 0.06, half * 0.3
+        w.arcs(np.column_stack((sx, sy, r, np.full(size, 180.0), np.full(size, 360.0))), 'HOLES')
+        w.arcs(np.column_stack((sx, sy + length, r, np.zeros(size), np.full(size, 180.0))), 'HOLES')
+        w.lines(np.column_stack((sx - r, sy, sx - r, sy + length)), 'HOLES')
+        w.lines(np.column_stack((sx + r, sy, sx + r, sy + length)), 'HOLES')
+    return w.count
+
+
+def write_nest(f, n, rng, block=20000):
+    # Random star shaped polygons packed on a jittered grid, each with a
+    # circular hole, about two entities per part
+    w = DxfWriter(f)
+    count = max(1, n // 2)
+    side = int(np.ceil(np.sqrt(count)))
+    for start, size in zip(range(0, count, block), _blocks(count, block)):
+        k = np.arange(start, start + size)
+        cx = (k % side) * 25.0 + rng.uniform(-2, 2, size)
+        cy = (k // side) * 25.0 + rng.uniform(-2, 2, size)
+        sides = rng.integers(5, 24, size)
+        counts = sides
+        part = np.repeat(np.arange(size), counts)
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        angle = 2 * np.pi * local / counts[part]
+        radius = rng.uniform(6, 11, counts.sum())
+        vertices = np.column_stack((cx[part] + radius * np.cos(angle), cy[part] + radius * np.sin(angle),
+                                    np.zeros(counts.sum())))
+        w.polylines(vertices, counts, True, 'OUTLINE')
+        w.circles(np.column_stack((cx, cy, rng.uniform(1, 4, size))), 'HOLES')
+    return w.count
+
+
+def write_noisy(f, n, rng, block=20000, noise=3e-4):
+    # Hexagons made of six LINEs each, every endpoint moved by up to noise
+    # so meeting endpoints stay within the default 1e-3 snapping tolerance,
+    # and one edge in ten drawn twice
+    w = DxfWriter(f)
+    count = max(1, n // 7)
+    side = int(np.ceil(np.sqrt(count)))
+    angles = np.arange(7) * np.pi / 3
+    for start, size in zip(range(0, count, block), _blocks(count, block)):
+        k = np.arange(start, start + size)
+        cx, cy = (k % side) * 30.0, (k // side) * 30.0
+        x = cx[:, None] + 10 * np.cos(angles)
+        y = cy[:, None] + 10 * np.sin(angles)
+        x0 = x[:, :-1] + rng.uniform(-noise, noise, (size, 6))
+        y0 = y[:, :-1] + rng.uniform(-noise, noise, (size, 6))
+        x1 = x[:, 1:] + rng.uniform(-noise, noise, (size, 6))
+        y1 = y[:, 1:] + rng.uniform(-noise, noise, (size, 6))
+        rows = np.stack((x0, y0, x1, y1), axis=2).reshape(-1, 4)
+        w.lines(rows, 'OUTLINE')
+        w.lines(rows[rng.random(len(rows)) < 0.1], 'OUTLINE')
+    return w.count
+
+
+PART_BLOCKS = 8
+
+
+def write_part_blocks(f, rng):
+    # BLOCKS section with PART_BLOCKS parts: a random star outline around
+    # the base point and one to three holes, all on layer 0 so they take
+    # the layer of their INSERT
+    f.write('0\nSECTION\n2\nBLOCKS\n')
+    w = DxfWriter(f)
+    w.handle = 0x20
+    for k in range(PART_BLOCKS):
+        f.write(f'0\nBLOCK\n5\n{w.handle:X}\n100\nAcDbEntity\n8\n0\n100\nAcDbBlockBegin\n2\nPART{k}\n70\n0\n10\n0.0\n20\n0.0\n30\n0.0\n3\nPART{k}\n')
+        w.handle += 1
+        sides = int(rng.integers(6, 17))
+        angle = 2 * np.pi * np.arange(sides) / sides
+        radius = rng.uniform(12, 20, sides)
+        bulges = np.where(rng.random(sides) < 0.25, 0.2, 0.0)
+        w.polylines(np.column_stack((radius * np.cos(angle), radius * np.sin(angle), bulges)), [sides])
+        holes = int(rng.integers(1, 4))
+        w.circles(np.column_stack((np.linspace(-4, 4, holes), np.zeros(holes), np.full(holes, 2.0))))
+        f.write(f'0\nENDBLK\n5\n{w.handle:X}\n100\nAcDbEntity\n8\n0\n100\nAcDbBlockEnd\n')
+        w.handle += 1
+    f.write('0\nENDSEC\n')
+
+
+def write_parts(f, n, rng, block=20000):
+    # n INSERTs of the part blocks on a grid, rotated in 15 degree steps and
+    # one in ten mirrored
+    w = DxfWriter(f)
+    side = int(np.ceil(np.sqrt(n)))
+    for start, size in zip(range(0, n, block), _blocks(n, block)):
+        k = np.arange(start, start + size)
+        names = [f'PART{p}' for p in rng.integers(0, PART_BLOCKS, size).tolist()]
+        sx = np.where(rng.random(size) < 0.1, -1.0, 1.0)
+        rows = np.column_stack(((k % side) * 50.0, (k // side) * 50.0, sx, np.ones(size),
+                                rng.integers(0, 24, size) * 15.0))
+        w.inserts(names, rows, 'OUTLINE')
+    return w.count
+
+
+GENERATORS = {
+    'grid': write_grid,
+    'gasket': write_gasket,
+    'nest': write_nest,
+    'noisy': write_noisy,
+    'parts': write_parts,
+}
+
+# Drawings that need a BLOCKS section before their entities
+BLOCK_WRITERS = {
+    'parts': write_part_blocks,
+}
+
+
+def generate(kind, n, filename, seed=0):
+    # Writes a drawing of about n entities, returns the exact entity count
+    rng = np.random.default_rng(seed)
+    tmp = filename + '.tmp'
+    with open(tmp, 'w', encoding='ascii', newline='\n') as f:
+        _header(f)
+        if kind in BLOCK_WRITERS:
+            BLOCK_WRITERS[kind](f, rng)
+        _entities(f)
+        count = GENERATORS[kind](f, n, rng)
+        _footer(f)
+    os.replace(tmp, filename)
+    return count
+
+
+def cached_drawing(directory, kind, n, seed=0):
+    # Path of the drawing for (kind, n, seed) in directory, generated on first use
+    os.makedirs(directory, exist_ok=True)
+    filename = os.path.join(directory, f'{kind}_{n}_{seed}.dxf')
+    if not os.path.exists(filename):
+        generate(kind, n, filename, seed)
+    return filename
@@ -0,0 +1,141 @@
+import numpy as np
+
+from geometry_store import LINE, CIRCLE, ARC, LWPOLYLINE, sweep_angles
+
+
+DEFAULT_CHORD_TOLERANCE = 0.01
+MAX_SEGMENTS = 4096
+
+
+def segment_counts(radii, sweeps, tolerance=DEFAULT_CHORD_TOLERANCE, max_segments=MAX_SEGMENTS):
+    # Number of chords needed so no chord strays more than tolerance from its
+    # arc: each chord may span at most 2 * acos(1 - tolerance / r). Steps are
+    # also capped at 90 degrees so tiny arcs keep their shape.
+    radii = np.abs(np.asarray(radii, dtype=np.float64))
+    sweeps = np.abs(np.asarray(sweeps, dtype=np.float64))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.clip(1.0 - tolerance / radii, -1.0, 1.0)
+    step = np.minimum(2.0 * np.arccos(ratio), np.pi / 2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        counts = np.ceil(sweeps / step)
+    counts = np.nan_to_num(counts, nan=1.0, posinf=max_segments)
+    return np.clip(counts, 1, max_segments).astype(np.int64)
+
+
+def tessellate_arcs(centers, radii, start_angles, sweeps, tolerance=DEFAULT_CHORD_TOLERANCE, include_end=True):
+    # Tessellates many arcs at once. Angles are in radians, negative sweeps
+    # run clockwise. Returns points (M, 2) and offsets (N + 1,), the points of
+    # arc i being points[offsets[i]:offsets[i + 1]].
+    centers = np.asarray(centers, dtype=np.float64).reshape(-1, 2)
+    radii = np.asarray(radii, dtype=np.float64)
+    start_angles = np.asarray(start_angles, dtype=np.float64)
+    sweeps = np.asarray(sweeps, dtype=np.float64)
+
+    counts = segment_counts(radii, sweeps, tolerance)
+    n_points = counts + 1 if include_end else counts
+    offsets = np.concatenate(([0], np.cumsum(n_points)))
+    arc_ids = np.repeat(np.arange(len(counts)), n_points)
+    k = np.arange(offsets[-1]) - offsets[arc_ids]
+    angles = start_angles[arc_ids] + sweeps[arc_ids] * (k / counts[arc_ids])
+    points = centers[arc_ids] + radii[arc_ids, None] * np.column_stack((np.cos(angles), np.sin(angles)))
+    return points, offsets
+
+
+def tessellate_circles(circles, tolerance=DEFAULT_CHORD_TOLERANCE):
+    # Closed rings for (cx, cy, r) rows, the first point is not repeated
+    circles = np.asarray(circles, dtype=np.float64).reshape(-1, 3)
+    return tessellate_arcs(circles[:, :2], circles[:, 2], np.zeros(len(circles)),
+                           np.full(len(circles), 2 * np.pi), tolerance, include_end=False)
+
+
+def bulge_arcs(p, q, bulges):
+    # Center, radius, start angle and signed sweep (radians) of bulged segments
+    theta = 4.0 * np.arctan(bulges)
+    d = q - p
+    with np.errstate(divide='ignore', invalid='ignore'):
+        f = (1.0 - bulges * bulges) / (4.0 * bulges)
+    f = np.where(bulges == 0, 0.0, f)
+    centers = (p + q) / 2.0 + np.column_stack((-d[:, 1], d[:, 0])) * f[:, None]
+    radii = np.hypot(p[:, 0] - centers[:, 0], p[:, 1] - centers[:, 1])
+    starts = np.arctan2(p[:, 1] - centers[:, 1], p[:, 0] - centers[:, 0])
+    return centers, radii, starts, theta
+
+
+def tessellate_runs(vertices, offsets, closed, tolerance=DEFAULT_CHORD_TOLERANCE):
+    # Flattens (x, y, bulge) vertex runs, as stored for LWPOLYLINEs and
+    # profiles, in one pass. Every vertex starts a segment towards the next
+    # vertex (wrapping round on closed runs); the last vertex of an open run
+    # only contributes itself. Closed runs do not repeat their first point.
+    # Returns points (M, 2) and per-run offsets (P + 1,).
+    vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 3)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    closed = np.asarray(closed, dtype=bool)
+    n = len(vertices)
+    if not n:
+        return np.zeros((0, 2)), np.zeros(len(offsets), dtype=np.int64)
+
+    lengths = np.diff(offsets)
+    run_ids = np.repeat(np.arange(len(lengths)), lengths)
+    nxt = np.arange(1, n + 1)
+    last = offsets[1:] - 1
+    has_vertices = lengths > 0
+    nxt[last[has_vertices]] = offsets[:-1][has_vertices]
+    terminal = np.zeros(n, dtype=bool)
+    terminal[last[has_vertices & ~closed]] = True
+
+    p = vertices[:, :2]
+    q = vertices[nxt, :2]
+    bulges = np.where(terminal, 0.0, vertices[:, 2])
+    is_arc = bulges != 0
+
+    centers, radii, starts, sweeps = bulge_arcs(p[is_arc], q[is_arc], bulges[is_arc])
+    counts = np.ones(n, dtype=np.int64)
+    counts[is_arc] = segment_counts(radii, sweeps, tolerance)
+
+    # Every segment emits its start point plus its interior arc points
+    point_offsets = np.concatenate(([0], np.cumsum(counts)))
+    seg_ids = np.repeat(np.arange(n), counts)
+    k = np.arange(point_offsets[-1]) - point_offsets[seg_ids]
+    points = p[seg_ids].copy()
+
+    arc_index = np.full(n, -1, dtype=np.int64)
+    arc_index[is_arc] = np.arange(is_arc.sum())
+    on_arc = is_arc[seg_ids] & (k > 0)
+    a = arc_index[seg_ids[on_arc]]
+    angles = starts[a] + sweeps[a] * (k[on_arc] / counts[seg_ids[on_arc]])
+    points[on_arc] = centers[a] + radii[a, None] * np.column_stack((np.cos(angles), np.sin(angles)))
+
+    run_counts = np.bincount(run_ids, weights=counts, minlength=len(lengths)).astype(np.int64)
+    return points, np.concatenate(([0], np.cumsum(run_counts)))
+
+
+def tessellate_store(store, tolerance=DEFAULT_CHORD_TOLERANCE):
+    # Every entity of a GeometryStore as a polyline. Returns points (M, 2),
+    # offsets (N + 1,), closed (N,) and the (kind, index) source of each
+    # polyline, ordered lines, circles, arcs, LWPOLYLINEs.
+    lines = store.lines
+    line_points = lines.reshape(-1, 2)
+    line_offsets = np.arange(0, 2 * len(lines) + 1, 2)
+
+    circle_points, circle_offsets = tessellate_circles(store.circles, tolerance)
+
+    arcs = store.arcs
+    arc_points, arc_offsets = tessellate_arcs(arcs[:, :2], arcs[:, 2], np.radians(arcs[:, 3]),
+                                              np.radians(sweep_angles(arcs[:, 3], arcs[:, 4])), tolerance)
+
+    poly_points, poly_offsets = tessellate_runs(store.poly_vertices, store.poly_offsets, store.poly_closed, tolerance)
+
+    parts = [(line_points, line_offsets), (circle_points, circle_offsets),
+             (arc_points, arc_offsets), (poly_points, poly_offsets)]
+    points = np.concatenate([pts for pts, _ in parts])
+    offsets = [np.zeros(1, dtype=np.int64)]
+    base = 0
+    for pts, offs in parts:
+        offsets.append(offs[1:] + base)
+        base += len(pts)
+    counts = store.counts()
+    closed = np.concatenate((np.zeros(counts[LINE], dtype=bool), np.ones(counts[CIRCLE], dtype=bool),
+                             np.zeros(counts[ARC], dtype=bool), store.poly_closed))
+    sources = np.concatenate([np.column_stack((np.full(c, kind), np.arange(c)))
+                              for kind, c in zip((LINE, CIRCLE, ARC, LWPOLYLINE), counts)]).astype(np.int64)
+    return points, np.concatenate(offsets), closed, sources
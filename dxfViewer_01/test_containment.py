@@ -0,0 +1,44 @@
+import numpy as np
+
+from containment import hole_owners, profile_parents
+
+
+def runs(*profiles):
+    # Flat points and offsets of the given point lists
+    points = np.concatenate([np.asarray(p, dtype=np.float64) for p in profiles])
+    offsets = np.concatenate(([0], np.cumsum([len(p) for p in profiles])))
+    return points, offsets
+
+
+def square(x, y, size):
+    return [(x, y), (x + size, y), (x + size, y + size), (x, y + size)]
+
+
+def test_holes_islands_and_open_chains():
+    points, offsets = runs(square(0, 0, 100), square(10, 10, 50), square(20, 20, 10),
+                           square(200, 0, 10), [(70, 70), (80, 90)], square(75, 75, 5))
+    closed = np.array([True, True, True, True, False, True])
+    # The island in the hole is an outline again, the open chain is never a hole
+    np.testing.assert_array_equal(profile_parents(points, offsets, closed), [-1, 0, 1, -1, 0, 0])
+    np.testing.assert_array_equal(hole_owners(points, offsets, closed), [-1, 0, -1, -1, -1, 0])
+
+
+def test_open_chains_between_loops():
+    # A long open chain after the loops used to be measured together with them
+    outer, inner = square(0, 0, 100), square(10, 10, 20)
+    line = [(500, 10), (2000, 30)]
+    points, offsets = runs(outer, inner, line)
+    np.testing.assert_array_equal(hole_owners(points, offsets, [True, True, False]), [-1, 0, -1])
+
+    points, offsets = runs(outer, line, inner, [(-50, 5), (-40, 500), (300, 20)])
+    closed = np.array([True, False, True, False])
+    np.testing.assert_array_equal(hole_owners(points, offsets, closed), [-1, -1, 0, -1])
+    np.testing.assert_array_equal(profile_parents(points, offsets, closed), [-1, -1, 0, -1])
+
+
+def test_empty_and_degenerate_profiles():
+    points, offsets = runs(square(0, 0, 100), [(10, 10), (20, 20)], square(40, 40, 10))
+    offsets = np.insert(offsets, 1, offsets[1])
+    closed = np.array([True, True, True, True])
+    # An empty profile and a closed two point run contain nothing and own nothing
+    np.testing.assert_array_equal(hole_owners(points, offsets, closed), [-1, -1, -1, 0])
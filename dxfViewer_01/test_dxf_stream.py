@@ -0,0 +1,56 @@
+import pytest
+
+from dxf_stream import iter_entities
+
+ENTITIES = [
+    [(0, 'LINE'), (5, '1A'), (8, 'CUT'), (10, 0.0), (20, 1.0), (30, 0.0), (11, 10.0), (21, 1.5), (31, 0.0)],
+    [(0, 'TEXT'), (5, '1B'), (8, 'NOTES'), (10, 3.0), (20, 4.0), (1, 'not geometry')],
+    [(0, 'CIRCLE'), (5, '1C'), (8, 'HOLES'), (10, 5.0), (20, 6.0), (40, 2.5)],
+    [(0, 'ARC'), (5, '1D'), (8, 'CUT'), (10, 1.0), (20, 2.0), (40, 3.0), (50, 90.0), (51, 180.0)],
+    [(0, 'LWPOLYLINE'), (5, '1E'), (8, 'CUT'), (90, 3), (70, 1),
+     (10, 0.0), (20, 0.0), (42, 0.5), (10, 4.0), (20, 0.0), (10, 4.0), (20, 3.0)],
+]
+
+
+def test_reads_supported_entities(write_drawing):
+    filename = write_drawing(ENTITIES, header=[(9, '$ACADVER'), (1, 'AC1015')])
+    line, circle, arc, polyline = iter_entities(filename)
+
+    assert (line.dxftype, line.layer, line.handle) == ('LINE', 'CUT', '1A')
+    assert (line.start, line.end) == ((0.0, 1.0), (10.0, 1.5))
+    assert (circle.layer, circle.center, circle.radius) == ('HOLES', (5.0, 6.0), 2.5)
+    assert (arc.center, arc.radius, arc.start_angle, arc.end_angle) == ((1.0, 2.0), 3.0, 90.0, 180.0)
+    assert polyline.closed
+    assert polyline.points == [(0.0, 0.0, 0.5), (4.0, 0.0, 0.0), (4.0, 3.0, 0.0)]
+
+
+def test_layer_and_type_filters(write_drawing):
+    filename = write_drawing(ENTITIES)
+    assert [e.dxftype for e in iter_entities(filename, layers=['CUT'])] == ['LINE', 'ARC', 'LWPOLYLINE']
+    assert [e.dxftype for e in iter_entities(filename, types=['circle', 'lwpolyline'])] == ['CIRCLE', 'LWPOLYLINE']
+    assert list(iter_entities(filename, layers=['CUT'], types=['CIRCLE'])) == []
+
+
+def test_ignores_tags_outside_entities(write_drawing):
+    # A HEADER variable holding an entity type name is not an entity
+    filename = write_drawing(ENTITIES[:1], header=[(9, '$PROJECTNAME'), (0, 'CIRCLE'), (40, 1.0)])
+    assert [e.dxftype for e in iter_entities(filename)] == ['LINE']
+
+
+def test_reports_progress_to_the_end(write_drawing):
+    filename = write_drawing(ENTITIES * 10)
+    calls = []
+    entities = list(iter_entities(filename, progress=lambda done, total: calls.append((done, total)),
+                                  progress_interval=7))
+    assert len(entities) == 40
+    assert len(calls) > 1
+    done, total = calls[-1]
+    assert done == total
+    assert all(a[0] <= b[0] for a, b in zip(calls, calls[1:]))
+
+
+def test_rejects_binary_dxf(tmp_path):
+    filename = tmp_path / 'binary.dxf'
+    filename.write_bytes(b'AutoCAD Binary DXF\r\n\x1a\x00')
+    with pytest.raises(ValueError):
+        list(iter_entities(str(filename)))
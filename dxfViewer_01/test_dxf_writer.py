@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from dxf_stream import Arc, Circle, Line, LWPolyline
+from dxf_writer import IDENTITY, save_incremental, write_dxf
+from geometry_store import LINE, CIRCLE, GeometryStore
+
+ENTITIES = [
+    Line('CUT', '31', (0, 0), (10, 0)), Line('CUT', '32', (10, 0), (10, 10)),
+    Circle('HOLES', '33', (5, 5), 2),
+    Arc('CUT', '34', (20, 0), 5, 0, 90),
+    LWPolyline('MARK', '35', [(30, 0, 0), (35, 5, 0.5), (40, 0, 0)], True),
+]
+
+
+def identities(store):
+    return [np.tile(IDENTITY, (n, 1, 1)) for n in store.counts()]
+
+
+@pytest.fixture
+def source(tmp_path):
+    filename = str(tmp_path / 'source.dxf')
+    assert write_dxf(filename, [GeometryStore.from_entities(ENTITIES)]) == len(ENTITIES)
+    return filename
+
+
+def test_write_dxf_reads_back(source):
+    store = GeometryStore.from_file(source)
+    expected = GeometryStore.from_entities(ENTITIES)
+    assert store.layers == expected.layers
+    assert store.counts() == expected.counts()
+    for name in ('lines', 'circles', 'arcs', 'poly_vertices', 'poly_offsets', 'poly_closed'):
+        np.testing.assert_allclose(getattr(store, name), getattr(expected, name))
+    np.testing.assert_array_equal(store.handle_columns[LINE], [0x31, 0x32])
+
+
+def test_unchanged_save_is_byte_identical(source, tmp_path):
+    store = GeometryStore.from_file(source)
+    target = str(tmp_path / 'target.dxf')
+    save_incremental(source, target, store, identities(store))
+    with open(source, 'rb') as a, open(target, 'rb') as b:
+        assert a.read() == b.read()
+
+
+def test_only_moved_entities_change(source, tmp_path):
+    store = GeometryStore.from_file(source)
+    matrices = identities(store)
+    matrices[LINE][1] = ((1, 0, 100), (0, 1, 50))
+    matrices[CIRCLE][0] = ((0, -1, 0), (1, 0, 0))
+    target = str(tmp_path / 'target.dxf')
+    save_incremental(source, target, store, matrices)
+
+    saved = GeometryStore.from_file(target)
+    np.testing.assert_allclose(saved.lines, [[0, 0, 10, 0], [110, 50, 110, 60]])
+    np.testing.assert_allclose(saved.circles, [[-5, 5, 2]])
+    np.testing.assert_allclose(saved.arcs, store.arcs)
+    np.testing.assert_allclose(saved.poly_vertices, store.poly_vertices)
+    np.testing.assert_array_equal(saved.handle_columns[LINE], store.handle_columns[LINE])
+    assert saved.layers == store.layers
+
+    with open(source, 'rb') as a, open(target, 'rb') as b:
+        before, after = a.read().splitlines(), b.read().splitlines()
+    assert len(before) == len(after)
+    assert sum(x != y for x, y in zip(before, after)) == 5
+
+
+def test_mismatched_store_leaves_target_alone(source, tmp_path):
+    store = GeometryStore.from_entities(ENTITIES + [Line('CUT', None, (0, 0), (1, 1))])
+    target = tmp_path / 'target.dxf'
+    target.write_bytes(b'old')
+    with pytest.raises(ValueError):
+        save_incremental(source, str(target), store, identities(store))
+    assert target.read_bytes() == b'old'
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from dxf_stream import Circle, Line, LWPolyline
+from geometry_file import GeometryFile, write_geometry_file
+from geometry_store import GeometryStore
+from profile_engine import find_profiles
+
+ENTITIES = [
+    Line('CUT', '31', (0, 0), (10, 0)), Line('CUT', '32', (10, 0), (10, 10)),
+    Line('CUT', '33', (10, 10), (0, 10)), Line('CUT', '34', (0, 10), (0, 0)),
+    Circle('HOLES', '35', (5, 5), 2),
+    LWPolyline('MARK', '36', [(20, 0, 0), (25, 5, 0.5), (30, 0, 0)], False),
+]
+
+
+@pytest.fixture
+def drawing(tmp_path):
+    store = GeometryStore.from_entities(ENTITIES)
+    profiles = find_profiles(store)
+    filename = str(tmp_path / 'drawing.dxfgeom')
+    write_geometry_file(filename, profiles, store, layer_colors={'CUT': 1, 'HOLES': 5})
+    return filename, store, profiles
+
+
+def test_round_trip(drawing):
+    filename, store, profiles = drawing
+    with GeometryFile(filename) as geometry:
+        assert len(geometry) == len(profiles)
+        assert geometry.layers == store.layers
+        assert geometry.layer_colors == {'CUT': 1, 'HOLES': 5, 'MARK': 7}
+        loaded = geometry.profiles()
+        for name in ('vertices', 'offsets', 'closed', 'layers', 'edges', 'edge_offsets', 'dangling'):
+            np.testing.assert_array_equal(getattr(loaded, name), getattr(profiles, name))
+        assert geometry.hasStore()
+        loaded = geometry.store()
+        assert loaded.counts() == store.counts()
+        for name in ('lines', 'circles', 'arcs', 'poly_vertices', 'poly_offsets', 'poly_closed'):
+            np.testing.assert_array_equal(getattr(loaded, name), getattr(store, name))
+        for k in range(4):
+            np.testing.assert_array_equal(loaded.layer_columns[k], store.layer_columns[k])
+            np.testing.assert_array_equal(loaded.handle_columns[k], store.handle_columns[k])
+
+
+def test_random_access(drawing):
+    filename, store, profiles = drawing
+    with GeometryFile(filename) as geometry:
+        for i in range(len(profiles)):
+            np.testing.assert_array_equal(geometry.profile(i), profiles.profile(i))
+            assert geometry.isClosed(i) == profiles.closed[i]
+            assert geometry.layer(i) == store.layers[profiles.layers[i]]
+        square = [i for i in range(len(profiles)) if geometry.layer(i) == 'CUT']
+        np.testing.assert_array_equal(geometry.bounds(square[0]), (0, 0, 10, 10))
+        assert sorted(geometry.query_rect(19, -1, 21, 1).tolist()) == \
+            [i for i in range(len(profiles)) if geometry.layer(i) == 'MARK']
+
+
+def test_profiles_only(tmp_path):
+    profiles = find_profiles(GeometryStore.from_entities(ENTITIES[:4]))
+    filename = str(tmp_path / 'profiles.dxfgeom')
+    write_geometry_file(filename, profiles, layers=['CUT'])
+    with GeometryFile(filename) as geometry:
+        assert not geometry.hasStore() and geometry.store() is None
+        assert geometry.layers == ['CUT']
+        np.testing.assert_array_equal(geometry.profiles().vertices, profiles.vertices)
+
+
+def test_rejects_other_files(tmp_path):
+    filename = tmp_path / 'drawing.dxf'
+    filename.write_bytes(b'  0\nSECTION\n  2\nENTITIES\n  0\nENDSEC\n  0\nEOF\n')
+    with pytest.raises(ValueError):
+        GeometryFile(str(filename))
@@ -0,0 +1,59 @@
+import numpy as np
+
+from dxf_stream import Arc, Circle, Line, LWPolyline
+from geometry_store import LINE, CIRCLE, ARC, LWPOLYLINE, GeometryStore
+
+ENTITIES = [
+    Line('CUT', '1A', (0.0, 1.0), (10.0, 1.5)),
+    Circle('HOLES', 'FF', (5.0, 6.0), 2.5),
+    Line('CUT', None, (2.0, 2.0), (2.0, -3.0)),
+    Arc('CUT', '20', (1.0, 2.0), 3.0, 90.0, 180.0),
+    LWPolyline('HOLES', '21', [(0.0, 0.0, 0.5), (4.0, 0.0, 0.0), (4.0, 3.0, 0.0)], True),
+    LWPolyline('CUT', '22', [(7.0, 7.0, 0.0), (8.0, 9.0, 0.0)], False),
+]
+
+
+def test_columns_per_kind():
+    store = GeometryStore.from_entities(ENTITIES)
+
+    assert store.counts() == (2, 1, 1, 2)
+    assert len(store) == 6
+    np.testing.assert_array_equal(store.lines, [[0, 1, 10, 1.5], [2, 2, 2, -3]])
+    np.testing.assert_array_equal(store.circles, [[5, 6, 2.5]])
+    np.testing.assert_array_equal(store.arcs, [[1, 2, 3, 90, 180]])
+    np.testing.assert_array_equal(store.poly_offsets, [0, 3, 5])
+    np.testing.assert_array_equal(store.poly_closed, [True, False])
+    np.testing.assert_array_equal(store.polyline(1), [[7, 7, 0], [8, 9, 0]])
+
+    # Layers are numbered in order of appearance, handles kept as integers
+    assert store.layers == ['CUT', 'HOLES']
+    np.testing.assert_array_equal(store.layer_columns[LINE], [0, 0])
+    np.testing.assert_array_equal(store.layer_columns[LWPOLYLINE], [1, 0])
+    np.testing.assert_array_equal(store.handle_columns[LINE], [0x1A, 0])
+    np.testing.assert_array_equal(store.handle_columns[CIRCLE], [0xFF])
+
+
+def test_bounds():
+    store = GeometryStore.from_entities(ENTITIES)
+    bounds = store.entity_bounds()
+    # The arc runs through its top and left extremes only
+    np.testing.assert_allclose(bounds[ARC], [[-2, 2, 1, 5]])
+    np.testing.assert_allclose(bounds[CIRCLE], [[2.5, 3.5, 7.5, 8.5]])
+    np.testing.assert_allclose(store.bounds(), (-2, -3, 10, 9))
+    assert GeometryStore().bounds() is None
+
+
+def test_select_layers():
+    store = GeometryStore.from_entities(ENTITIES).select_layers(['HOLES'])
+    assert store.counts() == (0, 1, 0, 1)
+    np.testing.assert_array_equal(store.poly_offsets, [0, 3])
+    np.testing.assert_array_equal(store.handle_columns[LWPOLYLINE], [0x21])
+
+
+def test_transformed_keeps_arcs_on_their_circle():
+    store = GeometryStore.from_entities(ENTITIES)
+    # Quarter turn about the origin, then a shift
+    moved = store.transformed(((0.0, -1.0, 10.0), (1.0, 0.0, 0.0)))
+    np.testing.assert_allclose(moved.lines[0], [9, 0, 8.5, 10])
+    np.testing.assert_allclose(moved.arcs[0], [8, 1, 3, 180, 270])
+    np.testing.assert_allclose(moved.polyline(0), [[10, 0, 0.5], [10, 4, 0], [7, 4, 0]])
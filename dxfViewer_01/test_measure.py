@@ -0,0 +1,93 @@
+import numpy as np
+
+from containment import hole_owners
+from dxf_stream import Circle, Line
+from geometry_store import LINE, CIRCLE, GeometryStore
+from measure import (DUPLICATE, PROFILE, SMALL_HOLE, THIN_WEB, ZERO_LENGTH, check_drawing, entity_measures,
+                     overlapping_segments, profile_measures)
+from profile_engine import find_profiles
+from tessellate import tessellate_runs
+
+
+def square(x, y, size):
+    corners = [(x, y), (x + size, y), (x + size, y + size), (x, y + size)]
+    return [Line('0', None, a, b) for a, b in zip(corners, corners[1:] + corners[:1])]
+
+
+def checked(entities, **limits):
+    store = GeometryStore.from_entities(entities)
+    profiles = find_profiles(store)
+    points, offsets = tessellate_runs(profiles.vertices, profiles.offsets, profiles.closed)
+    owners = hole_owners(points, offsets, profiles.closed)
+    issues = check_drawing(store, profiles, points, offsets, owners, **limits)
+    return store, profiles, points, offsets, owners, issues
+
+
+def profile_at(points, offsets, x, y):
+    # The profile whose first point is (x, y)
+    return int(np.flatnonzero(np.all(points[offsets[:-1]] == (x, y), axis=1))[0])
+
+
+def test_each_check_finds_its_issue():
+    entities = square(0, 0, 10) + square(10.5, 0, 10) + square(50, 0, 10)
+    entities += [Line('0', None, (2, 0), (5, 0)), Line('0', None, (100, 100), (100, 100))]
+    entities += [Circle('0', None, (5, 5), 0.3), Circle('0', None, (55, 5), 2)]
+    store, profiles, points, offsets, owners, issues = checked(entities)
+    assert sorted(issues.checks.tolist()) == [ZERO_LENGTH, DUPLICATE, SMALL_HOLE, THIN_WEB]
+    rows = {check: k for k, check in enumerate(issues.checks.tolist())}
+
+    k = rows[ZERO_LENGTH]
+    assert (issues.kinds[k], issues.indices[k]) == (LINE, 13)
+    np.testing.assert_allclose(issues.xy[k], (100, 100))
+
+    # The short line lies over the first side of the first square
+    k = rows[DUPLICATE]
+    assert (issues.kinds[k], issues.indices[k], issues.other_kinds[k], issues.other_indices[k]) == (LINE, 12, LINE, 0)
+    np.testing.assert_allclose(issues.values[k], 3)
+
+    k = rows[SMALL_HOLE]
+    small = [i for i in range(len(profiles)) if profiles.edges[profiles.edge_offsets[i]].tolist() == [CIRCLE, 0]][0]
+    assert (issues.kinds[k], issues.indices[k]) == (PROFILE, small)
+    assert issues.other_indices[k] == owners[small]
+    np.testing.assert_allclose(issues.values[k], 0.6, rtol=1e-3)
+
+    k = rows[THIN_WEB]
+    pair = sorted((profile_at(points, offsets, 0, 0), profile_at(points, offsets, 10.5, 0)))
+    assert [issues.indices[k], issues.other_indices[k]] == pair
+    np.testing.assert_allclose(issues.values[k], 0.5)
+
+
+def test_limits_switch_checks_off():
+    entities = square(0, 0, 10) + square(10.5, 0, 10) + [Circle('0', None, (5, 5), 0.3)]
+    issues = checked(entities, min_web=0.4, min_hole=0.5)[-1]
+    assert len(issues.checks) == 0
+    issues = checked(entities, min_web=0, min_hole=0)[-1]
+    assert len(issues.checks) == 0
+    issues = checked(entities, min_web=2.0, min_hole=0)[-1]
+    assert issues.checks.tolist() == [THIN_WEB]
+
+
+def test_overlapping_segments():
+    p = np.array([(0, 0), (10, 0), (3, 0), (0, 1), (20, 0)], dtype=np.float64)
+    q = np.array([(10, 0), (15, 0), (4, 0), (10, 1), (30, 0)], dtype=np.float64)
+    first, second, overlap = overlapping_segments(p, q)
+    # Touching end to end is no overlap, nor are parallel lines
+    assert sorted(zip(second.tolist(), first.tolist())) == [(2, 0)]
+    np.testing.assert_allclose(overlap, [1])
+
+
+def test_measures():
+    entities = square(0, 0, 10) + [Circle('0', None, (5, 5), 1)]
+    store = GeometryStore.from_entities(entities)
+    measures = entity_measures(store)
+    np.testing.assert_allclose(measures.lengths, [10, 10, 10, 10, 2 * np.pi])
+    np.testing.assert_allclose(measures.areas, [0, 0, 0, 0, np.pi])
+
+    profiles = find_profiles(store)
+    points, offsets = tessellate_runs(profiles.vertices, profiles.offsets, profiles.closed)
+    owners = hole_owners(points, offsets, profiles.closed)
+    measures = profile_measures(profiles, points, offsets, owners)
+    outline = int(np.flatnonzero(owners == -1)[0])
+    np.testing.assert_allclose(measures.lengths[outline], 40)
+    np.testing.assert_allclose(measures.net_areas[outline], 100 - np.pi)
+    np.testing.assert_allclose(measures.bounds[outline], (0, 0, 10, 10))
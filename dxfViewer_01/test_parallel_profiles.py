@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+import parallel_profiles
+from dxf_stream import Circle, Line
+from geometry_store import GeometryStore
+from parallel_profiles import find_profiles_parallel, sort_profiles
+from profile_engine import find_profiles
+
+
+@pytest.fixture(scope='module', autouse=True)
+def pool():
+    yield
+    parallel_profiles.shutdown()
+
+
+def drawing():
+    # A grid of squares with a hole each, every side split in two, open
+    # chains and stray lines in between
+    entities = []
+    for row in range(6):
+        for col in range(6):
+            x, y = col * 30.0, row * 30.0
+            corners = [(x, y), (x + 10, y), (x + 10, y + 10), (x, y + 10)]
+            for (x0, y0), (x1, y1) in zip(corners, corners[1:] + corners[:1]):
+                middle = ((x0 + x1) / 2, (y0 + y1) / 2)
+                entities += [Line('CUT', None, (x0, y0), middle), Line('CUT', None, (x1, y1), middle)]
+            entities.append(Circle('HOLES', None, (x + 5, y + 5), 2))
+            entities += [Line('MARK', None, (x + 15, y), (x + 20, y + 5)),
+                         Line('MARK', None, (x + 20, y + 5), (x + 25, y))]
+            entities.append(Line('MARK', None, (x + 15, y + 20), (x + 15, y + 20)))
+    return GeometryStore.from_entities(entities)
+
+
+def test_parallel_matches_serial():
+    store = drawing()
+    serial = sort_profiles(find_profiles(store))
+    parallel = find_profiles_parallel(store, jobs=2, min_entities=0)
+
+    assert serial.loop_count() == 72 and serial.chain_count() == 36
+    for name in ('vertices', 'offsets', 'closed', 'layers', 'edges', 'edge_offsets', 'dangling'):
+        np.testing.assert_array_equal(getattr(parallel, name), getattr(serial, name))
+
+
+def test_split_keeps_snapping_ends_together():
+    store = drawing()
+    piece_ids = parallel_profiles.split_pieces(store, 1e-3, 8)
+    lines = piece_ids[0]
+    # The eight halves of every square's sides share one piece
+    for square in range(36):
+        assert len(set(lines[square * 11:square * 11 + 8].tolist())) == 1
@@ -0,0 +1,80 @@
+import os
+
+import numpy as np
+
+from geometry_store import GeometryStore
+from parse_cache import ParseCache
+from profile_engine import find_profiles
+
+SQUARE = [[(0, 'LINE'), (5, hex(0x30 + k)[2:]), (8, 'CUT'), (10, x0), (20, y0), (11, x1), (21, y1)]
+          for k, (x0, y0, x1, y1) in enumerate(((0, 0, 10, 0), (10, 0, 10, 10), (10, 10, 0, 10), (0, 10, 0, 0)))]
+CIRCLE = [[(0, 'CIRCLE'), (8, 'HOLES'), (10, 5.0), (20, 5.0), (40, 2.0)]]
+
+
+def parsed(filename):
+    store = GeometryStore.from_file(filename)
+    return store, find_profiles(store)
+
+
+def test_round_trip(write_drawing, tmp_path):
+    filename = write_drawing(SQUARE + CIRCLE)
+    cache = ParseCache(str(tmp_path / 'cache'))
+    assert cache.load(filename, 1e-3) is None
+    store, profiles = parsed(filename)
+    cache.save(filename, 1e-3, store, profiles)
+
+    loaded = ParseCache(str(tmp_path / 'cache')).load(filename, 1e-3)
+    assert loaded is not None
+    cached_store, cached_profiles = loaded
+    assert cached_store.layers == store.layers
+    assert cached_store.counts() == store.counts()
+    np.testing.assert_array_equal(cached_store.lines, store.lines)
+    np.testing.assert_array_equal(cached_store.handle_columns[0], store.handle_columns[0])
+    for name in ('vertices', 'offsets', 'closed', 'layers', 'edges', 'edge_offsets', 'dangling'):
+        np.testing.assert_array_equal(getattr(cached_profiles, name), getattr(profiles, name))
+
+
+def test_keys_cover_content_and_settings(write_drawing, tmp_path):
+    cache = ParseCache(str(tmp_path / 'cache'))
+    first = write_drawing(SQUARE, name='first.dxf')
+    copy = write_drawing(SQUARE, name='copy.dxf')
+    other = write_drawing(SQUARE + CIRCLE, name='other.dxf')
+
+    # Same bytes under another name share their entry
+    assert cache.key(first, 1e-3) == cache.key(copy, 1e-3)
+    assert cache.key(first, 1e-3) != cache.key(other, 1e-3)
+    assert cache.key(first, 1e-3) != cache.key(first, 1e-2)
+    assert cache.key(first, 1e-3) != cache.key(first, 1e-3, layers=['CUT'])
+    assert cache.key(first, 1e-3, layers=['A', 'B']) == cache.key(first, 1e-3, layers=['B', 'A'])
+
+    # A changed file gets a new key, even with the same size
+    before = cache.key(first, 1e-3)
+    with open(first, 'r+', encoding='ascii') as f:
+        text = f.read().replace('CUT', 'CAT')
+        f.seek(0)
+        f.write(text)
+    os.utime(first, ns=(os.stat(first).st_atime_ns, os.stat(first).st_mtime_ns + 10 ** 9))
+    assert cache.key(first, 1e-3) != before
+
+
+def test_evicts_least_recently_used(write_drawing, tmp_path):
+    cache = ParseCache(str(tmp_path / 'cache'))
+    filenames = [write_drawing(SQUARE[:k + 1], name=f'{k}.dxf') for k in range(3)]
+    for k, filename in enumerate(filenames):
+        cache.save(filename, 1e-3, *parsed(filename))
+        # Entries are ordered by their modification time
+        entry = os.path.join(cache.directory, cache.key(filename, 1e-3))
+        os.utime(entry, (1000 + k, 1000 + k))
+    size = max(size for _, size, _ in cache.entries())
+
+    # Loading the oldest entry makes it the most recently used one
+    assert cache.load(filenames[0], 1e-3) is not None
+    cache.max_bytes = 2 * size
+    cache.evict()
+    assert cache.load(filenames[1], 1e-3) is None
+    assert cache.load(filenames[0], 1e-3) is not None
+    assert cache.load(filenames[2], 1e-3) is not None
+    assert cache.nbytes() <= cache.max_bytes
+
+    cache.clear()
+    assert cache.entries() == []
@@ -0,0 +1,34 @@
+import numpy as np
+
+from path_builder import build_paths, polygon_from_array, polygon_to_array
+
+
+def test_polygon_round_trip():
+    points = np.array([(0.5, -1.0), (2.0, 3.25), (1e9, -1e-9)])
+    polygon = polygon_from_array(points)
+    assert len(polygon) == 3
+    assert (polygon[1].x(), polygon[1].y()) == (2.0, 3.25)
+    np.testing.assert_array_equal(polygon_to_array(polygon), points)
+    assert polygon_to_array(polygon_from_array(np.zeros((0, 2)))).shape == (0, 2)
+
+
+def test_holes_join_their_outline():
+    points = np.array([(0, 0), (10, 0), (10, 10), (0, 10),
+                       (2, 2), (4, 2), (4, 4),
+                       (20, 0), (30, 5),
+                       (6, 6), (8, 6), (8, 8)], dtype=np.float64)
+    offsets = np.array([0, 4, 7, 9, 12])
+    closed = np.array([True, True, False, True])
+    owners = np.array([-1, 0, -1, 0])
+
+    paths = list(build_paths(points, offsets, closed, owners))
+    assert [ids for _, ids in paths] == [[0, 1, 3], [2]]
+    outline, chain = paths[0][0], paths[1][0]
+    # Loops are closed back to their start, one subpath each
+    assert [len(p) for p in outline.toSubpathPolygons()] == [5, 4, 4]
+    assert not outline.contains(polygon_from_array([(3, 3)])[0])
+    assert outline.contains(polygon_from_array([(5, 5)])[0])
+    np.testing.assert_array_equal(polygon_to_array(chain.toSubpathPolygons()[0]), points[7:9])
+
+    # Without owners every profile is a path of its own
+    assert [ids for _, ids in build_paths(points, offsets, closed)] == [[0], [1], [2], [3]]
@@ -0,0 +1,90 @@
+import numpy as np
+
+from dxf_stream import Arc, Circle, Line, LWPolyline
+from geometry_store import LINE, CIRCLE, ARC, GeometryStore
+from profile_engine import find_profiles, run_area2, snap_endpoints
+
+
+def square(x, y, size, jitter=0.0, layer='0'):
+    # Four lines in no particular direction, ends off by up to jitter
+    return [Line(layer, None, (x, y), (x + size, y + jitter)),
+            Line(layer, None, (x + size, y + size), (x + size - jitter, y)),
+            Line(layer, None, (x, y + size + jitter), (x + size, y + size)),
+            Line(layer, None, (x, y - jitter), (x, y + size))]
+
+
+def by_kind(profiles, i):
+    return sorted(map(tuple, profiles.profile_edges(i).tolist()))
+
+
+def test_snap_endpoints():
+    points = np.array([(0, 0), (0.0004, 0.0003), (1, 1), (1.0002, 1), (0, 0.01)])
+    nodes, ids = snap_endpoints(points, 1e-3)
+    assert len(nodes) == 3
+    assert ids[0] == ids[1] and ids[2] == ids[3]
+    assert len({ids[0], ids[2], ids[4]}) == 3
+
+
+def test_loop_from_lines_within_tolerance():
+    store = GeometryStore.from_entities(square(0, 0, 10, jitter=2e-4))
+    profiles = find_profiles(store, tolerance=1e-3)
+
+    assert profiles.loop_count() == 1 and profiles.chain_count() == 0
+    loop = profiles.profile(0)
+    assert len(loop) == 4
+    # Loops run counter-clockwise
+    assert run_area2(loop) > 0
+    np.testing.assert_allclose(abs(run_area2(loop)) / 2, 100, rtol=1e-3)
+    assert by_kind(profiles, 0) == [(LINE, 0), (LINE, 1), (LINE, 2), (LINE, 3)]
+    assert len(profiles.dangling) == 0
+
+
+def test_gaps_over_tolerance_stay_open():
+    store = GeometryStore.from_entities(square(0, 0, 10, jitter=0.01))
+    profiles = find_profiles(store, tolerance=1e-3)
+    assert profiles.loop_count() == 0
+
+
+def test_closed_entities_chains_and_dangling():
+    entities = square(0, 0, 10) + [
+        Circle('0', None, (5, 5), 2),
+        LWPolyline('0', None, [(20, 0, 0), (30, 0, 1), (30, 5, 0)], True),
+        # An open chain of a line and an arc
+        Line('0', None, (40, 0), (50, 0)),
+        Arc('0', None, (50, 5), 5, 270, 90),
+        # A zero-length line
+        Line('0', None, (60, 60), (60, 60)),
+    ]
+    store = GeometryStore.from_entities(entities)
+    profiles = find_profiles(store)
+
+    assert profiles.loop_count() == 3
+    assert profiles.chain_count() == 1
+    chain = np.flatnonzero(~profiles.closed)[0]
+    assert by_kind(profiles, chain) == [(LINE, 4), (ARC, 0)]
+    vertices = profiles.profile(chain)
+    assert len(vertices) == 3
+    # The arc stays exact, as a half circle bulge
+    np.testing.assert_allclose(np.abs(vertices[:, 2]), [0, 1, 0], atol=1e-9)
+    # Every entity outside the loops is dangling, chains included
+    assert sorted(map(tuple, profiles.dangling.tolist())) == [(LINE, 4), (LINE, 5), (ARC, 0)]
+    circle = [i for i in range(len(profiles)) if by_kind(profiles, i) == [(CIRCLE, 0)]]
+    assert len(circle) == 1 and profiles.closed[circle[0]]
+
+
+def test_tail_on_a_loop_is_cut_off():
+    # A line sticking out of a corner belongs to no loop
+    entities = square(0, 0, 10) + [Line('0', None, (10, 10), (15, 15))]
+    profiles = find_profiles(GeometryStore.from_entities(entities))
+    assert profiles.loop_count() == 1
+    loop = np.flatnonzero(profiles.closed)[0]
+    assert (LINE, 4) not in by_kind(profiles, loop)
+    assert (LINE, 4) in map(tuple, profiles.dangling.tolist())
+
+
+def test_layers_follow_the_first_entity():
+    entities = square(0, 0, 10, layer='CUT') + square(20, 0, 5, layer='HOLES')
+    store = GeometryStore.from_entities(entities)
+    profiles = find_profiles(store)
+    layers = sorted(store.layers[k] for k in profiles.layers.tolist())
+    assert layers == ['CUT', 'HOLES']
@@ -0,0 +1,67 @@
+import numpy as np
+
+from dxf_stream import Arc, Circle, Line
+from geometry_store import GeometryStore
+from tessellate import segment_counts, tessellate_runs, tessellate_store
+
+
+def chord_errors(points, center, radius):
+    # How far the middle of every chord between consecutive points is from the circle
+    middles = (points[1:] + points[:-1]) / 2
+    return radius - np.hypot(*(middles - center).T)
+
+
+def test_segment_counts_follow_the_tolerance():
+    counts = segment_counts([1.0, 100.0, 100.0], [np.pi, np.pi, np.pi], tolerance=0.01)
+    assert counts[0] < counts[1]
+    # Steps never exceed 90 degrees, however large the tolerance
+    assert segment_counts([1.0], [2 * np.pi], tolerance=10.0)[0] == 4
+    # Each chord spans at most 2 acos(1 - tolerance / r)
+    assert counts[1] == np.ceil(np.pi / (2 * np.arccos(1 - 0.01 / 100)))
+
+
+def test_bulge_runs():
+    # An open run: half circle from (0, 0) to (2, 0) below the chord, then a straight segment
+    vertices = np.array([(0, 0, 1.0), (2, 0, 0.0), (2, 3, 0.0),
+                         # A closed square, one side bulged outwards by a quarter circle
+                         (10, 0, 0.0), (12, 0, np.tan(np.pi / 8)), (12, 2, 0.0), (10, 2, 0.0)])
+    offsets = np.array([0, 3, 7])
+    points, point_offsets = tessellate_runs(vertices, offsets, [False, True], tolerance=1e-3)
+
+    first = points[point_offsets[0]:point_offsets[1]]
+    np.testing.assert_allclose(first[0], (0, 0))
+    np.testing.assert_allclose(first[-2:], [(2, 0), (2, 3)])
+    arc = first[:-1]
+    np.testing.assert_allclose(np.hypot(*(arc - (1, 0)).T), 1)
+    # A positive bulge turns counter-clockwise, from (0, 0) through (1, -1)
+    assert arc[:, 1].min() < -0.99
+    assert chord_errors(arc, (1, 0), 1).max() <= 1e-3
+
+    second = points[point_offsets[1]:point_offsets[2]]
+    # Closed runs do not repeat their first point
+    np.testing.assert_allclose(second[0], (10, 0))
+    np.testing.assert_allclose(second[-1], (10, 2))
+    bulged = second[1:-1]
+    np.testing.assert_allclose(bulged[[0, -1]], [(12, 0), (12, 2)])
+    np.testing.assert_allclose(np.hypot(*(bulged - (11, 1)).T), np.sqrt(2))
+
+
+def test_empty_runs():
+    points, offsets = tessellate_runs(np.array([(1, 1, 0.0), (2, 2, 0.0)]), np.array([0, 0, 2, 2]),
+                                      [True, False, True])
+    np.testing.assert_array_equal(offsets, [0, 0, 2, 2])
+    np.testing.assert_array_equal(points, [(1, 1), (2, 2)])
+
+
+def test_store_entities():
+    store = GeometryStore.from_entities([Line('0', None, (0, 0), (1, 0)), Circle('0', None, (5, 5), 2),
+                                         Arc('0', None, (0, 0), 10, 0, 90)])
+    points, offsets, closed, sources = tessellate_store(store, tolerance=1e-2)
+    np.testing.assert_array_equal(closed, [False, True, False])
+    np.testing.assert_array_equal(sources, [(0, 0), (1, 0), (2, 0)])
+    np.testing.assert_array_equal(points[:2], [(0, 0), (1, 0)])
+    ring = points[offsets[1]:offsets[2]]
+    np.testing.assert_allclose(np.hypot(*(ring - (5, 5)).T), 2)
+    assert chord_errors(np.vstack((ring, ring[:1])), (5, 5), 2).max() <= 1e-2
+    arc = points[offsets[2]:offsets[3]]
+    np.testing.assert_allclose(arc[[0, -1]], [(10, 0), (0, 10)], atol=1e-12)
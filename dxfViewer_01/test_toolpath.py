@@ -0,0 +1,63 @@
+import numpy as np
+
+from containment import profile_parents
+from dxf_stream import Circle, Line
+from geometry_store import GeometryStore
+from profile_engine import find_profiles
+from tessellate import tessellate_runs
+from toolpath import plan_toolpath, sequenced, travel
+
+
+def square(x, y, size):
+    corners = [(x, y), (x + size, y), (x + size, y + size), (x, y + size)]
+    return [Line('0', None, a, b) for a, b in zip(corners, corners[1:] + corners[:1])]
+
+
+def plan(entities, origin=None):
+    profiles = find_profiles(GeometryStore.from_entities(entities))
+    points, offsets = tessellate_runs(profiles.vertices, profiles.offsets, profiles.closed)
+    parents = profile_parents(points, offsets, profiles.closed)
+    return profiles, parents, plan_toolpath(profiles.vertices, profiles.offsets, profiles.closed, parents, origin)
+
+
+def test_holes_are_cut_before_their_outline():
+    # Two parts with two holes each, and a hole in a hole
+    entities = square(0, 0, 50) + square(100, 0, 50)
+    entities += [Circle('0', None, (10, 10), 3), Circle('0', None, (40, 40), 3), Circle('0', None, (110, 10), 3)]
+    entities += square(120, 20, 20) + [Circle('0', None, (130, 30), 2)]
+    profiles, parents, toolpath = plan(entities)
+
+    order = toolpath.order.tolist()
+    assert sorted(order) == list(range(len(profiles)))
+    position = {profile: k for k, profile in enumerate(order)}
+    for child, parent in enumerate(parents.tolist()):
+        if parent >= 0:
+            assert position[child] < position[parent]
+    # Children are cut one after the other, right before their parent
+    outline = int(np.flatnonzero(parents == -1)[0])
+    children = np.flatnonzero(parents == outline)
+    assert sorted(position[c] for c in children) == list(range(position[outline] - len(children), position[outline]))
+
+
+def test_planned_travel_is_no_longer():
+    rng = np.random.default_rng(3)
+    entities = [Circle('0', None, tuple(xy), 1) for xy in rng.uniform(0, 500, (200, 2))]
+    profiles, parents, toolpath = plan(entities, origin=(0, 0))
+    assert toolpath.origin == (0.0, 0.0)
+    assert toolpath.travel_after <= toolpath.travel_before
+    np.testing.assert_allclose(
+        travel(profiles.vertices, profiles.offsets, profiles.closed, toolpath.order, toolpath.starts,
+               toolpath.reversed, toolpath.origin),
+        toolpath.travel_after)
+
+
+def test_sequenced_rotates_loops_and_reverses_chains():
+    # A square pierced near its upper right corner, then a chain cut from its far end
+    entities = square(0, 0, 10) + [Line('0', None, (100, 100), (50, 50)), Line('0', None, (50, 50), (40, 10))]
+    profiles, parents, toolpath = plan(entities, origin=(12, 12))
+    result = sequenced(profiles, toolpath)
+
+    np.testing.assert_array_equal(result.closed, [True, False])
+    np.testing.assert_allclose(result.profile(0)[0, :2], (10, 10))
+    assert len(result.profile(0)) == 4
+    np.testing.assert_allclose(result.profile(1)[:, :2], [(40, 10), (50, 50), (100, 100)])
@@ -0,0 +1,188 @@
+import math
+from collections import OrderedDict
+
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, QRectF, QThread, Qt, pyqtSignal
+from PyQt5.QtGui import QImage, QPainter, QTransform
+
+from interactable_path_item import draw_render_command
+
+
+DEFAULT_TILE_SIZE = 256
+DEFAULT_MEMORY_BUDGET = 64 * 1024 * 1024
+# Bookkeeping charged for tiles with nothing to draw, which keep no image
+EMPTY_TILE_BYTES = 256
+
+
+def zoom_key(transform):
+    # Tiles are only reusable under the same view transform, ignoring the
+    # scroll translation. Values are rounded so repeated wheel steps that
+    # land on the same zoom share their tiles.
+    return tuple(float('%.6g' % v) for v in (transform.m11(), transform.m12(), transform.m21(), transform.m22()))
+
+
+def tile_range(rect, tile_size):
+    # Tile columns and rows (inclusive) covering rect in zoom space
+    return (math.floor(rect.left() / tile_size), math.floor(rect.top() / tile_size),
+            math.ceil(rect.right() / tile_size) - 1, math.ceil(rect.bottom() / tile_size) - 1)
+
+
+def _image_bytes(image):
+    return image.sizeInBytes() if image is not None else EMPTY_TILE_BYTES
+
+
+class _TileSignals(QObject):
+    finished = pyqtSignal(object, int, object)
+
+
+class _TileJob(QRunnable):
+    # Rasterizes a snapshot of render commands into one tile. Only plain
+    # value types (paths, pens, transforms) cross into the worker thread, as
+    # copies of the items' own (see detach_render_command); the scene and its
+    # items are never touched here.
+
+    def __init__(self, key, job_id, tile_size, commands, signals):
+        super().__init__()
+        self.key = key
+        self.job_id = job_id
+        self.tile_size = tile_size
+        self.commands = commands
+        self.signals = signals
+
+    def run(self):
+        image = QImage(self.tile_size, self.tile_size, QImage.Format_ARGB32_Premultiplied)
+        image.fill(Qt.transparent)
+        painter = QPainter(image)
+        for transform, command in self.commands:
+            painter.setTransform(transform)
+            draw_render_command(painter, command)
+        painter.end()
+        self.signals.finished.emit(self.key, self.job_id, image)
+
+
+class TileCache(QObject):
+    # Rasterized tiles of the static scene geometry, keyed by
+    # (zoom key, column, row) in zoom space, i.e. scene coordinates mapped
+    # by the view transform without its scroll offset. Tiles are rendered on
+    # a thread pool and evicted least recently used first once the images
+    # exceed the memory budget. Invalidated tiles stay drawable, flagged
+    # stale, until their replacement arrives so edits never flash blank.
+
+    tileReady = pyqtSignal(object)
+
+    def __init__(self, tile_size=DEFAULT_TILE_SIZE, memory_budget=DEFAULT_MEMORY_BUDGET, parent=None):
+        super().__init__(parent)
+        self.tile_size = tile_size
+        self.memory_budget = memory_budget
+        self._tiles = OrderedDict()  # key -> [image or None when empty, stale]
+        self._transforms = {}  # zoom key -> zoom transform
+        self._pending = {}  # key -> job id
+        self._next_job = 0
+        self._bytes = 0
+        self._pool = QThreadPool(self)
+        self._pool.setMaxThreadCount(max(1, QThread.idealThreadCount() - 1))
+        self._signals = _TileSignals(self)
+        self._signals.finished.connect(self._onFinished)
+
+    def __len__(self):
+        return len(self._tiles)
+
+    def nbytes(self):
+        return self._bytes
+
+    def pendingCount(self):
+        return len(self._pending)
+
+    def contains(self, key):
+        return key in self._tiles
+
+    def tile(self, key):
+        # (image, stale) of a cached tile, image being None for empty tiles,
+        # or None when the tile has not been rendered yet
+        entry = self._tiles.get(key)
+        if entry is None:
+            return None
+        self._tiles.move_to_end(key)
+        return entry[0], entry[1]
+
+    def peek(self, key):
+        # Like tile() without counting as a use, for placeholders
+        entry = self._tiles.get(key)
+        return entry[0] if entry is not None else None
+
+    def isPending(self, key):
+        return key in self._pending
+
+    def tileRect(self, key):
+        # Scene rect covered by a tile
+        zoom, i, j = key
+        size = self.tile_size
+        inverse, _ = self._transforms[zoom].inverted()
+        return inverse.mapRect(QRectF(i * size, j * size, size, size))
+
+    def request(self, key, zoom, commands, priority=0):
+        # Queues the rendering of a tile from render commands snapshot on the
+        # GUI thread: (item to zoom space transform, command) pairs
+        self._transforms[key[0]] = zoom
+        job_id = self._next_job
+        self._next_job += 1
+        self._pending[key] = job_id
+        if not commands:
+            # Nothing to draw, no need to go through a worker
+            self._onFinished(key, job_id, None)
+            return
+        size = self.tile_size
+        offset = QTransform.fromTranslate(-key[1] * size, -key[2] * size)
+        commands = [(transform * offset, command) for transform, command in commands]
+        self._pool.start(_TileJob(key, job_id, size, commands, self._signals), priority)
+
+    def invalidate(self, rect=None):
+        # Flags the tiles touching a scene rect as stale, everything when rect
+        # is None, and forgets the jobs still rendering them
+        if rect is None:
+            for entry in self._tiles.values():
+                entry[1] = True
+            self._pending.clear()
+            return
+        for zoom, transform in self._transforms.items():
+            i0, j0, i1, j1 = tile_range(transform.mapRect(rect), self.tile_size)
+            if (i1 - i0 + 1) * (j1 - j0 + 1) > len(self._tiles) + len(self._pending):
+                keys = [k for k in list(self._tiles) + list(self._pending)
+                        if k[0] == zoom and i0 <= k[1] <= i1 and j0 <= k[2] <= j1]
+            else:
+                keys = [(zoom, i, j) for i in range(i0, i1 + 1) for j in range(j0, j1 + 1)]
+            for key in keys:
+                entry = self._tiles.get(key)
+                if entry is not None:
+                    entry[1] = True
+                self._pending.pop(key, None)
+
+    def clear(self):
+        self._tiles.clear()
+        self._transforms.clear()
+        self._pending.clear()
+        self._bytes = 0
+
+    def _onFinished(self, key, job_id, image):
+        if self._pending.get(key) != job_id:
+            # Invalidated or cleared while rendering
+            return
+        del self._pending[key]
+        old = self._tiles.pop(key, None)
+        if old is not None:
+            self._bytes -= _image_bytes(old[0])
+        self._tiles[key] = [image, False]
+        self._bytes += _image_bytes(image)
+        self._evict()
+        self.tileReady.emit(key)
+
+    def _evict(self):
+        if self._bytes <= self.memory_budget:
+            return
+        while self._bytes > self.memory_budget and len(self._tiles) > 1:
+            _, (image, _) = self._tiles.popitem(last=False)
+            self._bytes -= _image_bytes(image)
+        # Forget zoom levels that no longer have any tile
+        zooms = {key[0] for key in self._tiles} | {key[0] for key in self._pending}
+        for zoom in list(self._transforms):
+            if zoom not in zooms:
+                del self._transforms[zoom]
@@ -0,0 +1,474 @@
+import math
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from box_index import BoxIndex
+from profile_engine import ProfileSet
+
+# Cut order for the profiles of a drawing. Profiles inside a closed loop
+# (holes, and anything else whose first point lies in it) are cut before
+# the loop, so a part never drops out of the sheet before its holes are
+# done. Every group of profiles sharing a parent is routed from where the
+# head is when the group starts: a nearest neighbour tour over the centres
+# of the profiles, found with a grid of cells, improved by 2-opt and Or-opt
+# moves between each centre and its nearest neighbours. Loops are then
+# pierced at the vertex nearest the head and open chains are started from
+# their nearer end.
+#
+#   parents = profile_parents(points, offsets, closed)
+#   toolpath = plan_toolpath(profiles.vertices, profiles.offsets, profiles.closed, parents)
+#   print(toolpath.travel_before, toolpath.travel_after)
+
+# Neighbours each centre is tried against in the improvement passes
+NEIGHBOURS = 8
+# Groups up to TINY_GROUP are improved by trying every move in plain
+# Python, up to SMALL_GROUP neighbour lists come from a distance matrix
+TINY_GROUP = 12
+SMALL_GROUP = 64
+# Segment lengths moved by Or-opt, and the neighbours of their ends tried
+OR_OPT_LENGTHS = (1, 2, 3)
+OR_OPT_NEIGHBOURS = 5
+
+# order      (P,) profile indices in cut order
+# starts     (P,) vertex the cut starts at, within each profile (not in cut order)
+# reversed   (P,) bool, open chains cut from their last vertex to their first
+# origin     (x, y) where the head starts
+# travel_before, travel_after  rapid travel in the original and the planned order
+Toolpath = namedtuple('Toolpath', 'order starts reversed origin travel_before travel_after seconds')
+
+
+def plan_toolpath(vertices, offsets, closed, parents, origin=None):
+    # parents (P,) from containment.profile_parents, origin is where the
+    # head starts, the lower left corner of the drawing by default
+    start_time = time.perf_counter()
+    xy = np.asarray(vertices, dtype=np.float64)[:, :2]
+    offsets = np.asarray(offsets, dtype=np.int64)
+    closed = np.asarray(closed, dtype=bool)
+    count = len(offsets) - 1
+    starts = np.zeros(count, dtype=np.int64)
+    reversed_ = np.zeros(count, dtype=bool)
+    if origin is None:
+        origin = xy.min(axis=0) if len(xy) else np.zeros(2)
+    origin = (float(origin[0]), float(origin[1]))
+    lengths = np.diff(offsets)
+    ids = np.flatnonzero(lengths > 0)
+    before = travel(xy, offsets, closed, ids, starts, reversed_, origin)
+    if not len(ids):
+        return Toolpath(ids, starts, reversed_, origin, before, before, time.perf_counter() - start_time)
+
+    lo = np.column_stack((np.minimum.reduceat(xy[:, 0], offsets[ids]), np.minimum.reduceat(xy[:, 1], offsets[ids])))
+    hi = np.column_stack((np.maximum.reduceat(xy[:, 0], offsets[ids]), np.maximum.reduceat(xy[:, 1], offsets[ids])))
+    centres = np.zeros((count, 2))
+    centres[ids] = (lo + hi) / 2
+
+    # Children of every profile, and of the sheet (-1) for the top level ones.
+    # A parent is always larger than its children so this is a tree.
+    parents = np.asarray(parents, dtype=np.int64)[ids]
+    order = np.argsort(parents, kind='stable')
+    keys, first = np.unique(parents[order], return_index=True)
+    groups = dict(zip(keys.tolist(), np.split(ids[order], first[1:])))
+    sequence = []
+
+    def cut_group(members, head):
+        # Cuts members and everything inside them, returns where the head ends
+        for profile in _route(centres, members, head).tolist():
+            children = groups.get(profile)
+            if children is not None:
+                head = cut_group(children, head)
+            head = _cut(xy, offsets, closed, profile, head, starts, reversed_)
+            sequence.append(profile)
+        return head
+
+    cut_group(groups.get(-1, np.zeros(0, dtype=np.int64)), origin)
+    order = np.array(sequence, dtype=np.int64)
+    after = travel(xy, offsets, closed, order, starts, reversed_, origin)
+    return Toolpath(order, starts, reversed_, origin, before, after, time.perf_counter() - start_time)
+
+
+def travel(xy, offsets, closed, order, starts, reversed_, origin=(0.0, 0.0)):
+    # Length of the rapid moves from origin through the profiles order
+    begin, end = rapid_moves(xy, offsets, closed, order, starts, reversed_, origin)
+    return float(np.hypot(*(end - begin).T).sum())
+
+
+def rapid_moves(xy, offsets, closed, order, starts, reversed_, origin=(0.0, 0.0)):
+    # (M, 2) start and end points of the moves from origin through the
+    # profiles order, each entered at its start vertex and left at its last
+    # (the start again for loops)
+    xy = np.asarray(xy, dtype=np.float64)[:, :2]
+    order = np.asarray(order, dtype=np.int64)
+    if not len(order):
+        return np.zeros((0, 2)), np.zeros((0, 2))
+    first, last = offsets[order], offsets[order + 1] - 1
+    loop = closed[order]
+    back = reversed_[order] & ~loop
+    entry = np.where(loop, first + starts[order], np.where(back, last, first))
+    leave = np.where(loop, entry, np.where(back, first, last))
+    return np.vstack((np.asarray(origin, dtype=np.float64)[None, :], xy[leave[:-1]])), xy[entry]
+
+
+def _cut(xy, offsets, closed, profile, head, starts, reversed_):
+    # Chooses where the profile is entered from head, returns where it leaves
+    first, end = int(offsets[profile]), int(offsets[profile + 1])
+    hx, hy = head
+    if closed[profile]:
+        run = xy[first:end]
+        k = int(np.argmin((run[:, 0] - hx) ** 2 + (run[:, 1] - hy) ** 2))
+        starts[profile] = k
+        return float(run[k, 0]), float(run[k, 1])
+    (x0, y0), (x1, y1) = xy[first].tolist(), xy[end - 1].tolist()
+    if (x1 - hx) ** 2 + (y1 - hy) ** 2 < (x0 - hx) ** 2 + (y0 - hy) ** 2:
+        reversed_[profile] = True
+        return x0, y0
+    return x1, y1
+
+
+def _route(centres, ids, head):
+    # ids in the order they are visited from head
+    ids = np.asarray(ids, dtype=np.int64)
+    return ids[_visit(centres[ids], head)]
+
+
+def _visit(xy, head):
+    # Order in which the points xy are visited from head
+    if len(xy) < 3:
+        d = np.hypot(*(xy - head).T)
+        return np.argsort(d, kind='stable')
+    unique, inverse = np.unique(xy, axis=0, return_inverse=True)
+    if len(unique) < len(xy):
+        # Stacked copies are visited together, and would crowd the neighbour lists
+        rank = np.empty(len(unique), dtype=np.int64)
+        rank[_visit(unique, head)] = np.arange(len(unique))
+        return np.argsort(rank[inverse.ravel()], kind='stable')
+    # Node 0 is the head, fixed at the start of the open tour
+    points = np.vstack((np.asarray(head, dtype=np.float64)[None, :], xy))
+    if len(points) <= SMALL_GROUP:
+        d = np.hypot(*(points[:, None, :] - points[None, :, :]).transpose(2, 0, 1))
+        tour = _nearest_neighbour_small(d)
+        if len(points) <= TINY_GROUP:
+            return _improve_tiny(d, tour)[1:] - 1
+        neighbours = np.argsort(d, axis=1)[:, 1:NEIGHBOURS + 1]
+    else:
+        neighbours = _grid_neighbours(points, NEIGHBOURS)
+        tour = _nearest_neighbour(points)
+    return _improve(points, tour, neighbours)[1:] - 1
+
+
+def _nearest_neighbour_small(d):
+    d = d.copy()
+    tour = [0]
+    d[:, 0] = np.inf
+    for _ in range(len(d) - 1):
+        k = int(np.argmin(d[tour[-1]]))
+        tour.append(k)
+        d[:, k] = np.inf
+    return np.array(tour, dtype=np.int64)
+
+
+def _improve_tiny(d, tour):
+    # Every 2-opt and Or-opt move until none helps, on a distance matrix.
+    # A free end node closes the open tour so both its ends stay put.
+    n = len(d)
+    d = np.pad(d, ((0, 1), (0, 1))).tolist()
+    t = tour.tolist() + [n]
+    m = len(t)
+    improved = True
+    while improved:
+        improved = False
+        for i in range(m - 3):
+            for j in range(i + 2, m - 1):
+                a, b, c, e = t[i], t[i + 1], t[j], t[j + 1]
+                if d[a][b] + d[c][e] - d[a][c] - d[b][e] > 1e-12:
+                    t[i + 1:j + 1] = t[i + 1:j + 1][::-1]
+                    improved = True
+        for length in OR_OPT_LENGTHS:
+            for i in range(1, m - length):
+                j = i + length - 1
+                p, first, last, s = t[i - 1], t[i], t[j], t[j + 1]
+                removed = d[p][first] + d[last][s] - d[p][s]
+                for w in range(m - 1):
+                    if i - 1 <= w <= j:
+                        continue
+                    u, v = t[w], t[w + 1]
+                    forward = d[u][first] + d[last][v] - d[u][v]
+                    backward = d[u][last] + d[first][v] - d[u][v]
+                    if removed - min(forward, backward) > 1e-12:
+                        segment = t[i:j + 1] if forward <= backward else t[i:j + 1][::-1]
+                        rest = t[:i] + t[j + 1:]
+                        at = rest.index(u) + 1
+                        t = rest[:at] + segment + rest[at:]
+                        improved = True
+                        break
+    return np.array(t[:-1], dtype=np.int64)
+
+
+def _nearest_neighbour(points):
+    # Greedy tour from point 0, the nearest unvisited point found by
+    # searching rings of grid cells outwards. The grid is rebuilt coarser
+    # whenever half of the points it holds are visited, so the rings stay
+    # short as the drawing empties.
+    xs, ys = points[:, 0].tolist(), points[:, 1].tolist()
+    remaining = np.arange(1, len(points))
+    tour = [0]
+    x, y = xs[0], ys[0]
+    while len(remaining):
+        # Sized over the head too, or the last few points would sit in cells
+        # far too small for the ring search to reach them
+        spread = np.vstack((points[remaining], (x, y)))
+        extent = max(float(np.ptp(spread[:, 0])), float(np.ptp(spread[:, 1])), 1e-9)
+        size = extent / math.sqrt(len(remaining)) * 2
+        cells = {}
+        keys = np.floor(points[remaining] / size).astype(np.int64)
+        for key, i in zip(map(tuple, keys.tolist()), remaining.tolist()):
+            cells.setdefault(key, set()).add(i)
+        left = len(remaining)
+        rebuild = left // 2
+        while left > rebuild:
+            cx, cy = math.floor(x / size), math.floor(y / size)
+            best, best_d = -1, math.inf
+            r = 0
+            while best < 0 or (r - 1) * size < best_d:
+                for key in _ring(cx, cy, r):
+                    for i in cells.get(key, ()):
+                        dd = math.hypot(xs[i] - x, ys[i] - y)
+                        if dd < best_d:
+                            best, best_d = i, dd
+                r += 1
+            key = (math.floor(xs[best] / size), math.floor(ys[best] / size))
+            cell = cells[key]
+            cell.discard(best)
+            if not cell:
+                del cells[key]
+            tour.append(best)
+            x, y = xs[best], ys[best]
+            left -= 1
+        remaining = np.array([i for cell in cells.values() for i in cell], dtype=np.int64)
+    return np.array(tour, dtype=np.int64)
+
+
+def _ring(cx, cy, r):
+    # Cells at Chebyshev distance r from (cx, cy)
+    if r == 0:
+        yield cx, cy
+        return
+    for dx in range(-r, r + 1):
+        yield cx + dx, cy - r
+        yield cx + dx, cy + r
+    for dy in range(-r + 1, r):
+        yield cx - r, cy + dy
+        yield cx + r, cy + dy
+
+
+def _grid_neighbours(points, k):
+    # (N, k) ids of about the k nearest other points of each point, -1 where
+    # fewer are found. Pairs closer than a radius that holds about 2k points
+    # at the average density are listed with a BoxIndex and the nearest k
+    # kept; the radius is shrunk first where clustering would list too many.
+    n = len(points)
+    extent = np.ptp(points, axis=0)
+    radius = math.sqrt(max(extent[0] * extent[1], max(extent.max(), 1e-9) ** 2 / n) * 2 * k / (math.pi * n))
+    for _ in range(8):
+        _, counts = np.unique(np.floor(points / radius).astype(np.int64), axis=0, return_counts=True)
+        pairs = 9 * float((counts.astype(np.float64) ** 2).sum())
+        if pairs <= 16 * k * n:
+            break
+        radius /= math.sqrt(pairs / (16 * k * n))
+    boxes = np.hstack((points - radius, points + radius))
+    index = BoxIndex(boxes, cell_size=radius * 2)
+    a, b = index.query_points(points)
+    keep = a != b
+    a, b = a[keep], b[keep]
+    d = np.hypot(*(points[a] - points[b]).T)
+    order = np.lexsort((d, a))
+    a, b = a[order], b[order]
+    group_start = np.searchsorted(a, np.arange(n))
+    rank = np.arange(len(a)) - group_start[a]
+    keep = rank < k
+    neighbours = np.full((n, k), -1, dtype=np.int64)
+    neighbours[a[keep], rank[keep]] = b[keep]
+    return neighbours
+
+
+def _improve(points, tour, neighbours, rounds=100):
+    # 2-opt and Or-opt on the open tour starting at node 0, only trying
+    # moves that join a node to one of its neighbours. Every round scores
+    # the moves of the nodes near the last changes at once, then applies
+    # the improving ones best first, each checked again against the tour
+    # as it is by then.
+    n = len(tour)
+    tour = np.asarray(tour, dtype=np.int64).copy()
+    pos = np.empty(n, dtype=np.int64)
+    pos[tour] = np.arange(n)
+    xs, ys = points[:, 0].tolist(), points[:, 1].tolist()
+    extent = float(np.ptp(points, axis=0).max()) if n else 0.0
+    path = _Path(tour, pos, xs, ys, 1e-9 * max(extent, 1.0))
+    columns = np.ascontiguousarray(points[:, 0]), np.ascontiguousarray(points[:, 1])
+    active = np.arange(n)
+    for _ in range(rounds):
+        touched = []
+        for moves, apply in ((_two_opt_moves, path.two_opt), (_or_opt_moves, path.or_opt)):
+            gain, candidates = moves(columns, tour, pos, neighbours, active)
+            better = np.flatnonzero(gain > path.tolerance)
+            for m in better[np.argsort(-gain[better], kind='stable')].tolist():
+                changed = apply(*candidates[m].tolist())
+                if changed:
+                    touched.extend(changed)
+        if not touched:
+            break
+        touched = np.unique(np.array(touched, dtype=np.int64))
+        active = np.unique(np.concatenate((touched, neighbours[touched].ravel())))
+        active = active[active >= 0]
+    return tour
+
+
+def _distance(points, a, b):
+    # points as separate x and y arrays, much cheaper to gather from
+    x, y = points
+    return np.hypot(x[a] - x[b], y[a] - y[b])
+
+
+def _edges(points, tour):
+    # Length of the edge leaving each position, zero past the open end
+    e = np.zeros(len(tour))
+    e[:-1] = _distance(points, tour[:-1], tour[1:])
+    return e
+
+
+def _two_opt_moves(points, tour, pos, neighbours, active):
+    # Gains of replacing the edges leaving positions p < q by (p, q) and
+    # (p + 1, q + 1), reversing the tour between them, for edges next to an
+    # active node and each of its neighbours. Moves are given by the nodes
+    # at p and q.
+    n = len(tour)
+    k = neighbours.shape[1]
+    a = np.repeat(active, k)
+    c = neighbours[active].ravel()
+    a, c = a[c >= 0], c[c >= 0]
+    lo, hi = np.minimum(pos[a], pos[c]), np.maximum(pos[a], pos[c])
+    p, q = np.concatenate((lo, lo - 1)), np.concatenate((hi, hi - 1))
+    keep = (p >= 0) & (q > p + 1)
+    p, q = p[keep], q[keep]
+    e = _edges(points, tour)
+    q1 = np.minimum(q + 1, n - 1)
+    gain = e[p] + e[q] - _distance(points, tour[p], tour[q]) - np.where(q == n - 1, 0.0, _distance(
+        points, tour[p + 1], tour[q1]))
+    return gain, np.column_stack((tour[p], tour[q]))
+
+
+def _or_opt_moves(points, tour, pos, neighbours, active):
+    # Gains of moving the segment tour[i..j] of up to three nodes, starting
+    # at an active node, into the edge leaving position w next to a
+    # neighbour of either end of the segment, turned round when that is
+    # shorter. Moves are given by the nodes at i, j and w.
+    n = len(tour)
+    e = _edges(points, tour)
+    gains, candidates = [], []
+    neighbours = neighbours[:, :OR_OPT_NEIGHBOURS]
+    starts = pos[active]
+    starts = starts[starts >= 1]
+    for length in OR_OPT_LENGTHS:
+        i = starts[starts + length - 1 <= n - 1]
+        if not len(i):
+            continue
+        j = i + length - 1
+        j1 = np.minimum(j + 1, n - 1)
+        removed = e[i - 1] + e[j] - np.where(j == n - 1, 0.0, _distance(points, tour[i - 1], tour[j1]))
+        c = np.hstack((neighbours[tour[i]], neighbours[tour[j]]))
+        w = np.hstack((pos[np.maximum(c, 0)], pos[np.maximum(c, 0)] - 1))
+        valid = np.hstack((c >= 0, c >= 0)) & (w >= 0) & ((w < i[:, None] - 1) | (w > j[:, None]))
+        w = np.where(valid, w, 0)
+        w1 = np.minimum(w + 1, n - 1)
+        ti, tj = tour[i][:, None], tour[j][:, None]
+        joined = np.where(w == n - 1, 0.0, -e[w])
+        forward = _distance(points, tour[w], ti) + np.where(w == n - 1, 0.0, _distance(points, tj, tour[w1])) + joined
+        backward = _distance(points, tour[w], tj) + np.where(w == n - 1, 0.0, _distance(points, ti, tour[w1])) + joined
+        added = np.where(valid, np.minimum(forward, backward), np.inf)
+        best = np.argmin(added, axis=1)
+        rows = np.arange(len(i))
+        gains.append(removed - added[rows, best])
+        candidates.append(np.column_stack((tour[i], tour[j], tour[w[rows, best]])))
+    if not gains:
+        return np.zeros(0), np.zeros((0, 3), dtype=np.int64)
+    return np.concatenate(gains), np.concatenate(candidates)
+
+
+class _Path:
+    # The open tour being improved, moves applied one at a time after
+    # checking they still shorten it
+
+    def __init__(self, tour, pos, xs, ys, tolerance):
+        self.tour = tour
+        self.pos = pos
+        self.xs = xs
+        self.ys = ys
+        self.tolerance = tolerance
+        self.n = len(tour)
+
+    def dist(self, a, b):
+        # Past the open end (-1) everything is free
+        if a < 0 or b < 0:
+            return 0.0
+        return math.hypot(self.xs[a] - self.xs[b], self.ys[a] - self.ys[b])
+
+    def node(self, i):
+        return int(self.tour[i]) if i < self.n else -1
+
+    def place(self, lo, hi, nodes):
+        self.tour[lo:hi + 1] = nodes
+        self.pos[nodes] = np.arange(lo, hi + 1)
+
+    def two_opt(self, x, y):
+        # Nodes touched by the 2-opt move after x and y, None if it no longer helps
+        p, q = sorted((int(self.pos[x]), int(self.pos[y])))
+        if q <= p + 1:
+            return None
+        a, b, c, d = self.node(p), self.node(p + 1), self.node(q), self.node(q + 1)
+        if self.dist(a, b) + self.dist(c, d) - self.dist(a, c) - self.dist(b, d) <= self.tolerance:
+            return None
+        self.place(p + 1, q, self.tour[p + 1:q + 1][::-1].copy())
+        return a, b, c, d
+
+    def or_opt(self, first, last, u):
+        # Nodes touched by moving first..last in after u, None if the
+        # segment was broken up or the move no longer helps
+        i, j, w = int(self.pos[first]), int(self.pos[last]), int(self.pos[u])
+        if j < i or j - i >= len(OR_OPT_LENGTHS) or i == 0 or i - 1 <= w <= j:
+            return None
+        p, s, v = self.node(i - 1), self.node(j + 1), self.node(w + 1)
+        removed = self.dist(p, first) + self.dist(last, s) - (self.dist(p, s) if s >= 0 else 0.0)
+        base = self.dist(u, v)
+        forward = self.dist(u, first) + self.dist(last, v) - base
+        backward = self.dist(u, last) + self.dist(first, v) - base
+        if removed - min(forward, backward) <= self.tolerance:
+            return None
+        segment = self.tour[i:j + 1]
+        segment = segment[::-1] if backward < forward else segment
+        if w < i:
+            self.place(w + 1, j, np.concatenate((segment, self.tour[w + 1:i])))
+        else:
+            self.place(i, w, np.concatenate((self.tour[j + 1:w + 1], segment)))
+        return p, s, u, v, first, last
+
+
+def sequenced(profiles, toolpath):
+    # ProfileSet of the profiles in cut order, loops rotated to start at
+    # their pierce vertex and open chains reversed where they are cut backwards
+    result = profiles.take(toolpath.order)
+    lengths = np.diff(result.offsets)
+    if not len(lengths) or not lengths.sum():
+        return result
+    owner = np.repeat(np.arange(len(lengths)), lengths)
+    local = np.arange(lengths.sum()) - result.offsets[owner]
+    shift = toolpath.starts[toolpath.order][owner]
+    back = (toolpath.reversed[toolpath.order] & ~result.closed)[owner]
+    source = np.where(back, lengths[owner] - 1 - local, (local + shift) % lengths[owner]) + result.offsets[owner]
+    vertices = result.vertices[source]
+    # The bulge of a reversed segment starts one vertex earlier and turns the other way
+    previous = np.maximum(source - 1, result.offsets[owner])
+    vertices[back, 2] = -result.vertices[previous[back], 2]
+    last = result.offsets[1:] - 1
+    vertices[last[back[last]], 2] = 0.0
+    return ProfileSet(vertices, result.offsets, result.closed, result.layers, result.edges, result.edge_offsets,
+                      result.dangling)
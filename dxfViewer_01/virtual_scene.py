@@ -0,0 +1,142 @@
+import numpy as np
+from PyQt5.QtCore import QObject, QPointF, QRectF
+
+from box_index import BoxIndex
+from geometry_file import profile_bounds
+from instrumentation import profiler
+from path_builder import build_paths
+
+
+class SceneVirtualizer(QObject):
+    # Keeps InteractablePathItems only for the profiles around the visible
+    # part of the scene. The geometry itself stays in the flattened profile
+    # arrays and a BoxIndex; as the view pans and zooms, items that drift
+    # out of reach are taken out of the scene and reused for profiles coming
+    # into view. The number of live items never exceeds max_items: when more
+    # profiles than that are in view, the largest ones win, the rest would be
+    # a few pixels at most.
+    #
+    # Item positions are remembered per profile while their items are
+    # recycled, so dragged profiles stay where they were put. With hole
+    # owners (see containment.hole_owners) a hole is part of its owner's
+    # item, as in a scene that is not virtualized.
+
+    def __init__(self, scene, profiles, points, offsets, layer_names, make_item,
+                 max_items=20000, margin=0.5, pool_size=2000, owners=None, parent=None):
+        super().__init__(parent)
+        self.scene = scene
+        self.profiles = profiles
+        self.points = points
+        self.point_offsets = offsets
+        self.layer_names = layer_names
+        # make_item(path, closed, layer) builds a new item; an old one is passed
+        # back as item= to be reconfigured instead
+        self.make_item = make_item
+        self.max_items = max_items
+        self.margin = margin
+        self.pool_size = pool_size
+
+        # Profile whose item draws each profile, and the holes of every owner
+        count = len(profiles)
+        owners = np.full(count, -1, dtype=np.int64) if owners is None else np.asarray(owners, dtype=np.int64)
+        self._heads = np.where(owners >= 0, owners, np.arange(count))
+        self._holes = {}
+        for hole, owner in zip(np.flatnonzero(owners >= 0).tolist(), owners[owners >= 0].tolist()):
+            self._holes.setdefault(owner, []).append(hole)
+
+        bounds = profile_bounds(profiles)
+        self.index = BoxIndex(bounds)
+        self._areas = np.nan_to_num((bounds[:, 2] - bounds[:, 0]) * (bounds[:, 3] - bounds[:, 1]))
+        self._positions = np.zeros((len(profiles), 2))
+        self._live = {}  # profile id -> item
+        self._pool = []
+
+        valid = bounds[~np.isnan(bounds).any(axis=1)]
+        if len(valid):
+            rect = QRectF(QPointF(valid[:, 0].min(), valid[:, 1].min()), QPointF(valid[:, 2].max(), valid[:, 3].max()))
+            # The scene rect would otherwise only cover the items alive right now
+            scene.setSceneRect(rect.adjusted(-rect.width() / 2, -rect.height() / 2, rect.width() / 2, rect.height() / 2))
+
+    def __len__(self):
+        return len(self.profiles)
+
+    def liveCount(self):
+        return len(self._live)
+
+    def liveItems(self):
+        return dict(self._live)
+
+    def item(self, i):
+        return self._live.get(i)
+
+    def positions(self):
+        # (P, 2) offset of every profile from where it was detected, holes
+        # moving with their owners
+        positions = self._positions.copy()
+        for i, item in self._live.items():
+            positions[i] = (item.pos().x(), item.pos().y())
+        return positions[self._heads]
+
+    def _wanted(self, rect):
+        # Profiles with an item of their own in reach of rect
+        ids = np.unique(self._heads[self.index.query(rect.left(), rect.top(), rect.right(), rect.bottom())])
+        if len(ids) > self.max_items:
+            ids = ids[np.argsort(-self._areas[ids], kind='stable')[:self.max_items]]
+        return ids
+
+    def update(self, visible_rect):
+        # Brings the live items in line with a visible scene rect
+        with profiler.span('virtualize'):
+            self._update(visible_rect)
+
+    def _update(self, visible_rect):
+        dx, dy = visible_rect.width() * self.margin, visible_rect.height() * self.margin
+        load_rect = visible_rect.adjusted(-dx, -dy, dx, dy)
+        # Items are only dropped once well outside, so small pans back and forth do not churn
+        keep_rect = visible_rect.adjusted(-2 * dx, -2 * dy, 2 * dx, 2 * dy)
+
+        wanted = self._wanted(load_rect)
+        keep = set(self._wanted(keep_rect).tolist())
+        for i in list(self._live):
+            if i not in keep and not self._live[i].isSelected():
+                self._recycle(i)
+
+        wanted = [i for i in wanted.tolist() if i not in self._live]
+        # Selected items are never recycled, so they may push the total over
+        # the budget; everything else stays within it
+        room = self.max_items - len(self._live)
+        if len(wanted) > room:
+            areas = self._areas[wanted]
+            wanted = [wanted[k] for k in np.argsort(-areas, kind='stable')[:max(room, 0)].tolist()]
+        for i in wanted:
+            self._show(i)
+
+    def _show(self, i):
+        # The profile and its holes, built like the paths of a whole drawing
+        ids = [i] + self._holes.get(i, [])
+        runs = [self.points[self.point_offsets[k]:self.point_offsets[k + 1]] for k in ids]
+        offsets = np.cumsum([0] + [len(run) for run in runs])
+        owners = np.array([-1] + [0] * (len(ids) - 1))
+        (path, _), = build_paths(np.concatenate(runs), offsets, self.profiles.closed[ids], owners)
+        closed = bool(self.profiles.closed[i])
+        layer = int(self.profiles.layers[i])
+        layer = self.layer_names[layer] if 0 <= layer < len(self.layer_names) else None
+        if self._pool:
+            item = self.make_item(path, closed, layer, item=self._pool.pop())
+        else:
+            item = self.make_item(path, closed, layer)
+        item.setPos(*self._positions[i])
+        self._live[i] = item
+        self.scene.addItem(item)
+
+    def _recycle(self, i):
+        item = self._live.pop(i)
+        self._positions[i] = (item.pos().x(), item.pos().y())
+        self.scene.removeItem(item)
+        if len(self._pool) < self.pool_size:
+            self._pool.append(item)
+
+    def clear(self):
+        for i in list(self._live):
+            self._recycle(i)
+        self._pool = []